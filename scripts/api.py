@@ -1,13 +1,78 @@
+import gc
 import logging
-from flask import Flask, request, jsonify
-import joblib
+import math
+import threading
+from flask import Flask, Response, request, jsonify, g
 import pandas as pd
 import os
 import numpy as np
-from models_registry import model_registry, dynamic_import
-import sqlite3
+from models_registry import model_registry
+from feature_encoder import build_feature_encoders
 import json
+import io
+from collections import namedtuple
+from datetime import datetime
+from artifact_holder import ArtifactHolder
+from request_log import RequestLogWriter, init_db
+from prediction_cache import PredictionCache
+from similarity_index import load_similarity_index
+from similarity_search import load_neighbour_search, CATEGORICAL_ATTRIBUTES
+from data_preprocessing import load_data, split_valid_rows, NUMERIC_FEATURES
+from model_export import load_artifact, promoted_artifact_dir
+from inference import build_backend
+from micro_batcher import MicroBatcher
+from price_index import PriceIndex
+from shadow_scoring import ShadowScorer, init_shadow_db
+from drift_monitor import DriftMonitor, build_reference
+from metrics import MetricsRegistry, StageTimer, BATCH_SIZE_BUCKETS
 
+# Seconds between two checks of the best model artifact for a new promotion
+MODEL_POLL_INTERVAL = float(os.environ.get('MODEL_POLL_INTERVAL', 5))
+# Seconds between two checks of the training data for changes
+DATA_POLL_INTERVAL = float(os.environ.get('DATA_POLL_INTERVAL', 30))
+# SQLite database of the request log, next to this script unless overridden
+REQUEST_LOG_DB_PATH = os.environ.get('REQUEST_LOG_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_requests.db'))
+# Maximum entries waiting to be written, entries per transaction and seconds between flushes
+REQUEST_LOG_QUEUE_SIZE = int(os.environ.get('REQUEST_LOG_QUEUE_SIZE', 10000))
+REQUEST_LOG_BATCH_SIZE = int(os.environ.get('REQUEST_LOG_BATCH_SIZE', 100))
+REQUEST_LOG_FLUSH_INTERVAL = float(os.environ.get('REQUEST_LOG_FLUSH_INTERVAL', 1.0))
+# 'drop' or 'block' when the request log queue is full
+REQUEST_LOG_FULL_POLICY = os.environ.get('REQUEST_LOG_FULL_POLICY', 'drop')
+# Maximum cached predictions (0 disables the cache) and seconds they stay valid (0 keeps them until evicted)
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 0))
+# Predict with the fast inference backend of the registry entry instead of the model's predict method
+FAST_INFERENCE = os.environ.get('FAST_INFERENCE', '1') != '0'
+# Milliseconds single-row predictions wait to be batched with concurrent ones (0 disables micro-batching),
+# maximum rows per micro-batch, and seconds a request waits for its micro-batch before answering 503
+MICRO_BATCH_WAIT_MS = float(os.environ.get('MICRO_BATCH_WAIT_MS', 0))
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 64))
+MICRO_BATCH_TIMEOUT_S = float(os.environ.get('MICRO_BATCH_TIMEOUT_S', 5))
+# Requests slower than this many milliseconds are logged with their stage breakdown (0 disables the log)
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0))
+# Model store versions of the candidate models scoring the /predict traffic in the background,
+# comma-separated (empty disables shadow scoring)
+SHADOW_MODELS = [version.strip() for version in os.environ.get('SHADOW_MODELS', '').split(',') if version.strip()]
+# Processes scoring the candidates, requests waiting for them before new ones are shed,
+# and share of the /predict requests that are shadow-scored
+SHADOW_WORKERS = int(os.environ.get('SHADOW_WORKERS', 1))
+SHADOW_QUEUE_SIZE = int(os.environ.get('SHADOW_QUEUE_SIZE', 100))
+SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE', 1.0))
+# Rows of each window of the input drift monitor (0 disables it), rows counted before it
+# reports scores, quantile bins of the numeric features in its reference profile, and PSI
+# above which /drift reports a feature
+DRIFT_WINDOW_ROWS = int(os.environ.get('DRIFT_WINDOW_ROWS', 10000))
+DRIFT_MIN_ROWS = int(os.environ.get('DRIFT_MIN_ROWS', 500))
+DRIFT_BINS = int(os.environ.get('DRIFT_BINS', 20))
+DRIFT_PSI_THRESHOLD = float(os.environ.get('DRIFT_PSI_THRESHOLD', 0.2))
+# Set by serve.py: the state is preloaded in the server's master process and
+# the background threads are started in each worker after it is forked
+SERVE_PRELOAD = os.environ.get('SERVE_PRELOAD', '0') == '1'
+
+LoadedModel = namedtuple('LoadedModel', ['model', 'model_name', 'version', 'backend'])
+
+# Diamond predicted by every newly loaded model before it serves requests
+WARM_UP_RECORD = {'carat': 0.7, 'cut': 'Ideal', 'color': 'G', 'clarity': 'VS2', 'depth': 61.8, 'table': 57.0, 'x': 5.7, 'y': 5.72, 'z': 3.53}
 
 
 def get_project_root():
@@ -20,6 +85,102 @@ def get_project_root():
     current_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.abspath(os.path.join(current_dir, os.pardir))
 
+def get_best_model_path(best_model_dir='models/best_model'):
+    """
+    Get the path of the best model artifact.
+
+    Parameters:
+    best_model_dir (str): Directory where the best model is stored.
+
+    Returns:
+    str: The absolute path to the best model file.
+    """
+    project_root = get_project_root()
+    return os.path.join(project_root, best_model_dir, 'best_model.pkl')
+
+def make_loaded_model(model, model_name, version):
+    """
+    Bundle a loaded model with its prediction backend.
+
+    Parameters:
+    model (sklearn model): The loaded model.
+    model_name (str): The registry name of the model.
+    version (str): The version of the model.
+
+    Returns:
+    LoadedModel: The model, its registry name, its version and its prediction backend.
+    """
+    # Models missing from the registry are rejected when predicting
+    backend = build_backend(model, model_name, FAST_INFERENCE) if model_name in model_registry else None
+    return LoadedModel(model, model_name, version, backend)
+
+def load_model_artifact(model_path):
+    """
+    Load a saved model artifact together with its name and version.
+
+    Parameters:
+    model_path (str): Path to the saved model file.
+
+    Returns:
+    LoadedModel: The model, its registry name, its version and its prediction backend.
+    """
+    # A promoted model store artifact is loaded from its export when it has one,
+    # unless best_model.pkl was replaced outside the store since its promotion
+    artifact_dir = promoted_artifact_dir(os.path.dirname(model_path))
+    if artifact_dir is not None:
+        model, metadata = load_artifact(artifact_dir)
+        return make_loaded_model(model, metadata['model_name'], metadata['version'])
+
+    # Only pickled artifacts need joblib, and unpickling imports the libraries of the model
+    import joblib
+
+    with open(model_path, 'rb') as model_file:
+        model, metadata = joblib.load(model_file)
+        modified = datetime.fromtimestamp(os.fstat(model_file.fileno()).st_mtime)
+
+    model_name = metadata.get('model_name', 'unknown')
+    # Artifacts saved before versions were recorded fall back to their mtime
+    version = metadata.get('version') or f"{model_name}_{modified.strftime('%Y-%m-%d_%H-%M-%S')}"
+
+    return make_loaded_model(model, model_name, version)
+
+def warm_up_model(loaded):
+    """
+    Run a dummy prediction through a newly loaded model.
+
+    The first prediction of a model pays for one-off setup, like the booster's
+    thread pool and buffers or the first pass through the encoder's pandas
+    code, so it is made here instead of in the first request.
+
+    Parameters:
+    loaded (LoadedModel): The loaded model.
+
+    Raises:
+    ValueError: If the model is not in the registry or cannot predict the dummy diamond.
+    """
+    df = pd.DataFrame([WARM_UP_RECORD], index=range(1))
+    # Without a version the prediction bypasses the cache
+    predictions, errors = predict_rows(df, loaded.backend, loaded.model_name)
+    if pd.notna(errors.iloc[0]) or not np.isfinite(predictions[0]):
+        raise ValueError(f"Model {loaded.version} failed its warm-up prediction.")
+
+def load_live_model(model_path):
+    """
+    Load the best model artifact and warm it up before it serves requests.
+
+    Parameters:
+    model_path (str): Path to the saved model file.
+
+    Returns:
+    LoadedModel: The model, its registry name, its version and its prediction backend.
+    """
+    loaded = load_model_artifact(model_path)
+    # Under serve.py the master process only loads the model: OpenMP thread
+    # pools do not survive a fork, so each worker warms it up (see warm_up)
+    if not SERVE_PRELOAD:
+        warm_up_model(loaded)
+    return loaded
+
 def load_best_model(best_model_dir='models/best_model'):
     """
     Load the best trained model from the specified directory.
@@ -31,18 +192,27 @@ def load_best_model(best_model_dir='models/best_model'):
     tuple: The best model and its metadata.
     """
 
-    project_root = get_project_root()
-    best_model_dir = os.path.join(project_root, best_model_dir)
-    best_model_path = os.path.join(best_model_dir, 'best_model.pkl')
+    best_model_path = get_best_model_path(best_model_dir)
 
     if not os.path.exists(best_model_path):
         raise FileNotFoundError(f"No best model found in directory: {best_model_path}")
 
-    with open(best_model_path, 'rb') as model_file:
-        model, metadata = joblib.load(model_file)
-        model_name = metadata.get('model_name', 'unknown')
+    loaded = load_model_artifact(best_model_path)
 
-    return model, model_name
+    return loaded.model, loaded.model_name
+
+def get_training_data_path(data_path='data/diamonds.csv'):
+    """
+    Get the path of the training data file.
+
+    Parameters:
+    data_path (str): Path to the training data file, relative to the project root.
+
+    Returns:
+    str: The absolute path to the training data file.
+    """
+    project_root = get_project_root()
+    return os.path.join(project_root, data_path)
 
 def load_training_data(data_path='data/diamonds.csv'):
     """
@@ -54,100 +224,692 @@ def load_training_data(data_path='data/diamonds.csv'):
     Returns:
     pd.DataFrame: Loaded training data.
     """
-    project_root = get_project_root()
-    data_path = os.path.join(project_root, data_path)
+    data_path = get_training_data_path(data_path)
     if not os.path.exists(data_path):
         raise FileNotFoundError(f"Training data not found in directory: {data_path}")
-    return pd.read_csv(data_path)
-
-def init_db():
-    """
-    Initialize the database for logging API requests and responses.
-    """
-    conn = sqlite3.connect('api_requests.db')
-    c = conn.cursor()
-    c.execute('''
-              CREATE TABLE IF NOT EXISTS requests
-              (id INTEGER PRIMARY KEY AUTOINCREMENT,
-              endpoint TEXT,
-              request_data TEXT,
-              response_data TEXT,
-              timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)
-              ''')
-    conn.commit()
-    conn.close()
+    return load_data(data_path)
 
 def save_request_response(endpoint, request_data, response_data):
     """
     Save the API request and response to the database.
 
+    The entry is queued and written by the background request log writer,
+    so logging does not add to the response latency.
+
     Parameters:
     endpoint (str): The API endpoint that was called.
     request_data (dict): The request data sent to the API.
     response_data (dict): The response data returned by the API.
     """
-    conn = sqlite3.connect('api_requests.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO requests (endpoint, request_data, response_data) VALUES (?, ?, ?)', 
-              (endpoint, json.dumps(request_data), json.dumps(response_data)))
-    conn.commit()
-    conn.close()
+    request_log.log(endpoint, request_data, response_data)
 
 app = Flask(__name__)
 
-# Initialize the database
-init_db()
+# Initialize the database of the background request log writer
+init_db(REQUEST_LOG_DB_PATH)
+request_log = RequestLogWriter(REQUEST_LOG_DB_PATH,
+                               max_queue_size=REQUEST_LOG_QUEUE_SIZE,
+                               batch_size=REQUEST_LOG_BATCH_SIZE,
+                               flush_interval=REQUEST_LOG_FLUSH_INTERVAL,
+                               full_policy=REQUEST_LOG_FULL_POLICY)
 
+# Keep the best model in memory and swap it in when a new one is promoted
+model_holder = ArtifactHolder(get_best_model_path(), load_live_model,
+                              poll_interval=MODEL_POLL_INTERVAL, name='best model',
+                              on_reload=lambda snapshot: on_model_reload(snapshot))
 
-@app.route('/predict', methods=['POST'])
-def predict():
+# Index the training data for similar diamonds queries and rebuild it when the file changes
+similarity_index_holder = ArtifactHolder(get_training_data_path(), load_similarity_index,
+                                         poll_interval=DATA_POLL_INTERVAL, name='similar diamonds index',
+                                         on_reload=lambda snapshot: rebuild_price_index())
+
+# Multi-attribute nearest-neighbour search over the same data
+neighbour_search_holder = ArtifactHolder(get_training_data_path(), load_neighbour_search,
+                                         poll_interval=DATA_POLL_INTERVAL, name='nearest diamonds search')
+
+artifact_holders = [model_holder, similarity_index_holder, neighbour_search_holder]
+
+# Set once the artifacts are loaded and the live model is warmed up in this process
+api_ready = threading.Event()
+
+# Compile the feature encoder of every registered model once
+feature_encoders = build_feature_encoders()
+
+# Catalog pre-scored by the live model for price range queries, re-scored when the model or the data is reloaded
+price_index = None
+price_index_lock = threading.Lock()
+
+# Bin counts of the scored rows compared to the catalog, rebuilt when the data changes
+drift_monitor = None
+drift_monitor_lock = threading.Lock()
+
+# Cache predictions of repeated diamonds, keyed on the version of the model that made them
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL or None) if PREDICTION_CACHE_SIZE > 0 else None
+
+# Request counters and latency histograms, served on /metrics
+metrics = MetricsRegistry(prefix='diamond_api_')
+request_counter = metrics.counter('requests', 'Requests by endpoint and status code.', ('endpoint', 'status'))
+error_counter = metrics.counter('errors', 'Requests answered with an error status.', ('endpoint',))
+request_latency = metrics.histogram('request_duration_seconds', 'Time spent handling a request.', ('endpoint',))
+stage_latency = metrics.histogram('stage_duration_seconds', 'Time spent in each stage of a request.', ('endpoint', 'stage'))
+predict_batch_rows = metrics.histogram('predict_rows', 'Rows per /predict request.', buckets=BATCH_SIZE_BUCKETS)
+invalid_rows_counter = metrics.counter('predict_invalid_rows', 'Rows of /predict requests rejected by validation.')
+micro_batch_rows = metrics.histogram('micro_batch_rows', 'Rows per micro-batch of single-row predictions.', buckets=BATCH_SIZE_BUCKETS)
+shadow_latency = metrics.histogram('shadow_predict_duration_seconds', 'Time a candidate model spent predicting a shadowed request.', ('model_version',))
+
+
+def component_stat(component, key):
+    """
+    Read a counter of a background component for /metrics.
+
+    Parameters:
+    component (function): Returns the component, or None when it is disabled.
+    key (str): The key of the counter in the component's stats.
+
+    Returns:
+    float: The counter, or None when the component is disabled.
+    """
+    instance = component()
+    return instance.stats()[key] if instance is not None else None
+
+def live_model_info():
+    """
+    Return the name and version of the live model for /metrics.
+
+    Returns:
+    dict: The (model name, version) labels mapped to 1.
+    """
+    snapshot = model_holder.snapshot()
+    return {(snapshot.value.model_name, snapshot.version): 1}
+
+# The state of the model and of the background components, read when /metrics is scraped
+metrics.callback('model_info', 'Model serving the predictions.', live_model_info, labelnames=('model_name', 'version'))
+for name, description, component, key, metric_type in [
+    ('prediction_cache_hits_total', 'Prediction cache hits.', lambda: prediction_cache, 'hits', 'counter'),
+    ('prediction_cache_misses_total', 'Prediction cache misses.', lambda: prediction_cache, 'misses', 'counter'),
+    ('prediction_cache_evictions_total', 'Prediction cache evictions.', lambda: prediction_cache, 'evictions', 'counter'),
+    ('prediction_cache_entries', 'Entries in the prediction cache.', lambda: prediction_cache, 'size', 'gauge'),
+    ('request_log_queue_depth', 'Request log entries waiting to be written.', lambda: request_log, 'queued', 'gauge'),
+    ('request_log_dropped_total', 'Request log entries dropped because the queue was full.', lambda: request_log, 'dropped', 'counter'),
+    ('request_log_flushed_total', 'Request log entries written to the database.', lambda: request_log, 'flushed', 'counter'),
+    ('request_log_errors_total', 'Request log entries that failed to be written.', lambda: request_log, 'errors', 'counter'),
+    ('micro_batches_total', 'Micro-batches of single-row predictions.', lambda: micro_batcher, 'batches', 'counter'),
+    ('micro_batch_errors_total', 'Micro-batches that failed.', lambda: micro_batcher, 'errors', 'counter'),
+    ('shadow_queue_depth', 'Requests waiting to be shadow-scored.', lambda: shadow_scorer, 'queued', 'gauge'),
+    ('shadow_requests_total', 'Requests submitted to shadow scoring.', lambda: shadow_scorer, 'submitted', 'counter'),
+    ('shadow_shed_total', 'Requests shed because the shadow scoring queue was full.', lambda: shadow_scorer, 'shed', 'counter')
+]:
+    metrics.callback(name, description, lambda component=component, key=key: component_stat(component, key), metric_type)
+
+def drift_scores(statistic):
     """
-    Predict the value of a diamond based on input features.
+    Read the drift of each feature over the recent windows for /metrics.
+
+    Parameters:
+    statistic (str): 'psi' or 'ks'.
 
     Returns:
-    JSON: The predicted value or an error message.
+    dict: The (feature,) labels mapped to the statistic, or None when the monitor is not built.
     """
+    monitor = drift_monitor
+    if monitor is None:
+        return None
+    return {(feature,): scores[statistic] for feature, scores in monitor.scores()['recent']['features'].items()
+            if scores[statistic] is not None}
+
+metrics.callback('drift_psi', 'Population stability index of each feature over the recent /predict rows.',
+                 lambda: drift_scores('psi'), labelnames=('feature',))
+metrics.callback('drift_ks', 'Kolmogorov-Smirnov statistic of each feature over the recent /predict rows.',
+                 lambda: drift_scores('ks'), labelnames=('feature',))
+
+
+def parse_prediction_records():
+    """
+    Parse the body of a /predict request into a list of feature records.
+
+    A JSON object is a single prediction; a JSON array, an NDJSON body
+    (application/x-ndjson) or a CSV body (text/csv) is a batch.
+
+    Returns:
+    tuple: The list of records, a dict mapping row positions to parse errors,
+    and whether the request is a batch.
+
+    Raises:
+    ValueError: If the body is not a JSON object or array, or not valid CSV.
+    """
+    mimetype = request.mimetype
+    invalid_json = set()
+
+    if mimetype == 'text/csv':
+        df = pd.read_csv(io.StringIO(request.get_data(as_text=True)))
+        return df.to_dict(orient='records'), {}, True
+
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        lines = [line for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        rows = []
+        for position, line in enumerate(lines):
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                rows.append(None)
+                invalid_json.add(position)
+    else:
+        # None when the body is not valid JSON, rejected below like a null body
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            return [data], {}, False
+        if not isinstance(data, list):
+            raise ValueError('expected a JSON object or an array of objects.')
+        rows = data
+
+    records, parse_errors = [], {}
+    for position, row in enumerate(rows):
+        if isinstance(row, dict):
+            records.append(row)
+        else:
+            records.append({})
+            parse_errors[position] = 'Row is not valid JSON.' if position in invalid_json else 'Row must be a JSON object.'
+
+    return records, parse_errors, True
+
+def parse_number(value, name, integer=False, minimum=None):
+    """
+    Convert a field of a request to a finite number.
+
+    Parameters:
+    value: The value sent in the request.
+    name (str): The name of the field, for the error message.
+    integer (bool): Require a whole number (3, 3.0 or "3") and convert it to an int.
+    minimum (float): Smallest accepted value, if any.
+
+    Returns:
+    int or float: The number.
 
+    Raises:
+    ValueError: If the value is not a finite number, is a boolean, is not whole when integer is set or is below minimum.
+    """
+    kind = 'an integer' if integer else 'a number'
+    if isinstance(value, bool):
+        raise ValueError(f"'{name}' must be {kind}.")
     try:
-        data = request.get_json()
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"'{name}' must be {kind}.") from None
+    if not math.isfinite(number):
+        raise ValueError(f"'{name}' must be a finite number.")
+    if integer:
+        # int() would truncate 3.5 to 3
+        if not number.is_integer():
+            raise ValueError(f"'{name}' must be {kind}.")
+        number = int(number)
+    if minimum is not None and number < minimum:
+        raise ValueError(f"'{name}' must be at least {minimum}.")
+    return number
 
-        # Convert the JSON data to a DataFrame
-        df = pd.DataFrame([data])
+def predict_rows(df, backend, model_name, model_version=None, timer=None):
+    """
+    Predict the value of every valid row of a dataframe with a single model call.
 
-        # Check which model to use
-        best_model, model_name = load_best_model()
+    Rows found in the prediction cache are not sent to the model.
 
-        df['price'] = 1
+    Parameters:
+    df (pd.DataFrame): The raw feature rows, indexed by position.
+    backend (ModelBackend, LinearBackend or XGBoostBackend): The prediction backend of the model.
+    model_name (str): The registry name of the model.
+    model_version (str): The version of the model, used to key the prediction cache.
+    timer (StageTimer): Times the validation, drift, cache, encoding and prediction stages.
 
-        if model_name in model_registry:
-            model_details = model_registry[model_name]
+    Returns:
+    tuple: A list of predictions aligned with df (None for invalid rows)
+    and a pd.Series of error messages (None for valid rows).
+    """
+    if model_name not in model_registry:
+        raise ValueError(f"Model '{model_name}' is not in the model registry.")
+    encoder = feature_encoders[model_name]
+    timer = timer if timer is not None else StageTimer()
 
-            # Dynamically import the preprocessing function
-            preprocess_function = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+    predictions = [None] * len(df)
+    with timer.stage('validate'):
+        valid_df, errors = split_valid_rows(df)
+    invalid_rows_counter.inc(amount=len(df) - len(valid_df))
 
-            # Preprocess the data
-            preprocessed_df = preprocess_function(df)
+    # Warm-up predictions have no version and are not part of the traffic
+    if DRIFT_WINDOW_ROWS > 0 and model_version is not None and not valid_df.empty:
+        with timer.stage('drift'):
+            observe_drift(valid_df)
 
-            # Drop the 'price' column
-            preprocessed_df = preprocessed_df.drop(columns=['price'])
+    if not valid_df.empty:
+        use_cache = prediction_cache is not None and model_version is not None
+        if use_cache:
+            with timer.stage('cache_lookup'):
+                keys = prediction_cache.make_keys(model_version, valid_df, encoder.numeric_features, encoder.categorical_features)
+                cached = prediction_cache.get_many(model_version, keys)
+                missing = [i for i, value in enumerate(cached) if value is None]
+        else:
+            cached = [None] * len(valid_df)
+            missing = range(len(valid_df))
 
-            # Make predictions
-            predictions = best_model.predict(preprocessed_df)
+        if len(missing):
+            # Encode the features with the encoder compiled for this model
+            with timer.stage('encode'):
+                features = encoder.transform(valid_df.iloc[missing] if use_cache else valid_df, as_frame=backend.as_frame)
 
-            # Apply log transformation if required
-            if model_details['log_transform']:
-                predictions = np.exp(predictions)
+            # Make predictions for the whole batch at once, the backend reverses the log transformation
+            with timer.stage('predict'):
+                new_predictions = backend.predict(features).tolist()
+            for i, prediction in zip(missing, new_predictions):
+                cached[i] = prediction
+            if use_cache:
+                with timer.stage('cache_store'):
+                    prediction_cache.put_many(model_version, [keys[i] for i in missing], new_predictions)
 
-        response = {'predictions': predictions.tolist(), 'model_name': model_name}
-        save_request_response('/predict', data, response)
-        return jsonify(response)
+        for position, prediction in zip(valid_df.index, cached):
+            predictions[position] = prediction
+
+    return predictions, errors
+
+def predict_single_rows(records):
+    """
+    Predict a micro-batch of single-row requests with one model call.
+
+    Parameters:
+    records (list): One raw record per request.
+
+    Returns:
+    list: The prediction, error, model name and model version of each record.
+    """
+    timer = StageTimer()
+    with timer.stage('parse'):
+        df = pd.DataFrame(records, index=range(len(records)))
+    with timer.stage('model'):
+        _, model_name, model_version, backend = model_holder.get()
+    predictions, errors = predict_rows(df, backend, model_name, model_version, timer)
+
+    micro_batch_rows.observe(len(records))
+    for stage, seconds in timer.stages.items():
+        stage_latency.observe(seconds, 'micro_batch', stage)
+    return [(prediction, error, model_name, model_version) for prediction, error in zip(predictions, errors)]
+
+def update_price_index():
+    """
+    Score the price index for the live model and catalog, unless it is already up to date.
+
+    The catalog is the dataset of the similar diamonds index. Only one thread
+    updates the index at a time; when only rows were appended to the catalog,
+    only those rows are scored.
+
+    Returns:
+    PriceIndex: The index of the live versions.
+    """
+    global price_index
+    with price_index_lock:
+        model_snapshot = model_holder.snapshot()
+        data_snapshot = similarity_index_holder.snapshot()
+        index = price_index
+        if index is not None and index.model_version == model_snapshot.version and index.data_version == data_snapshot.version:
+            return index
+
+        loaded = model_snapshot.value
+        if loaded.model_name not in model_registry:
+            raise ValueError(f"Model '{loaded.model_name}' is not in the model registry.")
+        args = (data_snapshot.value.catalog, feature_encoders[loaded.model_name], loaded.backend,
+                model_snapshot.version, data_snapshot.version)
+        if index is None:
+            index = PriceIndex.build(*args)
+        else:
+            index = index.refresh(*args)
+        price_index = index
+    return index
+
+def rebuild_price_index():
+    """
+    Re-score the price index after the model or the data was reloaded, in the watcher thread.
+
+    Until it is done, price queries are answered from the previous index,
+    which reports the model version that priced it. Workers of serve.py are
+    restarted on reloads and score the index in warm_up() instead.
+    """
+    if SERVE_PRELOAD:
+        return
+    try:
+        update_price_index()
+    except Exception as e:
+        logging.error(f"Error rebuilding the price index: {e}")
+
+def on_model_reload(snapshot):
+    """
+    Drop the cached predictions of the replaced model and re-score the price index, in the watcher thread.
+
+    Parameters:
+    snapshot (Snapshot): The snapshot of the new live model.
+    """
+    if prediction_cache is not None:
+        prediction_cache.retire_versions(snapshot.version)
+    rebuild_price_index()
+
+def get_price_index():
+    """
+    Return the price index, scoring it first if it was never built in this process.
+
+    Reloads re-score it in the background (see rebuild_price_index), so
+    requests never wait for a re-score.
+
+    Returns:
+    PriceIndex: The latest index.
+    """
+    index = price_index
+    return index if index is not None else update_price_index()
+
+def get_drift_monitor():
+    """
+    Return the drift monitor of the live catalog, rebuilding it first if the catalog changed.
+
+    The reference profile is binned from the dataset of the similar diamonds
+    index; a new catalog starts the counts over.
+
+    Returns:
+    DriftMonitor: The monitor of the live data version.
+    """
+    global drift_monitor
+    data_snapshot = similarity_index_holder.snapshot()
+    monitor = drift_monitor
+    if monitor is not None and monitor.data_version == data_snapshot.version:
+        return monitor
+
+    with drift_monitor_lock:
+        monitor = drift_monitor
+        if monitor is None or monitor.data_version != data_snapshot.version:
+            monitor = DriftMonitor(build_reference(data_snapshot.value.catalog, DRIFT_BINS), DRIFT_WINDOW_ROWS, data_snapshot.version,
+                                   min_rows=DRIFT_MIN_ROWS)
+            drift_monitor = monitor
+    return monitor
+
+def observe_drift(valid_df):
+    """
+    Count validated /predict rows in the drift monitor, without failing the request.
+
+    Parameters:
+    valid_df (pd.DataFrame): The rows that passed validation.
+    """
+    try:
+        get_drift_monitor().observe(valid_df)
+    except Exception as e:
+        logging.error(f"Error updating the drift monitor: {e}")
+
+# Load the model and the indexes now, so the first requests do not wait for them
+for holder in artifact_holders:
+    holder.refresh()
+
+# Batch concurrent single-row predictions, if enabled
+micro_batcher = None
+if MICRO_BATCH_WAIT_MS > 0:
+    micro_batcher = MicroBatcher(predict_single_rows, MICRO_BATCH_WAIT_MS, MICRO_BATCH_MAX_SIZE, name='predict-micro-batcher')
+
+# Score the /predict traffic with the candidate models in the background, if enabled.
+# The worker processes load the candidates once started, in each process serving requests
+shadow_scorer = None
+if SHADOW_MODELS:
+    init_shadow_db(REQUEST_LOG_DB_PATH)
+    shadow_scorer = ShadowScorer([os.path.join(get_project_root(), 'models', 'artifacts', version) for version in SHADOW_MODELS],
+                                 REQUEST_LOG_DB_PATH, max_workers=SHADOW_WORKERS, max_queue_size=SHADOW_QUEUE_SIZE,
+                                 sample_rate=SHADOW_SAMPLE_RATE, latency_histogram=shadow_latency,
+                                 warm_up_records=[WARM_UP_RECORD])
+
+def start_background_threads(watch_artifacts=True):
+    """
+    Start the request log writer, the micro-batcher, the shadow scorer and the artifact watchers.
+
+    Parameters:
+    watch_artifacts (bool): Watch the model and data files and hot-swap them in this process.
+    Workers of serve.py leave this to the master process, which restarts them on changes.
+    """
+    request_log.start()
+    if micro_batcher is not None:
+        micro_batcher.start()
+    if shadow_scorer is not None:
+        shadow_scorer.start()
+    if watch_artifacts:
+        for holder in artifact_holders:
+            holder.start()
+
+def warm_up():
+    """
+    Warm up the live model, score the price index and profile the catalog for the drift monitor in this process,
+    then report the API ready on /ready.
+
+    Processes forked by serve.py call this before accepting requests.
+    """
+    if SERVE_PRELOAD and model_holder.version is not None:
+        try:
+            warm_up_model(model_holder.get())
+        except Exception as e:
+            logging.error(f"Error warming up the best model: {e}")
+            return
+    # Scoring the catalog runs the model, so under serve.py it also happens in each worker
+    try:
+        update_price_index()
+    except Exception as e:
+        logging.error(f"Error building the price index: {e}")
+    if DRIFT_WINDOW_ROWS > 0:
+        try:
+            get_drift_monitor()
+        except Exception as e:
+            logging.error(f"Error building the drift monitor: {e}")
+    # The startup state lives as long as the process: keep the garbage collector from rescanning it
+    gc.freeze()
+    api_ready.set()
+
+@app.before_request
+def start_request_timer():
+    """
+    Start timing the request and its stages.
+    """
+    g.timer = StageTimer()
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Record the request latency, its stages and its status, and log it if it was slow.
+
+    Parameters:
+    response (flask.Response): The response of the request.
+
+    Returns:
+    flask.Response: The same response.
+    """
+    timer = g.get('timer')
+    if timer is None:
+        return response
+    # The route pattern, so that URLs with arbitrary paths do not create new label values
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    elapsed = timer.elapsed()
+
+    request_counter.inc(endpoint, str(response.status_code))
+    if response.status_code >= 400:
+        error_counter.inc(endpoint)
+    request_latency.observe(elapsed, endpoint)
+    for stage, seconds in timer.stages.items():
+        stage_latency.observe(seconds, endpoint, stage)
+
+    if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+        logging.warning(f"Slow request: {request.method} {endpoint} returned {response.status_code} "
+                        f"in {elapsed * 1000:.2f}ms ({timer.breakdown()})")
+    return response
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    """
+    Predict the value of one diamond or of a batch of diamonds.
+
+    The body is either a JSON object, a JSON array of objects, an NDJSON body
+    or a CSV body. Invalid rows of a batch are reported in 'errors' and get a
+    null prediction, without affecting the other rows.
+
+    Returns:
+    JSON: The predicted values or an error message.
+    """
+
+    timer = g.timer
+    data = None
+    try:
+        with timer.stage('parse'):
+            try:
+                records, parse_errors, is_batch = parse_prediction_records()
+            except ValueError as e:
+                # Not a JSON object or array, or a CSV body pandas cannot parse
+                response = {'error': f'Invalid request body: {e}'}
+                save_request_response('/predict', data, response)
+                return jsonify(response), 400
+        data = records if is_batch else records[0]
+        predict_batch_rows.observe(len(records))
+
+        if micro_batcher is not None and not is_batch:
+            # Predicted together with the concurrent single-row requests
+            with timer.stage('micro_batch'):
+                try:
+                    prediction, error, model_name, model_version = micro_batcher.submit(records[0], timeout=MICRO_BATCH_TIMEOUT_S)
+                except TimeoutError as e:
+                    logging.error(f"Error making prediction: {e}")
+                    response = {'error': 'The prediction timed out, try again later.'}
+                    save_request_response('/predict', data, response)
+                    return jsonify(response), 503
+            predictions, errors = [prediction], pd.Series([error], dtype=object)
+        else:
+            # Convert the records to a DataFrame
+            with timer.stage('parse'):
+                df = pd.DataFrame(records, index=range(len(records)))
+
+            # Take the live model once so the whole request runs on the same version
+            with timer.stage('model'):
+                _, model_name, model_version, backend = model_holder.get()
+
+            predictions, errors = predict_rows(df, backend, model_name, model_version, timer)
+            for position, error in parse_errors.items():
+                errors[position] = error
+
+        response = {'predictions': predictions, 'model_name': model_name, 'model_version': model_version}
+
+        if not is_batch:
+            if pd.notna(errors.iloc[0]):
+                response = {'error': errors.iloc[0]}
+                with timer.stage('log'):
+                    save_request_response('/predict', data, response)
+                return jsonify(response), 400
+        else:
+            response['errors'] = [{'row': int(position), 'error': error} for position, error in errors.dropna().items()]
+
+        # Queued for the candidate models without waiting, or shed if they fall behind
+        if shadow_scorer is not None:
+            with timer.stage('shadow'):
+                shadow_scorer.submit(records, predictions, model_version)
+
+        with timer.stage('log'):
+            save_request_response('/predict', data, response)
+        with timer.stage('serialize'):
+            return jsonify(response)
 
     except Exception as e:
         logging.error(f"Error making prediction: {e}")
         response = {'error': 'An error occurred during prediction.'}
         save_request_response('/predict', data, response)
         return jsonify(response), 500
-        
+
+@app.route('/model', methods=['GET'])
+def model_info():
+    """
+    Return the name and version of the model currently serving predictions.
+
+    Returns:
+    JSON: The live model details or an error message.
+    """
+
+    try:
+        snapshot = model_holder.snapshot()
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 503
+
+    response = {
+        'model_name': snapshot.value.model_name,
+        'model_version': snapshot.version,
+        'loaded_at': datetime.fromtimestamp(snapshot.loaded_at).strftime("%Y-%m-%d %H:%M:%S")
+    }
+    return jsonify(response)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """
+    Return the counters of the request log writer, the prediction cache, the micro-batcher and the shadow scorer.
+
+    Returns:
+    JSON: The counters of each component.
+    """
+
+    response = {
+        'request_log': request_log.stats(),
+        'prediction_cache': prediction_cache.stats() if prediction_cache is not None else None,
+        'micro_batcher': micro_batcher.stats() if micro_batcher is not None else None,
+        'shadow_scorer': shadow_scorer.stats() if shadow_scorer is not None else None
+    }
+    return jsonify(response)
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """
+    Report whether the API can serve requests: the model and the indexes are loaded and the model is warmed up.
+
+    Returns:
+    JSON: The readiness and the live model version, with status 503 while not ready.
+    """
+
+    waiting_for = [holder.name for holder in artifact_holders if holder.version is None]
+    if not api_ready.is_set():
+        waiting_for.append('warm-up')
+    if waiting_for:
+        return jsonify({'ready': False, 'waiting_for': waiting_for}), 503
+    return jsonify({'ready': True, 'model_version': model_holder.version})
+
+@app.route('/drift', methods=['GET'])
+def drift():
+    """
+    Return the drift of the /predict features from the training data.
+
+    For the recent windows and since startup, each feature gets the
+    population stability index and Kolmogorov-Smirnov statistic of its
+    binned distribution against the catalog's, once DRIFT_MIN_ROWS rows are
+    counted (null before). 'drifted' lists the features whose recent PSI is
+    above DRIFT_PSI_THRESHOLD. The counts are those of this process: under
+    serve.py, each worker only counts the requests it served.
+
+    Returns:
+    JSON: The drift scores or an error message.
+    """
+
+    if DRIFT_WINDOW_ROWS <= 0:
+        return jsonify({'error': 'Drift monitoring is disabled.'}), 404
+    try:
+        response = get_drift_monitor().scores()
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 503
+
+    response['psi_threshold'] = DRIFT_PSI_THRESHOLD
+    response['pid'] = os.getpid()
+    response['scope'] = ('Rows served by this worker process only: each serve.py worker keeps its own counts.' if SERVE_PRELOAD
+                         else 'Rows served by this process.')
+    response['drifted'] = [feature for feature, scores in response['recent']['features'].items()
+                           if scores['psi'] is not None and scores['psi'] > DRIFT_PSI_THRESHOLD]
+    return jsonify(response)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_page():
+    """
+    Return the request metrics and the component counters in the Prometheus text format.
+
+    Returns:
+    Response: The metrics page.
+    """
+
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # return n most similar diamonds of same cut, color, and clarity based on weight
 @app.route('/get_similar_diamonds', methods=['POST'])
 def get_similar_diamonds():
@@ -158,38 +920,31 @@ def get_similar_diamonds():
     JSON: The similar diamonds or an error message.
     """
 
+    timer = g.timer
+    data = None
     try:
-        data = request.get_json()
-        given_cut = data['cut']
-        given_color = data['color']
-        given_clarity = data['clarity']
-        given_weight = data['weight']
-        n = data.get('n', 5)  # Default to 5 samples if not specified
-
-        # Load the training data
-        training_data = load_training_data()
-
-        # Filter based on cut, color, and clarity
-        filtered_data = training_data[
-            (training_data['cut'] == given_cut) &
-            (training_data['color'] == given_color) &
-            (training_data['clarity'] == given_clarity)
-        ]
-
-        if filtered_data.empty:
-            return jsonify({'error': 'No matching diamonds found.'}), 404
+        with timer.stage('parse'):
+            data = request.get_json()
+            given_cut = data['cut']
+            given_color = data['color']
+            given_clarity = data['clarity']
+            given_weight = data['weight']
+            n = data.get('n', 5)  # Default to 5 samples if not specified
 
-        # Calculate the absolute difference in weight
-        filtered_data['weight_diff'] = (filtered_data['carat'] - given_weight).abs()
+        # Query the in-memory index instead of scanning the dataset
+        with timer.stage('index'):
+            similarity_index = similarity_index_holder.get()
+        with timer.stage('query'):
+            positions = similarity_index.query_positions(given_cut, given_color, given_clarity, given_weight, n)
 
-        # Sort by weight difference and select the top n samples
-        similar_diamonds = filtered_data.nsmallest(n, 'weight_diff')
-
-        # Drop the weight_diff column before returning
-        similar_diamonds = similar_diamonds.drop(columns=['weight_diff'])
+        if positions is None:
+            return jsonify({'error': 'No matching diamonds found.'}), 404
 
-        response = similar_diamonds.to_json(orient='records')
-        save_request_response('/get_similar_diamonds', data, response)
+        # Serialized straight from the shared catalog columns
+        with timer.stage('serialize'):
+            response = similarity_index.catalog.to_json(positions)
+        with timer.stage('log'):
+            save_request_response('/get_similar_diamonds', data, response)
         return response
 
     except Exception as e:
@@ -199,6 +954,141 @@ def get_similar_diamonds():
         return jsonify(response), 500
 
 
+@app.route('/get_nearest_diamonds', methods=['POST'])
+def get_nearest_diamonds():
+    """
+    Return the diamonds closest to the given one across carat, depth, table and x, y, z.
+
+    The numeric features present in the request are compared after scaling by
+    their standard deviation in the dataset. 'weights' sets the weight of each
+    feature, 'match' lists the categorical attributes that must be equal
+    (default: cut, color and clarity; [] searches the whole catalog), 'n' caps
+    the number of results and 'radius' only keeps diamonds within that scaled distance.
+
+    Returns:
+    JSON: The nearest diamonds with their distance or an error message.
+    """
+
+    timer = g.timer
+    data = None
+    try:
+        with timer.stage('parse'):
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                raise ValueError('Request body must be a JSON object.')
+            query = dict(data)
+            if 'carat' not in query and 'weight' in query:
+                query['carat'] = query['weight']
+
+            radius = parse_number(data['radius'], 'radius', minimum=0) if data.get('radius') is not None else None
+            if data.get('n') is not None:
+                n = parse_number(data['n'], 'n', integer=True, minimum=1)
+            else:
+                n = None if radius is not None else 5
+            match = data.get('match', list(CATEGORICAL_ATTRIBUTES))
+            if not isinstance(match, list):
+                raise ValueError("'match' must be a list of attributes.")
+            weights = data.get('weights') or {feature: 1.0 for feature in NUMERIC_FEATURES if feature in query}
+            if not isinstance(weights, dict):
+                raise ValueError("'weights' must be an object mapping features to weights.")
+            weights = {feature: parse_number(weight, f'weights.{feature}', minimum=0) for feature, weight in weights.items()}
+
+        with timer.stage('index'):
+            neighbour_search = neighbour_search_holder.get()
+        with timer.stage('query'):
+            nearest = neighbour_search.get_index(match, weights).query(query, n=n, radius=radius)
+
+        if nearest is None:
+            return jsonify({'error': 'No matching diamonds found.'}), 404
+
+        with timer.stage('serialize'):
+            positions, distances = nearest
+            response = neighbour_search.catalog.to_json(positions, {'distance': distances})
+        with timer.stage('log'):
+            save_request_response('/get_nearest_diamonds', data, response)
+        return response
+
+    except ValueError as e:
+        response = {'error': str(e)}
+        save_request_response('/get_nearest_diamonds', data, response)
+        return jsonify(response), 400
+
+    except Exception as e:
+        logging.error(f"Error finding nearest diamonds: {e}")
+        response = {'error': str(e)}
+        save_request_response('/get_nearest_diamonds', data, response)
+        return jsonify(response), 500
+
+
+@app.route('/get_diamonds_by_price', methods=['POST'])
+def get_diamonds_by_price():
+    """
+    Return the diamonds of the catalog whose predicted price is within a budget.
+
+    'min_price' and 'max_price' bound the predicted price (both inclusive,
+    either may be left out). 'cut', 'color' and 'clarity' take a grade or a
+    list of accepted grades, and 'min_cut', 'min_color' and 'min_clarity' the
+    worst accepted grade. The diamonds are sorted by predicted price,
+    cheapest first unless 'order' is 'desc', and paginated with 'offset' and
+    'limit' (default 20).
+
+    Returns:
+    JSON: The number of matching diamonds and the requested page, or an error message.
+    """
+
+    timer = g.timer
+    data = None
+    try:
+        with timer.stage('parse'):
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                raise ValueError('Request body must be a JSON object.')
+            grades, min_grades = {}, {}
+            for attribute in CATEGORICAL_ATTRIBUTES:
+                if attribute in data:
+                    grades[attribute] = data[attribute] if isinstance(data[attribute], list) else [data[attribute]]
+                if f'min_{attribute}' in data:
+                    min_grades[attribute] = data[f'min_{attribute}']
+            min_price = parse_number(data['min_price'], 'min_price') if data.get('min_price') is not None else None
+            max_price = parse_number(data['max_price'], 'max_price') if data.get('max_price') is not None else None
+            if min_price is not None and max_price is not None and min_price > max_price:
+                raise ValueError("'min_price' must not be greater than 'max_price'.")
+            offset = parse_number(data.get('offset', 0), 'offset', integer=True, minimum=0)
+            limit = parse_number(data.get('limit', 20), 'limit', integer=True, minimum=0)
+            if data.get('order', 'asc') not in ('asc', 'desc'):
+                raise ValueError("'order' must be 'asc' or 'desc'.")
+
+        with timer.stage('index'):
+            index = get_price_index()
+        with timer.stage('query'):
+            total, positions, prices = index.query_positions(min_price, max_price, grades, min_grades,
+                                                              offset, limit, descending=data.get('order') == 'desc')
+
+        with timer.stage('serialize'):
+            # The page is serialized from the catalog columns and spliced into the response object
+            header = json.dumps({'total': total, 'offset': offset, 'limit': limit, 'model_version': index.model_version})
+            diamonds = index.catalog.to_json(positions, {'predicted_price': prices})
+            response = f'{header[:-1]}, "diamonds": {diamonds}}}'
+        with timer.stage('log'):
+            save_request_response('/get_diamonds_by_price', data, response)
+        return Response(response, mimetype='application/json')
+
+    except (ValueError, TypeError) as e:
+        response = {'error': str(e)}
+        save_request_response('/get_diamonds_by_price', data, response)
+        return jsonify(response), 400
+
+    except Exception as e:
+        logging.error(f"Error finding diamonds by price: {e}")
+        response = {'error': str(e)}
+        save_request_response('/get_diamonds_by_price', data, response)
+        return jsonify(response), 500
+
+
+# Processes forked by serve.py start their threads once forked
+if not SERVE_PRELOAD:
+    start_background_threads()
+    warm_up()
 
 if __name__ == '__main__':
     app.run(debug=True)
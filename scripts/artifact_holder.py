@@ -0,0 +1,170 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+"""
+Artifact Holder
+
+This module keeps an artifact loaded from disk resident in memory and swaps it
+for a fresh copy when the file on disk changes. It is used by the API to serve
+every request from an in-memory object instead of reloading it per request.
+
+Classes:
+   ArtifactHolder -- Holds the loaded artifact and watches its file for changes.
+"""
+
+Snapshot = namedtuple('Snapshot', ['value', 'version', 'signature', 'loaded_at'])
+
+
+def file_signature(path):
+   """
+   Compute a cheap signature of a file used to detect changes.
+
+   Parameters:
+   path (str): Path to the file.
+
+   Returns:
+   tuple: (mtime_ns, size, inode) of the file, or None if it does not exist.
+   """
+   try:
+      stat = os.stat(path)
+   except FileNotFoundError:
+      return None
+   return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class ArtifactHolder:
+   """
+   Keep an artifact resident in memory and hot-swap it when its file changes.
+
+   The loaded value is published as an immutable snapshot. Readers take the
+   snapshot once per request with `snapshot()`, so a request that started on
+   the old artifact finishes on it even if a swap happens meanwhile.
+
+   Parameters:
+   path (str): Path to the artifact file to watch.
+   loader (callable): Function taking the path and returning the loaded value.
+   poll_interval (float): Seconds between two checks of the file signature.
+   name (str): Name used in log messages and for the watcher thread.
+   on_reload (callable): Called with the new snapshot each time it replaces a live one,
+   in the thread that reloaded it, to rebuild state derived from the artifact.
+   """
+
+   def __init__(self, path, loader, poll_interval=5.0, name='artifact', on_reload=None):
+      self.path = path
+      self.loader = loader
+      self.poll_interval = poll_interval
+      self.name = name
+      self.on_reload = on_reload
+      self._snapshot = None
+      self._reload_lock = threading.Lock()
+      self._stop_event = threading.Event()
+      self._thread = None
+      if hasattr(os, 'register_at_fork'):
+         os.register_at_fork(after_in_child=self._reset_after_fork)
+
+   def refresh(self, force=False):
+      """
+      Reload the artifact if its file changed since the last load.
+
+      A failed load keeps the current snapshot live, so a partially written
+      file never replaces a working artifact. After a successful reload, the
+      on_reload hook runs once the new snapshot is live.
+
+      Parameters:
+      force (bool): Reload even if the file signature did not change.
+
+      Returns:
+      bool: True if a new snapshot was published.
+      """
+      with self._reload_lock:
+         signature = file_signature(self.path)
+         current = self._snapshot
+         if signature is None:
+            return False
+         if not force and current is not None and current.signature == signature:
+            return False
+
+         try:
+            value = self.loader(self.path)
+         except Exception as e:
+            logging.error(f"Error loading {self.name} from {self.path}: {e}")
+            return False
+
+         # The signature is taken before loading: if the file changes while it
+         # is being read, the next poll sees a new signature and loads it again.
+         version = getattr(value, 'version', None) or '-'.join(str(part) for part in signature[:2])
+         snapshot = self._snapshot = Snapshot(value, version, signature, time.time())
+         logging.info(f"Loaded {self.name} version {version} from {self.path}")
+
+      # Only on reloads: the owner builds the state of the first load itself
+      if current is not None and self.on_reload is not None:
+         try:
+            self.on_reload(snapshot)
+         except Exception as e:
+            logging.error(f"Error in the reload hook of {self.name}: {e}")
+      return True
+
+   def snapshot(self):
+      """
+      Return the live snapshot, loading the artifact on first use.
+
+      Returns:
+      Snapshot: The live value with its version and load time.
+      """
+      snapshot = self._snapshot
+      if snapshot is None:
+         self.refresh()
+         snapshot = self._snapshot
+         if snapshot is None:
+            raise FileNotFoundError(f"No {self.name} found at: {self.path}")
+      return snapshot
+
+   def get(self):
+      """
+      Return the live value.
+
+      Returns:
+      object: The loaded artifact.
+      """
+      return self.snapshot().value
+
+   @property
+   def version(self):
+      """
+      Return the version of the live artifact, or None if nothing is loaded.
+      """
+      snapshot = self._snapshot
+      return snapshot.version if snapshot is not None else None
+
+   def start(self):
+      """
+      Load the artifact if available and start the background watcher thread.
+      """
+      if self._thread is not None and self._thread.is_alive():
+         return
+      self.refresh()
+      self._stop_event.clear()
+      self._thread = threading.Thread(target=self._watch, name=f'{self.name}-watcher', daemon=True)
+      self._thread.start()
+
+   def stop(self):
+      """
+      Stop the background watcher thread.
+      """
+      self._stop_event.set()
+      if self._thread is not None:
+         self._thread.join()
+         self._thread = None
+
+   def _reset_after_fork(self):
+      # A process forked during a reload must not inherit the held lock, and the watcher thread does not survive the fork
+      self._reload_lock = threading.Lock()
+      self._stop_event = threading.Event()
+      self._thread = None
+
+   def _watch(self):
+      while not self._stop_event.wait(self.poll_interval):
+         self.refresh()
@@ -0,0 +1,707 @@
+import argparse
+import hashlib
+import joblib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+from data_preprocessing import load_data, NUMERIC_FEATURES
+from models_registry import model_registry, dynamic_import
+from feature_encoder import build_feature_encoders
+from inference import build_backend
+from micro_batcher import MicroBatcher
+from similarity_index import SimilarDiamondsIndex
+from similarity_search import DiamondNeighbourSearch
+from train_model import SPLIT_SEED
+
+# Largest R2 loss against a baseline trained on the same data and split before a regression is reported
+R2_TOLERANCE = 0.01
+
+
+def get_project_root():
+    """
+    Get the project root directory.
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.abspath(os.path.join(current_dir, os.pardir))
+
+def make_synthetic_catalog(n_rows, seed=42, data_path='data/diamonds.csv'):
+    """
+    Build a synthetic catalog shaped like the dataset, of any size.
+
+    Rows are resampled from the dataset and their numeric features are
+    jittered by up to 2%, so the catalog keeps the real joint distribution
+    without duplicating rows.
+
+    Parameters:
+    n_rows (int): Number of rows of the catalog.
+    seed (int): Seed of the random generator.
+    data_path (str): Path to the dataset, relative to the project root.
+
+    Returns:
+    pd.DataFrame: The synthetic catalog.
+    """
+    rng = np.random.default_rng(seed)
+    df = load_data(os.path.join(get_project_root(), data_path))
+    df = df[(df.x * df.y * df.z != 0) & (df.price > 0)]
+
+    catalog = df.iloc[rng.integers(0, len(df), n_rows)].reset_index(drop=True)
+    jitter = rng.uniform(0.98, 1.02, size=(n_rows, len(NUMERIC_FEATURES)))
+    catalog[NUMERIC_FEATURES] = (catalog[NUMERIC_FEATURES].to_numpy() * jitter).round(2)
+
+    return catalog
+
+def dataset_hash(df):
+    """
+    Get the SHA-256 of the content of a dataframe.
+
+    Parameters:
+    df (pd.DataFrame): The dataset.
+
+    Returns:
+    str: The hex digest.
+    """
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+def summarize_latencies(latencies):
+    """
+    Summarize a list of latencies.
+
+    Parameters:
+    latencies (list): Latencies in seconds.
+
+    Returns:
+    dict: Mean, p50 and p99 latency in microseconds.
+    """
+    latencies = np.asarray(latencies) * 1e6
+    return {
+        'mean_us': float(latencies.mean()),
+        'p50_us': float(np.percentile(latencies, 50)),
+        'p99_us': float(np.percentile(latencies, 99))
+    }
+
+def time_calls(fn, calls):
+    """
+    Time a function over a list of argument tuples.
+
+    Parameters:
+    fn (function): The function to time.
+    calls (list): The argument tuples, one per call.
+
+    Returns:
+    dict: The latency summary of the calls.
+    """
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return summarize_latencies(latencies)
+
+def print_results(title, results):
+    """
+    Print benchmark results as an aligned table.
+
+    Parameters:
+    title (str): Title of the benchmark.
+    results (dict): Mapping of case names to their measurements.
+    """
+    print(f'\n{title}')
+    for name, values in results.items():
+        formatted = '  '.join(f'{key}={value:,.1f}' if isinstance(value, float) else f'{key}={value}' for key, value in values.items())
+        print(f'  {name:<28} {formatted}')
+
+def bench_similarity(rows=200_000, queries=200, n=5, seed=42):
+    """
+    Compare the similar diamonds implementations on a synthetic catalog.
+
+    Cases: the former pandas scan (filter + nsmallest on carat), the grouped
+    carat index, a pandas scan over all numeric features, and the KD-tree
+    search with exact, relaxed and radius queries.
+
+    Parameters:
+    rows (int): Number of rows of the synthetic catalog.
+    queries (int): Number of queries per case.
+    n (int): Number of diamonds returned per query.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    dict: Latency summaries and build times per case.
+    """
+    catalog = make_synthetic_catalog(rows, seed)
+    rng = np.random.default_rng(seed + 1)
+    samples = catalog.iloc[rng.integers(0, rows, queries)].to_dict(orient='records')
+    weights = dict.fromkeys(NUMERIC_FEATURES, 1.0)
+    results = {}
+
+    def pandas_carat_scan(query):
+        filtered = catalog[(catalog['cut'] == query['cut']) & (catalog['color'] == query['color']) & (catalog['clarity'] == query['clarity'])]
+        filtered = filtered.assign(weight_diff=(filtered['carat'] - query['carat']).abs())
+        return filtered.nsmallest(n, 'weight_diff')
+
+    std = catalog[NUMERIC_FEATURES].std(ddof=0)
+
+    def pandas_multi_scan(query):
+        filtered = catalog[(catalog['cut'] == query['cut']) & (catalog['color'] == query['color']) & (catalog['clarity'] == query['clarity'])]
+        scaled = (filtered[NUMERIC_FEATURES] - pd.Series({f: query[f] for f in NUMERIC_FEATURES})) / std
+        return filtered.assign(distance=np.sqrt((scaled ** 2).sum(axis=1))).nsmallest(n, 'distance')
+
+    results['pandas_carat_scan'] = time_calls(pandas_carat_scan, [(q,) for q in samples])
+
+    start = time.perf_counter()
+    index = SimilarDiamondsIndex(catalog)
+    build = time.perf_counter() - start
+    results['grouped_carat_index'] = time_calls(
+        lambda q: index.query(q['cut'], q['color'], q['clarity'], q['carat'], n), [(q,) for q in samples])
+    results['grouped_carat_index']['build_ms'] = build * 1e3
+
+    results['pandas_multi_scan'] = time_calls(pandas_multi_scan, [(q,) for q in samples])
+
+    search = DiamondNeighbourSearch(catalog)
+    for case, match, radius, limit in [('kdtree_exact_match', ('cut', 'color', 'clarity'), None, n),
+                                       ('kdtree_relaxed_cut', ('color', 'clarity'), None, n),
+                                       ('kdtree_no_match', (), None, n),
+                                       ('kdtree_radius_0.1', ('cut', 'color', 'clarity'), 0.1, None)]:
+        start = time.perf_counter()
+        search.get_index(match, weights)
+        build = time.perf_counter() - start
+        results[case] = time_calls(lambda q: search.query(q, n=limit, radius=radius, match=match, weights=weights),
+                                   [(q,) for q in samples])
+        results[case]['build_ms'] = build * 1e3
+
+    # The KD-tree must return the same neighbours as the exhaustive scan
+    mismatches = 0
+    for query in samples:
+        expected = pandas_multi_scan(query)['distance'].to_numpy()
+        found = search.query(query, n=n, weights=weights)['distance'].to_numpy()
+        mismatches += not np.allclose(np.sort(expected), np.sort(found))
+    results['kdtree_exact_match']['mismatches_vs_scan'] = mismatches
+
+    print_results(f'Similar diamonds on {rows:,} rows ({queries} queries, n={n})', results)
+    return results
+
+# Loads a dataset in a fresh interpreter and reports its time and resident memory growth.
+# The RSS is read from /proc since ru_maxrss is inherited from the parent across fork and exec.
+_LOAD_PROBE = """
+import json, os, sys, time
+import pandas as pd
+from data_preprocessing import load_data
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+before = rss_mb()
+start = time.perf_counter()
+df = load_data(sys.argv[1], use_cache=sys.argv[2] == 'cache')
+load_s = time.perf_counter() - start
+print(json.dumps({'load_ms': load_s * 1e3, 'rss_delta_mb': rss_mb() - before, 'frame_mb': df.memory_usage(deep=True).sum() / 2 ** 20}))
+"""
+
+def _probe_load(csv_path, mode, cache_dir):
+    result = subprocess.run([sys.executable, '-c', _LOAD_PROBE, csv_path, mode], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=dict(os.environ, DATASET_CACHE_DIR=cache_dir))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def bench_dataset_load(rows=1_000_000, repeats=3, seed=42):
+    """
+    Compare loading a dataset from CSV and from its typed columnar cache.
+
+    A synthetic CSV is written to a temporary directory, and cached there
+    too. Every load runs in a fresh interpreter, so the peak RSS growth of the process is measured
+    without the allocations of earlier loads.
+
+    Parameters:
+    rows (int): Number of rows of the synthetic dataset.
+    repeats (int): Number of loads per case; the best time is reported.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    dict: Load time, RSS growth and dataframe size per case.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'diamonds.csv')
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        make_synthetic_catalog(rows, seed).to_csv(csv_path, index=False)
+
+        runs = [_probe_load(csv_path, 'csv', cache_dir) for _ in range(repeats)]
+        results['read_csv'] = min(runs, key=lambda run: run['load_ms'])
+
+        results['cache_first_build'] = _probe_load(csv_path, 'cache', cache_dir)
+
+        runs = [_probe_load(csv_path, 'cache', cache_dir) for _ in range(repeats)]
+        results['cache_load'] = min(runs, key=lambda run: run['load_ms'])
+
+        cache_size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(cache_dir) for name in names)
+        results['cache_load']['disk_mb'] = cache_size / 2 ** 20
+        results['cache_load']['speedup'] = results['read_csv']['load_ms'] / results['cache_load']['load_ms']
+
+    print_results(f'Dataset load on {rows:,} rows', results)
+    return results
+
+def train_registered_models(data_path='data/diamonds.csv'):
+    """
+    Train every registered model with its default parameters.
+
+    Parameters:
+    data_path (str): Path to the dataset, relative to the project root.
+
+    Returns:
+    dict: Mapping of model names to their trained model.
+    """
+    df = load_data(os.path.join(get_project_root(), data_path))
+    models = {}
+    for model_type, model_details in model_registry.items():
+        preprocess_fn = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+        train_fn = dynamic_import(model_details['train_module'], model_details['train_function'])
+        models[model_type], _, _ = train_fn(preprocess_fn(df))
+    return models
+
+# Loads a model in a fresh interpreter, so the import of its libraries counts as in a cold start
+_MODEL_PROBE = """
+import json, sys, time
+from feature_encoder import build_feature_encoders, PROBE_ROW
+from models_registry import model_registry, dynamic_import
+import pandas as pd
+mode, model_type, path = sys.argv[1:4]
+as_frame = mode == 'joblib' and model_registry[model_type]['predict_input'] == 'dataframe'
+features = build_feature_encoders()[model_type].transform(pd.DataFrame([PROBE_ROW]), as_frame=as_frame)
+start = time.perf_counter()
+if mode == 'joblib':
+    import joblib
+    model, _ = joblib.load(path)
+else:
+    with open(path + '/manifest.json') as f:
+        export = json.load(f)['export']
+    model = dynamic_import(model_registry[model_type]['export_module'], model_registry[model_type]['export_load_function'])(path, export)
+load_s = time.perf_counter() - start
+start = time.perf_counter()
+model.predict(features)
+predict_s = time.perf_counter() - start
+print(json.dumps({'load_ms': load_s * 1e3, 'first_predict_ms': predict_s * 1e3}))
+"""
+
+def _probe_model(mode, model_type, path):
+    result = subprocess.run([sys.executable, '-c', _MODEL_PROBE, mode, model_type, path], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def bench_model_load(repeats=5, data_path='data/diamonds.csv'):
+    """
+    Compare loading the models from their joblib pickle and from their export.
+
+    Each registered model is trained with its default parameters and saved
+    both ways to a temporary directory. Every load runs in a fresh interpreter
+    and includes the import of the libraries the format needs.
+
+    Parameters:
+    repeats (int): Number of loads per case; the median is reported.
+    data_path (str): Path to the dataset, relative to the project root.
+
+    Returns:
+    dict: Load time, first prediction latency and artifact size per case.
+    """
+    models = train_registered_models(data_path)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for model_type, model in models.items():
+            model_details = model_registry[model_type]
+            pickle_path = os.path.join(tmp_dir, f'{model_type}.pkl')
+            joblib.dump((model, {'model_name': model_type}), pickle_path)
+            cases = {f'{model_type}_joblib': ('joblib', pickle_path, [pickle_path])}
+
+            if 'export_function' in model_details:
+                export_dir = os.path.join(tmp_dir, model_type)
+                os.makedirs(export_dir)
+                export = dynamic_import(model_details['export_module'], model_details['export_function'])(model, export_dir)
+                with open(os.path.join(export_dir, 'manifest.json'), 'w') as f:
+                    json.dump({'export': export}, f)
+                export_files = [os.path.join(export_dir, name) for name in export['files'].values()]
+                cases[f"{model_type}_{export['format']}"] = ('export', export_dir, export_files)
+
+            for case, (mode, path, files) in cases.items():
+                runs = [_probe_model(mode, model_type, path) for _ in range(repeats)]
+                results[case] = {
+                    'load_ms': float(np.median([run['load_ms'] for run in runs])),
+                    'first_predict_ms': float(np.median([run['first_predict_ms'] for run in runs])),
+                    'size_kb': sum(os.path.getsize(file) for file in files) / 1024
+                }
+
+    print_results(f'Model load ({repeats} cold starts per case)', results)
+    return results
+
+def bench_inference(batch_sizes=(1, 100, 10_000), calls=200, seed=42):
+    """
+    Compare the model predict path with the fast inference backends.
+
+    Both paths start from the raw rows: the predict path encodes them into
+    the input the model expects (a dataframe for the linear model), calls
+    model.predict and reverses the log transform, the backend path encodes
+    them into a float32 array and calls the registry entry's backend. The
+    largest relative difference between the two paths is reported.
+
+    Parameters:
+    batch_sizes (tuple): Rows per call.
+    calls (int): Number of calls per case, at most 2,000,000 rows per case.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    dict: Latency summaries and prediction differences per case.
+    """
+    models = train_registered_models()
+    encoders = build_feature_encoders()
+    catalog = make_synthetic_catalog(max(batch_sizes), seed)
+    rng = np.random.default_rng(seed + 1)
+    results = {}
+
+    for model_type, model in models.items():
+        model_details = model_registry[model_type]
+        encoder = encoders[model_type]
+        as_frame = model_details['predict_input'] == 'dataframe'
+        backend = build_backend(model, model_type)
+
+        def predict_path(batch):
+            predictions = model.predict(encoder.transform(batch, as_frame=as_frame))
+            return np.exp(predictions) if model_details['log_transform'] else predictions
+
+        def backend_path(batch):
+            return backend.predict(encoder.transform(batch, as_frame=backend.as_frame))
+
+        reference = predict_path(catalog)
+        max_rel_diff = float(np.max(np.abs(backend_path(catalog) - reference) / np.abs(reference)))
+
+        for batch_size in batch_sizes:
+            n_calls = max(5, min(calls, 2_000_000 // batch_size))
+            batches = [(catalog.iloc[rng.integers(0, len(catalog), batch_size)],) for _ in range(n_calls)]
+            results[f'{model_type}_predict_{batch_size}'] = time_calls(predict_path, batches)
+            results[f'{model_type}_backend_{batch_size}'] = time_calls(backend_path, batches)
+            results[f'{model_type}_backend_{batch_size}']['speedup_p50'] = (results[f'{model_type}_predict_{batch_size}']['p50_us'] /
+                                                                          results[f'{model_type}_backend_{batch_size}']['p50_us'])
+        results[f'{model_type}_backend_{batch_sizes[0]}']['max_rel_diff'] = f'{max_rel_diff:.1e}'
+
+    print_results(f'Inference ({calls} calls per case)', results)
+    return results
+
+def import_api():
+    """
+    Import the API module for in-process benchmarks.
+
+    The request log goes to a temporary database unless REQUEST_LOG_DB_PATH
+    is set, so benchmarks do not fill the real one. The API serves the
+    project's best model.
+
+    Returns:
+    module: The api module.
+    """
+    os.environ.setdefault('REQUEST_LOG_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='benchmark_'), 'api_requests.db'))
+    import api
+    return api
+
+def bench_micro_batching(concurrency=(1, 8, 32), wait_ms=(0, 1, 2, 5), requests_per_thread=100, max_batch_size=64, seed=42):
+    """
+    Measure /predict throughput and latency with and without micro-batching.
+
+    Client threads send single-row requests through the Flask test client,
+    each with a different synthetic diamond, with the prediction cache off.
+    A wait of 0 runs without the micro-batcher.
+
+    Parameters:
+    concurrency (tuple): Numbers of concurrent client threads.
+    wait_ms (tuple): Micro-batching windows in milliseconds.
+    requests_per_thread (int): Requests sent by each client thread.
+    max_batch_size (int): Maximum rows per micro-batch.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    dict: Throughput, latency summary and mean batch size per case.
+    """
+    api = import_api()
+    api.prediction_cache = None
+    catalog = make_synthetic_catalog(max(concurrency) * requests_per_thread, seed).drop(columns='price')
+    records = [{key: (value.item() if hasattr(value, 'item') else value) for key, value in record.items()}
+               for record in catalog.to_dict(orient='records')]
+    results = {}
+
+    for wait in wait_ms:
+        for threads in concurrency:
+            if wait > 0:
+                api.micro_batcher = MicroBatcher(api.predict_single_rows, wait, max_batch_size)
+                api.micro_batcher.start()
+            else:
+                api.micro_batcher = None
+
+            latencies = [[] for _ in range(threads)]
+
+            def client(thread):
+                test_client = api.app.test_client()
+                for record in records[thread * requests_per_thread:(thread + 1) * requests_per_thread]:
+                    start = time.perf_counter()
+                    test_client.post('/predict', json=record)
+                    latencies[thread].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            workers = [threading.Thread(target=client, args=(thread,)) for thread in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            case = f'wait_{wait}ms_threads_{threads}'
+            results[case] = dict(summarize_latencies([latency for thread in latencies for latency in thread]),
+                                 requests_per_s=threads * requests_per_thread / elapsed)
+            if api.micro_batcher is not None:
+                results[case]['mean_batch'] = api.micro_batcher.stats()['mean_batch_size']
+
+    print_results(f'Micro-batching ({requests_per_thread} single-row requests per client thread)', results)
+    return results
+
+def bench_suite(rows=50_000, calls=100, seed=42):
+    """
+    Benchmark the hot paths of the API and of the training pipeline.
+
+    Cases: the preprocess function of each registry entry on 1 row and on
+    `rows` rows, load_best_model, model.predict of each registry entry on 1
+    and 100 rows, /predict and /get_similar_diamonds end to end through the
+    Flask test client, the request log writer, and a full training run of
+    each registry entry (preprocess, train, evaluate and save to a temporary
+    model store) on a synthetic dataset of `rows` rows. Runs offline and on
+    CPU only; the API serves the project's best model and dataset.
+
+    Parameters:
+    rows (int): Number of rows of the synthetic dataset.
+    calls (int): Number of calls per latency case.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    dict: Measurements per case.
+    """
+    from main import train_and_evaluate
+    from request_log import RequestLogWriter, init_db
+    from save_model import save_model_and_metrics
+
+    catalog = make_synthetic_catalog(rows, seed)
+    rng = np.random.default_rng(seed + 1)
+    samples = [catalog.iloc[[i]].reset_index(drop=True) for i in rng.integers(0, rows, calls)]
+    results = {}
+
+    # Preprocessing, 1 row vs the whole dataset
+    for model_type, model_details in model_registry.items():
+        preprocess_fn = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+        results[f'preprocess_{model_type}_1_row'] = time_calls(preprocess_fn, [(sample,) for sample in samples])
+        results[f'preprocess_{model_type}_{rows}_rows'] = time_calls(preprocess_fn, [(catalog,)] * 3)
+
+    # Training runs, saved to a throwaway model store
+    models = {}
+    data_sha256 = dataset_hash(catalog)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for model_type in model_registry:
+            start = time.perf_counter()
+            models[model_type], metrics = train_and_evaluate(model_type, catalog)
+            save_model_and_metrics(models[model_type], metrics, model_type, store_dir=tmp_dir)
+            results[f'train_{model_type}_{rows}_rows'] = {'wall_s': time.perf_counter() - start, 'R2': metrics['R2'],
+                                                          'data_sha256': data_sha256, 'split_seed': metrics['split_seed']}
+
+    # model.predict on the model's own input, 1 and 100 rows
+    encoders = build_feature_encoders()
+    for model_type, model in models.items():
+        as_frame = model_registry[model_type]['predict_input'] == 'dataframe'
+        for batch_size in (1, 100):
+            batches = [(encoders[model_type].transform(catalog.iloc[rng.integers(0, rows, batch_size)], as_frame=as_frame),)
+                       for _ in range(calls)]
+            results[f'predict_{model_type}_{batch_size}'] = time_calls(model.predict, batches)
+
+    # API, end to end through the Flask test client
+    api = import_api()
+    api.prediction_cache = None
+    results['load_best_model'] = time_calls(api.load_best_model, [()] * 10)
+
+    test_client = api.app.test_client()
+    records = catalog.drop(columns='price').to_dict(orient='records')
+    results['api_predict_1'] = time_calls(lambda record: test_client.post('/predict', json=record),
+                                          [(records[i],) for i in rng.integers(0, rows, calls)])
+    results['api_predict_100'] = time_calls(lambda batch: test_client.post('/predict', json=batch),
+                                            [([records[i] for i in rng.integers(0, rows, 100)],) for _ in range(calls)])
+    results['api_similar_diamonds'] = time_calls(
+        lambda record: test_client.post('/get_similar_diamonds', json=dict(record, weight=record['carat'], n=5)),
+        [(records[i],) for i in rng.integers(0, rows, calls)])
+    results['api_diamonds_by_price'] = time_calls(
+        lambda low: test_client.post('/get_diamonds_by_price', json={'min_price': low, 'max_price': low * 1.2, 'min_cut': 'Very Good'}),
+        [(float(low),) for low in rng.uniform(500, 15000, calls)])
+
+    # Request log: enqueue latency and write throughput
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'requests.db')
+        init_db(db_path)
+        writer = RequestLogWriter(db_path, max_queue_size=100_000)
+        writer.start()
+        entries = [('/predict', records[i], {'predictions': [1000.0]}) for i in rng.integers(0, rows, 10_000)]
+        start = time.perf_counter()
+        results['request_log'] = time_calls(writer.log, entries)
+        writer.flush()
+        results['request_log']['entries_per_s'] = len(entries) / (time.perf_counter() - start)
+        writer.stop()
+
+    print_results(f'Suite ({rows:,} synthetic rows, {calls} calls per case)', results)
+    return results
+
+def get_environment():
+    """
+    Describe the machine and library versions a benchmark ran with.
+
+    Returns:
+    dict: Python, platform, CPU count and library versions.
+    """
+    import platform
+    import sklearn
+    import xgboost
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'xgboost': xgboost.__version__
+    }
+
+def save_results(path, benchmark, params, results):
+    """
+    Save benchmark results as JSON, with the parameters and the environment of the run.
+
+    Parameters:
+    path (str): Path of the JSON file.
+    benchmark (str): Name of the benchmark.
+    params (dict): Parameters of the run.
+    results (dict): The measurements.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    run = {
+        'benchmark': benchmark,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'params': params,
+        'environment': get_environment(),
+        'results': results
+    }
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=4)
+    print(f'\nResults saved to {path}')
+
+def compare_to_baseline(results, baseline_path, tolerance=0.2):
+    """
+    Compare results with a saved run and report the regressions.
+
+    Latencies and durations (keys ending in _us, _ms or _s) regress when they
+    grow by more than `tolerance`, throughputs (keys ending in _per_s) when
+    they drop by more than `tolerance`. p99 latencies are compared but never
+    reported as regressions, and other values are not compared. R2 regresses
+    when it drops by more than R2_TOLERANCE, and is only compared when both
+    runs record the same dataset hash and split seed: otherwise it is reported
+    as not comparable.
+
+    Parameters:
+    results (dict): The measurements of this run.
+    baseline_path (str): Path of the saved baseline run.
+    tolerance (float): Relative change allowed before a regression is reported.
+
+    Returns:
+    list: The regressions, as (case, metric, baseline value, current value).
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)['results']
+
+    comparison = {}
+    regressions = []
+    for case, values in results.items():
+        for metric, value in values.items():
+            base = baseline.get(case, {}).get(metric)
+            if metric == 'R2' and isinstance(base, (int, float)):
+                # Scores on other test rows say nothing about the change
+                if any(values.get(key) is None or values.get(key) != baseline[case].get(key) for key in ('data_sha256', 'split_seed')):
+                    comparison.setdefault(case, {})[metric] = 'not comparable'
+                    continue
+                regressed = value < base - R2_TOLERANCE
+                comparison.setdefault(case, {})[metric] = f'{value - base:+.4f}' + (' REGRESSION' if regressed else '')
+                if regressed:
+                    regressions.append((case, metric, base, value))
+                continue
+            if not isinstance(value, (int, float)) or not isinstance(base, (int, float)) or base == 0:
+                continue
+            ratio = value / base
+            if metric.endswith('_per_s'):
+                regressed = ratio < 1 - tolerance
+            elif metric.endswith(('_us', '_ms', '_s')):
+                # Tail latencies are shown but too noisy to gate on
+                regressed = ratio > 1 + tolerance and not metric.startswith('p99')
+            else:
+                continue
+            comparison.setdefault(case, {})[metric] = f'{ratio:.2f}x' + (' REGRESSION' if regressed else '')
+            if regressed:
+                regressions.append((case, metric, base, value))
+
+    print(f'\nCompared to {baseline_path} (current / baseline, tolerance {tolerance:.0%}; R2 as current - baseline)')
+    for case, values in comparison.items():
+        print(f"  {case:<28} {'  '.join(f'{metric}={ratio}' for metric, ratio in values.items())}")
+    print(f'{len(regressions)} regression(s).')
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmarks.")
+    parser.add_argument('--output', default=None, help="Save the results as JSON to this path")
+    parser.add_argument('--baseline', default=None, help="Compare the results with a saved run and exit with 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Relative change allowed before a regression is reported")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    suite_parser = subparsers.add_parser('suite', help="API and pipeline hot paths")
+    suite_parser.add_argument('--rows', type=int, default=50_000, help="Rows of the synthetic dataset")
+    suite_parser.add_argument('--calls', type=int, default=100, help="Calls per latency case")
+
+    similarity_parser = subparsers.add_parser('similarity', help="Similar diamonds search")
+    similarity_parser.add_argument('--rows', type=int, default=200_000, help="Rows of the synthetic catalog")
+    similarity_parser.add_argument('--queries', type=int, default=200, help="Number of queries per case")
+    similarity_parser.add_argument('--n', type=int, default=5, help="Diamonds returned per query")
+
+    dataset_parser = subparsers.add_parser('dataset', help="Dataset load from CSV vs columnar cache")
+    dataset_parser.add_argument('--rows', type=int, default=1_000_000, help="Rows of the synthetic dataset")
+    dataset_parser.add_argument('--repeats', type=int, default=3, help="Loads per case")
+
+    models_parser = subparsers.add_parser('models', help="Model load from joblib vs export")
+    models_parser.add_argument('--repeats', type=int, default=5, help="Cold starts per case")
+
+    inference_parser = subparsers.add_parser('inference', help="Model predict vs fast inference backends")
+    inference_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 10_000], help="Rows per call")
+    inference_parser.add_argument('--calls', type=int, default=200, help="Calls per case")
+
+    batching_parser = subparsers.add_parser('batching', help="/predict with and without micro-batching")
+    batching_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help="Concurrent client threads")
+    batching_parser.add_argument('--wait-ms', type=float, nargs='+', default=[0, 1, 2, 5], help="Micro-batching windows (0 disables)")
+    batching_parser.add_argument('--requests', type=int, default=100, help="Requests per client thread")
+    batching_parser.add_argument('--max-batch-size', type=int, default=64, help="Maximum rows per micro-batch")
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'suite':
+        results = bench_suite(args.rows, args.calls)
+    elif args.benchmark == 'similarity':
+        results = bench_similarity(args.rows, args.queries, args.n)
+    elif args.benchmark == 'dataset':
+        results = bench_dataset_load(args.rows, args.repeats)
+    elif args.benchmark == 'models':
+        results = bench_model_load(args.repeats)
+    elif args.benchmark == 'inference':
+        results = bench_inference(tuple(args.batch_sizes), args.calls)
+    elif args.benchmark == 'batching':
+        results = bench_micro_batching(tuple(args.concurrency), tuple(args.wait_ms), args.requests, args.max_batch_size)
+
+    if args.output:
+        params = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'tolerance')}
+        save_results(args.output, args.benchmark, params, results)
+    if args.baseline and compare_to_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
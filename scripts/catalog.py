@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from data_preprocessing import load_data, CUT_CATEGORIES, COLOR_CATEGORIES, CLARITY_CATEGORIES
+from dataset_cache import load_columns
+
+"""
+Catalog
+
+This module holds the diamond catalog served by the API in compact columns:
+category codes for cut, color and clarity, float32 for the measurements and
+int32 for the prices. Loaded from the dataset cache, the columns are read-only
+memory maps of the cache files, so every worker process of the API attaches
+to the same copy in the page cache instead of holding its own dataframe.
+Query results are serialized to JSON straight from the columns.
+
+Classes:
+   CompactCatalog -- Column-wise, read-only catalog.
+
+Functions:
+   load_catalog -- Loads the catalog of a dataset file.
+"""
+
+# Categories of the categorical columns, in the order of the dataset cache
+CATEGORIES = {'cut': CUT_CATEGORIES, 'color': COLOR_CATEGORIES, 'clarity': CLARITY_CATEGORIES}
+
+
+def _format_values(values):
+   """
+   Format values as JSON numbers, null for missing values.
+
+   float32 values keep their shortest decimal form (0.3, not 0.30000001192092896).
+
+   Returns:
+   list: The JSON text of each value.
+   """
+   text = values.astype(str).astype(object)
+   if values.dtype.kind == 'f':
+      text[~np.isfinite(values)] = 'null'
+   return text.tolist()
+
+
+class CompactCatalog:
+   """
+   Read-only catalog stored column by column in compact NumPy arrays.
+
+   Categorical columns are kept as integer codes (-1 for missing values)
+   with their categories, the other columns as they are stored in the
+   dataset cache. Row positions are the row numbers of the dataset.
+
+   Parameters:
+   columns (dict): Column name to array, in dataset column order.
+   categories (dict): Categories of each categorical column.
+   """
+
+   def __init__(self, columns, categories=None):
+      # Plain ndarray views of the memory maps: indexing them does not copy the whole column
+      self.columns = {name: np.asarray(values) for name, values in columns.items()}
+      self.categories = categories or {}
+      self.n_rows = len(next(iter(self.columns.values()))) if self.columns else 0
+
+   @classmethod
+   def from_frame(cls, df):
+      """
+      Build a catalog from a dataframe.
+
+      Text and categorical columns are converted to codes, the other columns
+      keep their dtype so no precision is lost.
+
+      Parameters:
+      df (pd.DataFrame): The dataset.
+
+      Returns:
+      CompactCatalog: The catalog, held in memory.
+      """
+      columns, categories = {}, {}
+      for name in df.columns:
+         values = df[name]
+         if isinstance(values.dtype, pd.CategoricalDtype):
+            categories[name] = list(values.cat.categories)
+         elif values.dtype == object:
+            known = CATEGORIES.get(name)
+            if known is not None and set(values.dropna().unique()) <= set(known):
+               categories[name] = known
+            else:
+               categories[name] = sorted(values.dropna().unique().tolist())
+         else:
+            columns[name] = values.to_numpy()
+            continue
+         columns[name] = pd.Categorical(values, categories=categories[name]).codes.astype(np.int8)
+      return cls(columns, categories)
+
+   def __len__(self):
+      return self.n_rows
+
+   def column(self, name):
+      """
+      Return a column: the codes of a categorical column, the values otherwise.
+
+      Parameters:
+      name (str): Name of the column.
+
+      Returns:
+      np.ndarray: The read-only column.
+      """
+      return self.columns[name]
+
+   def take(self, positions):
+      """
+      Build a dataframe of some rows, indexed by their positions.
+
+      Parameters:
+      positions (np.ndarray or slice): Row positions.
+
+      Returns:
+      pd.DataFrame: The rows, with categorical columns as pd.Categorical.
+      """
+      index = np.arange(self.n_rows)[positions]
+      data = {}
+      for name, values in self.columns.items():
+         if name in self.categories:
+            data[name] = pd.Categorical.from_codes(values[positions], categories=self.categories[name])
+         else:
+            data[name] = values[positions]
+      return pd.DataFrame(data, index=index)
+
+   def group_positions(self, attributes):
+      """
+      Group the rows by the values of categorical columns.
+
+      Rows with a missing value in one of the columns are left out.
+
+      Parameters:
+      attributes (tuple): Names of the categorical columns.
+
+      Returns:
+      dict: Tuple of category values to the sorted positions of its rows.
+      """
+      if not attributes:
+         return {(): np.arange(self.n_rows)}
+
+      codes = [self.columns[attribute].astype(np.int64) for attribute in attributes]
+      combined = np.zeros(self.n_rows, dtype=np.int64)
+      valid = np.ones(self.n_rows, dtype=bool)
+      for attribute, attribute_codes in zip(attributes, codes):
+         combined = combined * len(self.categories[attribute]) + attribute_codes
+         valid &= attribute_codes >= 0
+
+      positions = np.flatnonzero(valid)
+      positions = positions[np.argsort(combined[positions], kind='stable')]
+      boundaries = np.flatnonzero(np.diff(combined[positions])) + 1
+
+      groups = {}
+      for group in np.split(positions, boundaries):
+         if len(group):
+            key = tuple(self.categories[attribute][attribute_codes[group[0]]] for attribute, attribute_codes in zip(attributes, codes))
+            groups[key] = group
+      return groups
+
+   def extends(self, other):
+      """
+      Check whether this catalog starts with every row of another one, in order.
+
+      Parameters:
+      other (CompactCatalog): The other catalog.
+
+      Returns:
+      bool: True if only rows were appended to the other catalog.
+      """
+      if len(self) < len(other) or list(self.columns) != list(other.columns) or self.categories != other.categories:
+         return False
+      return all(np.array_equal(self.columns[name][:len(other)], values, equal_nan=values.dtype.kind == 'f')
+                 for name, values in other.columns.items())
+
+   def to_json(self, positions, extra=None):
+      """
+      Serialize rows to a JSON array of records, without building a dataframe.
+
+      Parameters:
+      positions (np.ndarray): Row positions, in output order.
+      extra (dict): Additional float columns aligned with positions, e.g. {'distance': distances}.
+
+      Returns:
+      str: The JSON array of records.
+      """
+      positions = np.asarray(positions, dtype=np.intp)
+      fields = []
+      for name, values in self.columns.items():
+         if name in self.categories:
+            # Code -1 picks the trailing null
+            lookup = np.array([json.dumps(category) for category in self.categories[name]] + ['null'], dtype=object)
+            fields.append((json.dumps(name), lookup[values[positions]].tolist()))
+         else:
+            fields.append((json.dumps(name), _format_values(values[positions])))
+      for name, values in (extra or {}).items():
+         fields.append((json.dumps(name), _format_values(np.asarray(values, dtype=np.float64))))
+
+      records = ('{' + ','.join(f'{name}:{column[i]}' for name, column in fields) + '}' for i in range(len(positions)))
+      return '[' + ','.join(records) + ']'
+
+
+def load_catalog(data_path):
+   """
+   Load the catalog of a dataset file.
+
+   Local CSV files are memory-mapped from their dataset cache (built on first
+   use), other sources, and files whose cache directory is not writable, are
+   parsed and converted in memory.
+
+   Parameters:
+   data_path (str): Path to the dataset CSV file.
+
+   Returns:
+   CompactCatalog: The catalog.
+   """
+   if not isinstance(data_path, str) or not os.path.isfile(data_path):
+      return CompactCatalog.from_frame(load_data(data_path))
+
+   try:
+      arrays, meta = load_columns(data_path, mmap=True, categories=CATEGORIES)
+   except OSError as e:
+      logging.warning(f"Dataset cache unavailable, parsing {data_path} instead: {e}")
+      return CompactCatalog.from_frame(load_data(data_path, use_cache=False))
+   categories = {column['name']: column['categories'] for column in meta['columns'] if column['kind'] == 'category'}
+   return CompactCatalog(arrays, categories)
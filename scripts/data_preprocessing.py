@@ -1,18 +1,50 @@
+import logging
+import os
+import numpy as np
 import pandas as pd
+from dataset_cache import load_dataset, to_float64
 
-def load_data(file_path):
+CUT_CATEGORIES = ['Fair', 'Good', 'Very Good', 'Premium', 'Ideal']
+COLOR_CATEGORIES = ['D', 'E', 'F', 'G', 'H', 'I', 'J']
+CLARITY_CATEGORIES = ['I1', 'SI2', 'SI1', 'VS2', 'VS1', 'VVS2', 'VVS1', 'IF']
+NUMERIC_FEATURES = ['carat', 'depth', 'table', 'x', 'y', 'z']
+
+def load_data(file_path, use_cache=True):
    """
    Load the dataset from a given file path.
 
+   The CSV is read through its typed columnar cache (see dataset_cache), built
+   on first use and rebuilt when the file changes: cut, color and clarity are
+   categorical. The cache stores floats as float32 and integers as int32, but
+   they are returned as float64 and int64, with the values the CSV parse
+   gives, so training is the same either way. If the cache directory is not
+   writable, the CSV is parsed instead.
+
    Parameters:
    file_path (str): The path to the CSV file.
+   use_cache (bool): Read through the columnar cache instead of parsing the CSV.
 
    Returns:
    pd.DataFrame: Loaded dataframe.
    """
 
-   df = pd.read_csv(file_path)
-   
+   # URLs and buffers are parsed directly, only local files are cached
+   if not use_cache or not isinstance(file_path, str) or not os.path.isfile(file_path):
+      return pd.read_csv(file_path)
+
+   categories = {'cut': CUT_CATEGORIES, 'color': COLOR_CATEGORIES, 'clarity': CLARITY_CATEGORIES}
+   try:
+      df = load_dataset(file_path, categories)
+   except OSError as e:
+      logging.warning(f"Dataset cache unavailable, parsing {file_path} instead: {e}")
+      return pd.read_csv(file_path)
+
+   # Only the storage is compact: a float32 feature matrix changes the fitted models
+   for column in df.columns:
+      if df[column].dtype == np.float32:
+         df[column] = to_float64(df[column].to_numpy())
+      elif df[column].dtype == np.int32:
+         df[column] = df[column].astype(np.int64)
    return df
 
 def preprocess_categorical_single_row(row): 
@@ -27,9 +59,9 @@ def preprocess_categorical_single_row(row):
    pd.DataFrame: A dataframe with one-hot encoded categorical features and other columns.
    """
 
-   cut_categories = ['Fair', 'Good', 'Very Good', 'Premium', 'Ideal']
-   color_categories = ['D', 'E', 'F', 'G', 'H', 'I', 'J']
-   clarity_categories = ['I1', 'SI2', 'SI1', 'VS2', 'VS1', 'VVS2', 'VVS1', 'IF']
+   cut_categories = CUT_CATEGORIES
+   color_categories = COLOR_CATEGORIES
+   clarity_categories = CLARITY_CATEGORIES
     
    dummy_columns = (
       ['cut_' + cat for cat in cut_categories[0:]] +
@@ -65,9 +97,9 @@ def preprocess_categorical_multiple_rows(df):
 
    df = df.copy()  
 
-   cut_categories = ['Fair', 'Good', 'Very Good', 'Premium', 'Ideal']
-   color_categories = ['D', 'E', 'F', 'G', 'H', 'I', 'J']
-   clarity_categories = ['I1', 'SI2', 'SI1', 'VS2', 'VS1', 'VVS2', 'VVS1', 'IF']
+   cut_categories = CUT_CATEGORIES
+   color_categories = COLOR_CATEGORIES
+   clarity_categories = CLARITY_CATEGORIES
     
    df['cut'] = pd.Categorical(df['cut'], categories=cut_categories)
    df['color'] = pd.Categorical(df['color'], categories=color_categories)
@@ -86,6 +118,69 @@ def preprocess_categorical_multiple_rows(df):
 
    return df
 
+def split_valid_rows(df):
+   """
+   Separate the rows that can be scored from the ones the preprocessing would reject.
+   Used for API batch requests, so that a bad row is reported instead of being
+   silently dropped by the preprocessing filters. Numeric features must be
+   finite numbers: NaN, infinite values and booleans are rejected.
+
+   Parameters:
+   df (pd.DataFrame): The raw feature rows.
+
+   Returns:
+   tuple: The valid rows with numeric features cast to float (original index kept),
+   and a pd.Series aligned with df holding an error message for each invalid row
+   and None for valid rows.
+   """
+
+   errors = np.full(len(df), None, dtype=object)
+   # Rows without an error so far: only the first error of a row is reported
+   pending = np.ones(len(df), dtype=bool)
+   coerced = {}
+
+   for col in NUMERIC_FEATURES:
+      if col not in df.columns:
+         errors[pending] = f"Missing feature '{col}'."
+         pending[:] = False
+         continue
+      column = df[col]
+      # JSON true/false would otherwise be cast to 1.0/0.0
+      if column.dtype.kind == 'b':
+         booleans = np.ones(len(df), dtype=bool)
+      elif column.dtype == object:
+         booleans = np.fromiter((isinstance(value, (bool, np.bool_)) for value in column), dtype=bool, count=len(df))
+      else:
+         booleans = np.zeros(len(df), dtype=bool)
+      if column.dtype.kind not in 'fiu':
+         column = coerced[col] = pd.to_numeric(column.where(~booleans), errors='coerce')
+      # NaN, infinite values ('inf', JSON Infinity) and booleans
+      invalid = pending & (~np.isfinite(column.to_numpy(dtype=np.float64)) | booleans)
+      errors[invalid] = f"Feature '{col}' must be a number."
+      pending &= ~invalid
+
+   for col, categories in (('cut', CUT_CATEGORIES), ('color', COLOR_CATEGORIES), ('clarity', CLARITY_CATEGORIES)):
+      if col not in df.columns:
+         errors[pending] = f"Missing feature '{col}'."
+         pending[:] = False
+         continue
+      invalid = pending & ~df[col].isin(categories).to_numpy()
+      errors[invalid] = f"Feature '{col}' must be one of {categories}."
+      pending &= ~invalid
+
+   # Same condition as the dimension filter applied by the preprocess functions
+   if pending.any():
+      dimensions = [coerced.get(col, df[col]).to_numpy(dtype=np.float64) for col in ('x', 'y', 'z')]
+      invalid = pending & (dimensions[0] * dimensions[1] * dimensions[2] == 0)
+      errors[invalid] = "Features 'x', 'y' and 'z' must be non-zero."
+      pending &= ~invalid
+
+   valid_df = df.assign(**coerced) if coerced else df
+   valid_df = valid_df[pending]
+   errors = pd.Series(errors, index=df.index, dtype=object)
+
+   return valid_df, errors
+
 def linear_model_preprocess(df):
    """
    Preprocess the dataframe for the linear regression model.
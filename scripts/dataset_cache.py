@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+"""
+Dataset Cache
+
+This module converts a CSV dataset once into a typed columnar store and reads
+it back from there. Each column is saved as its own .npy file: text columns as
+integer category codes, floats as float32 and integers as int32, so a load is
+a memory map instead of a CSV parse with inferred dtypes. The store is keyed by
+the SHA-256 of the CSV and rebuilt automatically when the CSV changes. Caches
+live in one directory, DATASET_CACHE_DIR if set, so the data directory can be
+read-only.
+
+Functions:
+   get_cache_dir -- Returns the directory of the dataset caches.
+   load_dataset -- Loads a CSV dataset through its columnar cache.
+   load_columns -- Returns the cached columns as (memory-mapped) NumPy arrays.
+   build_dataset_cache -- Converts a CSV file into its columnar cache.
+"""
+
+FORMAT_VERSION = 1
+
+
+def get_cache_dir():
+   """
+   Get the directory holding the caches of every dataset.
+
+   Returns:
+   str: DATASET_CACHE_DIR if set, else 'diamonds/datasets' in XDG_CACHE_HOME if set,
+   else '.cache/datasets' in the project root.
+   """
+   if os.environ.get('DATASET_CACHE_DIR'):
+      return os.path.abspath(os.environ['DATASET_CACHE_DIR'])
+   if os.environ.get('XDG_CACHE_HOME'):
+      return os.path.join(os.environ['XDG_CACHE_HOME'], 'diamonds', 'datasets')
+   project_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+   return os.path.join(project_root, '.cache', 'datasets')
+
+def get_cache_root(csv_path):
+   """
+   Get the directory holding the cache entries of a CSV file.
+
+   Parameters:
+   csv_path (str): Path to the CSV file.
+
+   Returns:
+   str: The cache directory, '<file name>-<hash of its absolute path>' in the cache directory.
+   """
+   csv_path = os.path.abspath(csv_path)
+   # CSV files of the same name in different directories get their own caches
+   path_key = hashlib.sha256(csv_path.encode()).hexdigest()[:12]
+   return os.path.join(get_cache_dir(), f'{os.path.basename(csv_path)}-{path_key}')
+
+def file_hash(path, chunk_size=1 << 20, size=None):
+   """
+   Compute the SHA-256 of a file.
+
+   Parameters:
+   path (str): Path to the file.
+   chunk_size (int): Bytes read at a time.
+   size (int): Only hash the first size bytes of the file.
+
+   Returns:
+   str: The hex digest of the file content.
+   """
+   digest = hashlib.sha256()
+   remaining = size if size is not None else float('inf')
+   with open(path, 'rb') as f:
+      while remaining > 0:
+         chunk = f.read(int(min(chunk_size, remaining)))
+         if not chunk:
+            break
+         digest.update(chunk)
+         remaining -= len(chunk)
+   return digest.hexdigest()
+
+def source_hash(csv_path):
+   """
+   Get the SHA-256 of a CSV file, reusing the last one while its size and mtime are unchanged.
+
+   Parameters:
+   csv_path (str): Path to the CSV file.
+
+   Returns:
+   str: The hex digest of the CSV file.
+   """
+   cache_root = get_cache_root(csv_path)
+   stat = os.stat(csv_path)
+   signature = [stat.st_size, stat.st_mtime_ns]
+   memo_path = os.path.join(cache_root, 'source.json')
+
+   try:
+      with open(memo_path, 'r') as f:
+         memo = json.load(f)
+      if memo['signature'] == signature:
+         return memo['sha256']
+   except (OSError, ValueError, KeyError):
+      pass
+
+   digest = file_hash(csv_path)
+   os.makedirs(cache_root, exist_ok=True)
+   tmp_path = f'{memo_path}.{os.getpid()}.tmp'
+   with open(tmp_path, 'w') as f:
+      json.dump({'signature': signature, 'sha256': digest}, f)
+   os.replace(tmp_path, memo_path)
+   return digest
+
+def _compact_column(values, categories=None):
+   """
+   Convert a CSV column to its compact storage.
+
+   Returns:
+   tuple: The stored array and the column metadata.
+   """
+   if values.dtype == object:
+      if categories is None or not set(values.dropna().unique()) <= set(categories):
+         categories = sorted(values.dropna().unique().tolist())
+      codes = pd.Categorical(values, categories=categories).codes
+      dtype = np.int8 if len(categories) < 128 else np.int16 if len(categories) < 32768 else np.int32
+      # Code -1 stands for missing values
+      return codes.astype(dtype), {'kind': 'category', 'categories': categories}
+   if values.dtype.kind == 'f':
+      return values.to_numpy(dtype=np.float32), {'kind': 'float32'}
+   if values.dtype.kind in 'iu' and values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+      return values.to_numpy(dtype=np.int32), {'kind': 'int32'}
+   return values.to_numpy(), {'kind': str(values.dtype)}
+
+def build_dataset_cache(csv_path, digest=None, categories=None):
+   """
+   Convert a CSV file into its columnar cache.
+
+   The entry is written to a temporary directory and renamed into place, so
+   concurrent readers never see a partial entry. Entries of older versions of
+   the CSV are removed.
+
+   Parameters:
+   csv_path (str): Path to the CSV file.
+   digest (str): SHA-256 of the CSV file, computed if not given.
+   categories (dict): Ordered categories of known text columns; other text columns use their sorted values.
+
+   Returns:
+   str: The directory of the cache entry.
+   """
+   digest = digest or source_hash(csv_path)
+   cache_root = get_cache_root(csv_path)
+   entry_dir = os.path.join(cache_root, digest)
+   tmp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+   os.makedirs(tmp_dir, exist_ok=True)
+
+   df = pd.read_csv(csv_path)
+   columns = []
+   for name in df.columns:
+      array, meta = _compact_column(df[name], (categories or {}).get(name))
+      np.save(os.path.join(tmp_dir, f'{len(columns)}.npy'), array)
+      columns.append(dict(meta, name=name))
+
+   with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+      json.dump({'format': FORMAT_VERSION, 'sha256': digest, 'rows': len(df), 'columns': columns}, f, indent=4)
+
+   try:
+      os.rename(tmp_dir, entry_dir)
+   except OSError:
+      # Another process built the same entry first
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+
+   for name in os.listdir(cache_root):
+      path = os.path.join(cache_root, name)
+      if name != digest and os.path.isdir(path) and not name.endswith('.tmp'):
+         shutil.rmtree(path, ignore_errors=True)
+
+   return entry_dir
+
+def _cache_entry(csv_path, categories=None):
+   digest = source_hash(csv_path)
+   entry_dir = os.path.join(get_cache_root(csv_path), digest)
+   meta_path = os.path.join(entry_dir, 'meta.json')
+   meta = None
+   if os.path.exists(meta_path):
+      with open(meta_path, 'r') as f:
+         meta = json.load(f)
+   if meta is None or meta.get('format') != FORMAT_VERSION:
+      if meta is not None:
+         shutil.rmtree(entry_dir, ignore_errors=True)
+      entry_dir = build_dataset_cache(csv_path, digest, categories)
+      with open(os.path.join(entry_dir, 'meta.json'), 'r') as f:
+         meta = json.load(f)
+   return entry_dir, meta
+
+def load_columns(csv_path, mmap=True, categories=None):
+   """
+   Return the cached columns of a CSV dataset as NumPy arrays, building the cache if needed.
+
+   Parameters:
+   csv_path (str): Path to the CSV file.
+   mmap (bool): Memory-map the arrays read-only instead of reading them into memory.
+   categories (dict): Ordered categories of known text columns, used if the cache is built.
+
+   Returns:
+   tuple: A dict of column name to array (category codes for categorical columns)
+   and the cache metadata with the categories of each column.
+   """
+   entry_dir, meta = _cache_entry(csv_path, categories)
+   arrays = {}
+   for i, column in enumerate(meta['columns']):
+      arrays[column['name']] = np.load(os.path.join(entry_dir, f'{i}.npy'), mmap_mode='r' if mmap else None)
+   return arrays, meta
+
+def load_dataset(csv_path, categories=None):
+   """
+   Load a CSV dataset through its typed columnar cache.
+
+   Text columns are returned as pd.Categorical, floats as float32 and integers as int32.
+
+   Parameters:
+   csv_path (str): Path to the CSV file.
+   categories (dict): Ordered categories of known text columns, used if the cache is built.
+
+   Returns:
+   pd.DataFrame: The loaded dataset.
+   """
+   arrays, meta = load_columns(csv_path, mmap=True, categories=categories)
+   data = {}
+   for column in meta['columns']:
+      values = arrays[column['name']]
+      if column['kind'] == 'category':
+         data[column['name']] = pd.Categorical.from_codes(np.asarray(values), categories=column['categories'])
+      else:
+         data[column['name']] = np.asarray(values)
+   return pd.DataFrame(data)
+
+def to_float64(values):
+   """
+   Widen float32 values to float64 keeping their shortest decimal form (0.3 stays 0.3, not 0.30000001).
+
+   Only the distinct values go through their decimal form, which is the slow part.
+
+   Parameters:
+   values (np.ndarray): The float32 values.
+
+   Returns:
+   np.ndarray: The float64 values.
+   """
+   unique, inverse = np.unique(np.asarray(values), return_inverse=True)
+   return unique.astype(str).astype(np.float64)[inverse.reshape(-1)].reshape(np.shape(values))
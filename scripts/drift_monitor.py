@@ -0,0 +1,236 @@
+import threading
+import numpy as np
+from data_preprocessing import NUMERIC_FEATURES
+from dataset_cache import to_float64
+
+"""
+Drift Monitor
+
+This module tracks whether the diamonds sent to /predict still look like the
+training data. A reference profile bins every feature of the catalog once:
+quantile bins for the numeric features, one bin per grade for cut, color and
+clarity. Each scored request then only adds its rows to fixed-size bin
+counters, so the memory per feature stays constant however long the API runs,
+and the drift scores are computed from the counters on demand.
+
+Classes:
+   FeatureBins -- Binning of one feature, with its reference counts.
+   DriftMonitor -- Streaming bin counts of the scored rows, compared to the reference.
+
+Functions:
+   build_reference -- Bins every feature of a catalog.
+   psi -- Population stability index of two histograms.
+   ks_statistic -- Kolmogorov-Smirnov statistic of two histograms.
+"""
+
+# Quantile bins of each numeric feature in the reference profile
+DEFAULT_BINS = 20
+# Rows counted before scores are reported: a handful of requests cannot fill the bins and always looks drifted
+DEFAULT_MIN_ROWS = 500
+# Floor of the bin proportions in the PSI, so an empty bin does not make it infinite
+PSI_EPSILON = 1e-4
+# Categorical features of the profile
+CATEGORICAL_FEATURES = ['cut', 'color', 'clarity']
+
+
+class FeatureBins:
+   """
+   Binning of one feature with its bin counts in the reference data.
+
+   A numeric feature is binned by its edges: bin i holds the values in
+   [edges[i - 1], edges[i]), the first and last bins are open-ended. A
+   categorical feature has one bin per category and a last bin for unknown
+   values.
+
+   Parameters:
+   name (str): Name of the feature.
+   reference_counts (np.ndarray): Rows of the reference data in each bin.
+   edges (np.ndarray): Bin edges of a numeric feature.
+   categories (list): Categories of a categorical feature.
+   """
+
+   def __init__(self, name, reference_counts, edges=None, categories=None):
+      self.name = name
+      self.edges = np.asarray(edges, dtype=np.float64) if edges is not None else None
+      self.categories = list(categories) if categories is not None else None
+      self.codes = {category: code for code, category in enumerate(self.categories or [])}
+      self.reference_counts = np.asarray(reference_counts, dtype=np.int64)
+
+   @property
+   def n_bins(self):
+      return len(self.reference_counts)
+
+   def count(self, values):
+      """
+      Count values in each bin.
+
+      Parameters:
+      values (array-like): Values of the feature; numeric values must not be NaN.
+
+      Returns:
+      np.ndarray: The number of values in each bin.
+      """
+      if self.edges is not None:
+         bins = np.searchsorted(self.edges, np.asarray(values, dtype=np.float64), side='right')
+      else:
+         unknown = self.n_bins - 1
+         bins = [self.codes.get(value, unknown) for value in values]
+      return np.bincount(bins, minlength=self.n_bins)
+
+
+def build_reference(catalog, bins=DEFAULT_BINS):
+   """
+   Bin every feature of a catalog.
+
+   The edges of a numeric feature are values of the catalog at evenly spaced
+   quantiles, so each bin holds about the same share of the reference rows;
+   repeated edges are merged. Missing values are left out.
+
+   Parameters:
+   catalog (CompactCatalog): The training data.
+   bins (int): Number of bins of each numeric feature.
+
+   Returns:
+   dict: Feature name to its FeatureBins.
+   """
+   reference = {}
+   for name in NUMERIC_FEATURES:
+      values = catalog.column(name)
+      values = values[np.isfinite(values)]
+      # Values of the catalog: the reference rows equal to an edge fall in the same bin as requests sending that value
+      edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1], method='lower'))
+      counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+      reference[name] = FeatureBins(name, counts, edges=to_float64(edges) if edges.dtype == np.float32 else edges)
+
+   for name in CATEGORICAL_FEATURES:
+      codes = catalog.column(name)
+      categories = catalog.categories[name]
+      counts = np.append(np.bincount(codes[codes >= 0], minlength=len(categories)), 0)
+      reference[name] = FeatureBins(name, counts, categories=categories)
+   return reference
+
+
+def psi(expected, actual, epsilon=PSI_EPSILON):
+   """
+   Compute the population stability index of a histogram against a reference histogram.
+
+   Below 0.1 the distributions are usually considered stable, above 0.2 shifted.
+
+   Parameters:
+   expected (np.ndarray): Bin counts of the reference.
+   actual (np.ndarray): Bin counts of the observed values.
+   epsilon (float): Floor of the bin proportions.
+
+   Returns:
+   float: The index, None if either histogram is empty.
+   """
+   if expected.sum() == 0 or actual.sum() == 0:
+      return None
+   expected = np.maximum(expected / expected.sum(), epsilon)
+   actual = np.maximum(actual / actual.sum(), epsilon)
+   return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def ks_statistic(expected, actual):
+   """
+   Compute the Kolmogorov-Smirnov statistic of a histogram against a reference histogram.
+
+   The largest gap between the two cumulative distributions, measured at the
+   bin edges. For categorical features it depends on the order of the
+   categories, which are ordered grades here.
+
+   Parameters:
+   expected (np.ndarray): Bin counts of the reference.
+   actual (np.ndarray): Bin counts of the observed values.
+
+   Returns:
+   float: The statistic between 0 and 1, None if either histogram is empty.
+   """
+   if expected.sum() == 0 or actual.sum() == 0:
+      return None
+   return float(np.max(np.abs(np.cumsum(expected) / expected.sum() - np.cumsum(actual) / actual.sum())))
+
+
+class DriftMonitor:
+   """
+   Streaming bin counts of the scored rows, compared to the reference profile.
+
+   Besides the counts since startup, the monitor keeps the counts of the
+   last two windows of window_rows rows: when the current window is full,
+   it replaces the previous one and a new window starts. The recent scores
+   cover both windows, so they always reflect between window_rows and twice
+   window_rows of the latest rows. Memory is three counters per bin.
+
+   Parameters:
+   reference (dict): Feature name to its FeatureBins, from build_reference.
+   window_rows (int): Rows of a window.
+   data_version (str): Version of the training data of the reference.
+   min_rows (int): Rows counted before the scores of a period are reported.
+   """
+
+   def __init__(self, reference, window_rows=10000, data_version=None, min_rows=DEFAULT_MIN_ROWS):
+      self.reference = reference
+      self.window_rows = window_rows
+      self.min_rows = min_rows
+      self.data_version = data_version
+      self.reference_rows = int(next(iter(reference.values())).reference_counts.sum()) if reference else 0
+      self.total = {name: np.zeros(bins.n_bins, dtype=np.int64) for name, bins in reference.items()}
+      self.current = {name: np.zeros(bins.n_bins, dtype=np.int64) for name, bins in reference.items()}
+      self.previous = {name: np.zeros(bins.n_bins, dtype=np.int64) for name, bins in reference.items()}
+      self.total_rows = 0
+      self.current_rows = 0
+      self.previous_rows = 0
+      self.lock = threading.Lock()
+
+   def observe(self, df):
+      """
+      Add validated rows to the counts.
+
+      Parameters:
+      df (pd.DataFrame): Rows that passed validation, with every feature of the reference.
+      """
+      if df.empty:
+         return
+      # Binning happens outside the lock, only the additions are serialized
+      counts = {name: bins.count(df[name].to_numpy()) for name, bins in self.reference.items()}
+      with self.lock:
+         if self.current_rows >= self.window_rows:
+            self.previous, self.previous_rows = self.current, self.current_rows
+            self.current = {name: np.zeros(bins.n_bins, dtype=np.int64) for name, bins in self.reference.items()}
+            self.current_rows = 0
+         for name, feature_counts in counts.items():
+            self.total[name] += feature_counts
+            self.current[name] += feature_counts
+         self.total_rows += len(df)
+         self.current_rows += len(df)
+
+   def scores(self):
+      """
+      Score the drift of every feature over the recent windows and since startup.
+
+      Returns:
+      dict: For 'recent' and 'total', the rows counted and the PSI and KS
+      statistic of each feature (None until min_rows rows are counted).
+      """
+      with self.lock:
+         recent = {name: self.current[name] + self.previous[name] for name in self.reference}
+         total = {name: counts.copy() for name, counts in self.total.items()}
+         recent_rows = self.current_rows + self.previous_rows
+         total_rows = self.total_rows
+
+      def score(counts, rows):
+         if rows < self.min_rows:
+            features = {name: {'psi': None, 'ks': None} for name in self.reference}
+         else:
+            features = {name: {'psi': psi(bins.reference_counts, counts[name]), 'ks': ks_statistic(bins.reference_counts, counts[name])}
+                        for name, bins in self.reference.items()}
+         return {'rows': rows, 'features': features}
+
+      return {
+         'data_version': self.data_version,
+         'reference_rows': self.reference_rows,
+         'window_rows': self.window_rows,
+         'min_rows': self.min_rows,
+         'recent': score(recent, recent_rows),
+         'total': score(total, total_rows)
+      }
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from data_preprocessing import CUT_CATEGORIES, COLOR_CATEGORIES, CLARITY_CATEGORIES, NUMERIC_FEATURES
+from models_registry import model_registry, dynamic_import
+
+"""
+Feature Encoder
+
+This module turns raw diamond records into the model feature matrix without
+going through the per-request DataFrame preprocessing. An encoder is compiled
+once from the category lists and the column order produced by a registry
+entry's preprocess function, then maps records straight into a preallocated
+float32 matrix using integer category codes.
+
+Classes:
+   FeatureEncoder -- Encodes records into the feature matrix of a registry entry.
+
+Functions:
+   build_feature_encoders -- Builds one encoder per registry entry.
+"""
+
+CATEGORICAL_FEATURES = {
+   'cut': CUT_CATEGORIES,
+   'color': COLOR_CATEGORIES,
+   'clarity': CLARITY_CATEGORIES
+}
+
+# A valid row used to discover the output columns of a preprocess function
+PROBE_ROW = {
+   'carat': 1.0, 'cut': CUT_CATEGORIES[0], 'color': COLOR_CATEGORIES[0], 'clarity': CLARITY_CATEGORIES[0],
+   'depth': 60.0, 'table': 55.0, 'x': 1.0, 'y': 1.0, 'z': 1.0, 'price': 1
+}
+
+
+def _column(records, col):
+   if isinstance(records, pd.DataFrame):
+      return records[col].to_numpy()
+   return [record[col] for record in records]
+
+
+class FeatureEncoder:
+   """
+   Encode raw diamond records into a float32 feature matrix.
+
+   Numeric features are copied to their output column and every categorical
+   value is looked up once in a value -> column table, so one and many rows go
+   through the same vectorized code path. Unknown categories leave all their
+   one-hot columns at 0, like the preprocess functions do.
+
+   Parameters:
+   columns (list): Output feature columns, in the order expected by the model.
+   categorical_features (dict): Categories of each categorical feature.
+   """
+
+   def __init__(self, columns, categorical_features=CATEGORICAL_FEATURES):
+      self.columns = list(columns)
+      position = {col: i for i, col in enumerate(self.columns)}
+
+      self.numeric = [(col, position[col]) for col in NUMERIC_FEATURES if col in position]
+      self.categorical = []
+      for col, categories in categorical_features.items():
+         lookup = {cat: position[f'{col}_{cat}'] for cat in categories if f'{col}_{cat}' in position}
+         if lookup:
+            self.categorical.append((col, lookup))
+
+      # Raw features the encoded columns are computed from
+      self.numeric_features = [col for col, _ in self.numeric]
+      self.categorical_features = [col for col, _ in self.categorical]
+
+   @classmethod
+   def from_preprocess(cls, preprocess_function):
+      """
+      Compile an encoder matching the output of a preprocess function.
+
+      Parameters:
+      preprocess_function (function): A registry preprocess function.
+
+      Returns:
+      FeatureEncoder: Encoder producing the same columns, without 'price'.
+      """
+      probe = preprocess_function(pd.DataFrame([PROBE_ROW]))
+      return cls([col for col in probe.columns if col != 'price'])
+
+   def transform(self, records, as_frame=False):
+      """
+      Encode records into the feature matrix.
+
+      Parameters:
+      records (pd.DataFrame, dict or list): One record, a list of records or a dataframe.
+      as_frame (bool): Return a pd.DataFrame with the feature names instead of an array.
+
+      Returns:
+      np.ndarray: A (n_rows, n_features) float32 matrix, or a pd.DataFrame if as_frame.
+      """
+      if isinstance(records, dict):
+         records = [records]
+
+      n_rows = len(records)
+      features = np.zeros((n_rows, len(self.columns)), dtype=np.float32)
+
+      for col, position in self.numeric:
+         features[:, position] = _column(records, col)
+
+      rows = np.arange(n_rows)
+      for col, lookup in self.categorical:
+         codes = np.fromiter((lookup.get(value, -1) for value in _column(records, col)), dtype=np.intp, count=n_rows)
+         known = codes >= 0
+         features[rows[known], codes[known]] = 1
+
+      if as_frame:
+         return pd.DataFrame(features, columns=self.columns, copy=False)
+      return features
+
+
+def build_feature_encoders():
+   """
+   Build the feature encoder of every model in the registry.
+
+   Returns:
+   dict: Mapping of model names to their FeatureEncoder.
+   """
+   encoders = {}
+   for model_name, model_details in model_registry.items():
+      preprocess_function = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+      encoders[model_name] = FeatureEncoder.from_preprocess(preprocess_function)
+   return encoders
@@ -0,0 +1,160 @@
+import numpy as np
+from models_registry import model_registry, dynamic_import
+
+"""
+Inference
+
+This module builds the prediction backend used at serving time. A backend
+takes the encoded float32 feature matrix and returns prices, with the log
+transform of the registry entry already reversed. The fast backends call
+the model math directly: a NumPy dot product for linear models and booster
+in-place prediction for XGBoost, skipping the pandas and sklearn input checks
+of `model.predict`. The backend is picked per registry entry.
+
+Classes:
+   ModelBackend -- Calls the model's own predict method.
+   LinearBackend -- Dot product with the coefficients of a linear model.
+   XGBoostBackend -- In-place prediction with an XGBoost booster.
+
+Functions:
+   build_linear_backend -- Builds the backend of a linear model.
+   build_xgboost_backend -- Builds the backend of an XGBoost model.
+   build_backend -- Builds the backend of a model from its registry entry.
+"""
+
+
+class ModelBackend:
+   """
+   Backend calling the model's predict method.
+
+   Parameters:
+   model (sklearn model): The trained model.
+   log_transform (bool): Whether the model predicts the log of the price.
+   as_frame (bool): Whether the model expects a pd.DataFrame with the feature names.
+   """
+
+   def __init__(self, model, log_transform, as_frame=False):
+      self.model = model
+      self.log_transform = log_transform
+      self.as_frame = as_frame
+
+   def predict(self, features):
+      """
+      Predict the price of each row.
+
+      Parameters:
+      features (np.ndarray or pd.DataFrame): The encoded features.
+
+      Returns:
+      np.ndarray: The predicted prices.
+      """
+      predictions = self.model.predict(features)
+      return np.exp(predictions) if self.log_transform else predictions
+
+
+class LinearBackend:
+   """
+   Backend computing `features @ coef + intercept` with NumPy.
+
+   Parameters:
+   coef (np.ndarray): The coefficients, in feature order.
+   intercept (float): The intercept.
+   log_transform (bool): Whether the model predicts the log of the price.
+   """
+
+   as_frame = False
+
+   def __init__(self, coef, intercept, log_transform):
+      self.coef = np.ascontiguousarray(coef, dtype=np.float64)
+      self.intercept = float(intercept)
+      self.log_transform = log_transform
+
+   def predict(self, features):
+      """
+      Predict the price of each row.
+
+      Parameters:
+      features (np.ndarray): The encoded float32 features.
+
+      Returns:
+      np.ndarray: The predicted prices.
+      """
+      predictions = features @ self.coef
+      predictions += self.intercept
+      return np.exp(predictions, out=predictions) if self.log_transform else predictions
+
+
+class XGBoostBackend:
+   """
+   Backend predicting with the booster of an XGBoost model in place.
+
+   Parameters:
+   booster (xgboost.Booster): The booster of the model.
+   log_transform (bool): Whether the model predicts the log of the price.
+   """
+
+   as_frame = False
+
+   def __init__(self, booster, log_transform):
+      self.booster = booster
+      self.log_transform = log_transform
+
+   def predict(self, features):
+      """
+      Predict the price of each row.
+
+      Parameters:
+      features (np.ndarray): The encoded float32 features.
+
+      Returns:
+      np.ndarray: The predicted prices.
+      """
+      features = np.ascontiguousarray(features, dtype=np.float32)
+      predictions = self.booster.inplace_predict(features, validate_features=False)
+      return np.exp(predictions) if self.log_transform else predictions
+
+
+def build_linear_backend(model, log_transform):
+   """
+   Build the backend of a linear model.
+
+   Parameters:
+   model (LinearRegression or ExportedLinearModel): The model, with coef_ and intercept_.
+   log_transform (bool): Whether the model predicts the log of the price.
+
+   Returns:
+   LinearBackend: The backend.
+   """
+   return LinearBackend(model.coef_, model.intercept_, log_transform)
+
+def build_xgboost_backend(model, log_transform):
+   """
+   Build the backend of an XGBoost model.
+
+   Parameters:
+   model (XGBRegressor or ExportedXGBoostModel): The model.
+   log_transform (bool): Whether the model predicts the log of the price.
+
+   Returns:
+   XGBoostBackend: The backend.
+   """
+   booster = model.get_booster() if hasattr(model, 'get_booster') else model.booster
+   return XGBoostBackend(booster, log_transform)
+
+def build_backend(model, model_name, fast=True):
+   """
+   Build the prediction backend of a model from its registry entry.
+
+   Parameters:
+   model (sklearn model): The loaded model.
+   model_name (str): The registry name of the model.
+   fast (bool): Use the entry's fast backend if it has one, instead of the model's predict method.
+
+   Returns:
+   ModelBackend, LinearBackend or XGBoostBackend: The backend.
+   """
+   model_details = model_registry[model_name]
+   if fast and 'inference_function' in model_details:
+      build_fn = dynamic_import(model_details['inference_module'], model_details['inference_function'])
+      return build_fn(model, model_details['log_transform'])
+   return ModelBackend(model, model_details['log_transform'], model_details['predict_input'] == 'dataframe')
@@ -0,0 +1,473 @@
+import argparse
+import http.client
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+import numpy as np
+from benchmark import make_synthetic_catalog, import_api, print_results, save_results
+
+# Endpoint mix of the synthetic traffic when the request log is empty
+DEFAULT_TRAFFIC = {'/predict': 0.8, '/get_similar_diamonds': 0.2}
+# Relative difference allowed between a replayed and a logged prediction
+PREDICTION_RTOL = 1e-5
+
+
+def get_default_db_path():
+    """
+    Get the path of the API request log database.
+
+    Returns:
+    str: The absolute path to the database file.
+    """
+    return os.environ.get('REQUEST_LOG_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_requests.db'))
+
+def load_logged_requests(db_path, endpoints=None, limit=None):
+    """
+    Read the requests and responses of the request log, in the order they were served.
+
+    Parameters:
+    db_path (str): Path to the request log database.
+    endpoints (list): Only read these endpoints (default: every endpoint).
+    limit (int): Read at most this many requests (default: all).
+
+    Returns:
+    list: Dicts with the endpoint, the request body and the logged response.
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute('SELECT endpoint, request_data, response_data FROM requests ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+    entries = []
+    for endpoint, request_data, response_data in rows:
+        if endpoints and endpoint not in endpoints:
+            continue
+        payload = json.loads(request_data) if request_data else None
+        # Requests that failed before their body was parsed cannot be replayed
+        if payload is None:
+            continue
+        response = json.loads(response_data) if response_data else None
+        # The similar diamonds responses are logged as their JSON text
+        if isinstance(response, str):
+            response = json.loads(response)
+        entries.append({'endpoint': endpoint, 'payload': payload, 'response': response})
+        if limit and len(entries) >= limit:
+            break
+    return entries
+
+def describe_traffic(entries):
+    """
+    Get the shape of logged traffic: the endpoint mix, the /predict batch sizes and the number of diamonds asked for.
+
+    Parameters:
+    entries (list): The logged requests.
+
+    Returns:
+    dict: The share of each endpoint and the observed batch sizes and n values.
+    """
+    if not entries:
+        return {'endpoints': DEFAULT_TRAFFIC, 'batch_sizes': [1], 'n': [5]}
+
+    counts = {}
+    batch_sizes, n_values = [], []
+    for entry in entries:
+        counts[entry['endpoint']] = counts.get(entry['endpoint'], 0) + 1
+        payload = entry['payload']
+        if entry['endpoint'] == '/predict':
+            batch_sizes.append(len(payload) if isinstance(payload, list) else 1)
+        elif isinstance(payload, dict) and 'n' in payload:
+            n_values.append(payload['n'])
+
+    return {
+        'endpoints': {endpoint: count / len(entries) for endpoint, count in counts.items()},
+        'batch_sizes': batch_sizes or [1],
+        'n': n_values or [5]
+    }
+
+def make_synthetic_requests(shape, n_requests=10_000, seed=42):
+    """
+    Build synthetic requests following the shape of logged traffic.
+
+    Diamonds come from the synthetic catalog of the benchmarks; endpoints,
+    /predict batch sizes and n values are sampled from the shape.
+
+    Parameters:
+    shape (dict): The traffic shape, from describe_traffic.
+    n_requests (int): Number of requests.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    list: Dicts with the endpoint and the request body, without logged response.
+    """
+    rng = np.random.default_rng(seed)
+    endpoints = [endpoint for endpoint in shape['endpoints'] if endpoint in REQUEST_BUILDERS]
+    if not endpoints:
+        raise ValueError("The logged traffic has no endpoint the load test can generate requests for.")
+    shares = np.array([shape['endpoints'][endpoint] for endpoint in endpoints])
+
+    catalog = make_synthetic_catalog(max(n_requests, 1000), seed).drop(columns='price')
+    records = [{key: (value.item() if hasattr(value, 'item') else value) for key, value in record.items()}
+               for record in catalog.to_dict(orient='records')]
+
+    requests = []
+    for endpoint in rng.choice(endpoints, size=n_requests, p=shares / shares.sum()):
+        payload = REQUEST_BUILDERS[endpoint](records, shape, rng)
+        requests.append({'endpoint': str(endpoint), 'payload': payload, 'response': None})
+    return requests
+
+def _predict_request(records, shape, rng):
+    batch_size = int(rng.choice(shape['batch_sizes']))
+    batch = [records[i] for i in rng.integers(0, len(records), batch_size)]
+    return batch[0] if batch_size == 1 else batch
+
+def _similar_request(records, shape, rng):
+    record = records[rng.integers(0, len(records))]
+    return {'cut': record['cut'], 'color': record['color'], 'clarity': record['clarity'],
+            'weight': record['carat'], 'n': int(rng.choice(shape['n']))}
+
+def _nearest_request(records, shape, rng):
+    return dict(records[rng.integers(0, len(records))], n=int(rng.choice(shape['n'])))
+
+def _price_range_request(records, shape, rng):
+    min_price = round(float(rng.uniform(500, 15000)))
+    return {'min_price': min_price, 'max_price': round(min_price * 1.2), 'min_cut': 'Very Good', 'limit': 20}
+
+# Request body builders of the synthetic traffic, per endpoint
+REQUEST_BUILDERS = {
+    '/predict': _predict_request,
+    '/get_similar_diamonds': _similar_request,
+    '/get_nearest_diamonds': _nearest_request,
+    '/get_diamonds_by_price': _price_range_request
+}
+
+
+class TestClientTarget:
+    """
+    Send requests to the API in the current process through the Flask test client.
+
+    Parameters:
+    app (flask.Flask): The API application.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, endpoint, payload):
+        """
+        Send a POST request with a JSON body.
+
+        Returns:
+        tuple: The status code and the decoded JSON body (None if it is not JSON).
+        """
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        response = self._local.client.post(endpoint, json=payload)
+        try:
+            return response.status_code, json.loads(response.get_data(as_text=True))
+        except ValueError:
+            return response.status_code, None
+
+
+class HTTPTarget:
+    """
+    Send requests to a running API server over HTTP, with one keep-alive connection per thread.
+
+    Parameters:
+    url (str): Base URL of the server, e.g. http://127.0.0.1:8000.
+    timeout (float): Seconds before a request fails.
+    """
+
+    def __init__(self, url, timeout=30.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def send(self, endpoint, payload):
+        """
+        Send a POST request with a JSON body.
+
+        Returns:
+        tuple: The status code and the decoded JSON body (None if it is not JSON).
+        """
+        body = json.dumps(payload)
+        headers = {'Content-Type': 'application/json'}
+        for attempt in range(2):
+            if not hasattr(self._local, 'conn'):
+                self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._local.conn.request('POST', self.base_path + endpoint, body=body, headers=headers)
+                response = self._local.conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server may close an idle keep-alive connection: reconnect once
+                self._local.conn.close()
+                del self._local.conn
+                if attempt:
+                    raise
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+
+def predictions_match(logged, replayed):
+    """
+    Compare the predictions of a replayed /predict request with the logged ones.
+
+    Only responses of the same model are compared: the model name must be
+    equal, and the version too when both responses have one.
+
+    Parameters:
+    logged (dict): The logged response.
+    replayed (dict): The response to the replayed request.
+
+    Returns:
+    bool: Whether the predictions are equal within PREDICTION_RTOL, or None if they cannot be compared.
+    """
+    if not isinstance(logged, dict) or not isinstance(replayed, dict) or 'predictions' not in logged or 'predictions' not in replayed:
+        return None
+    if logged.get('model_name') != replayed.get('model_name'):
+        return None
+    if logged.get('model_version') and replayed.get('model_version') and logged['model_version'] != replayed['model_version']:
+        return None
+
+    # Invalid rows of a batch have a null prediction
+    expected = np.array([np.nan if value is None else value for value in logged['predictions']], dtype=np.float64)
+    actual = np.array([np.nan if value is None else value for value in replayed['predictions']], dtype=np.float64)
+    return expected.shape == actual.shape and bool(np.allclose(actual, expected, rtol=PREDICTION_RTOL, equal_nan=True))
+
+def send_request(target, entry, scheduled_at):
+    """
+    Send one request and record its outcome.
+
+    Parameters:
+    target (TestClientTarget or HTTPTarget): Where to send the request.
+    entry (dict): The endpoint, the request body and the logged response.
+    scheduled_at (float): perf_counter time the request was due, latency is measured from it.
+
+    Returns:
+    tuple: The endpoint, the latency in seconds, the status code (0 if the request failed) and the prediction check.
+    """
+    try:
+        status, body = target.send(entry['endpoint'], entry['payload'])
+    except Exception:
+        status, body = 0, None
+    latency = time.perf_counter() - scheduled_at
+    match = predictions_match(entry['response'], body) if entry['response'] is not None else None
+    return entry['endpoint'], latency, status, match
+
+def run_closed_loop(target, entries, concurrency, duration, max_requests=None):
+    """
+    Keep `concurrency` requests in flight: each client thread sends its next request as soon as the last one returns.
+
+    Parameters:
+    target (TestClientTarget or HTTPTarget): Where to send the requests.
+    entries (list): The requests, sent in order and cycled through.
+    concurrency (int): Number of client threads.
+    duration (float): Seconds during which requests are sent.
+    max_requests (int): Stop after this many requests (default: no limit).
+
+    Returns:
+    tuple: The request outcomes and the elapsed seconds.
+    """
+    counter = itertools.count()
+    lock = threading.Lock()
+    outcomes = [[] for _ in range(concurrency)]
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def client(thread):
+        while time.perf_counter() < deadline:
+            with lock:
+                index = next(counter)
+            if max_requests is not None and index >= max_requests:
+                return
+            outcomes[thread].append(send_request(target, entries[index % len(entries)], time.perf_counter()))
+
+    threads = [threading.Thread(target=client, args=(thread,)) for thread in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [outcome for thread in outcomes for outcome in thread], time.perf_counter() - start
+
+def run_open_loop(target, entries, concurrency, duration, rate, max_requests=None, poisson=True, seed=42):
+    """
+    Send requests at a fixed arrival rate, whatever the response times.
+
+    Requests are scheduled independently of the responses and handed to
+    `concurrency` client threads. Latencies are measured from the scheduled
+    arrival, so the time a request waits for a free client thread counts, as
+    it would for a real user when the server falls behind.
+
+    Parameters:
+    target (TestClientTarget or HTTPTarget): Where to send the requests.
+    entries (list): The requests, sent in order and cycled through.
+    concurrency (int): Number of client threads.
+    duration (float): Seconds during which requests arrive.
+    rate (float): Arrivals per second.
+    max_requests (int): Stop after this many requests (default: no limit).
+    poisson (bool): Exponential inter-arrival times instead of evenly spaced arrivals.
+    seed (int): Seed of the arrival times.
+
+    Returns:
+    tuple: The request outcomes and the elapsed seconds.
+    """
+    rng = np.random.default_rng(seed)
+    arrivals = queue.Queue()
+    outcomes = [[] for _ in range(concurrency)]
+
+    def client(thread):
+        while True:
+            item = arrivals.get()
+            if item is None:
+                return
+            scheduled_at, entry = item
+            outcomes[thread].append(send_request(target, entry, scheduled_at))
+
+    threads = [threading.Thread(target=client, args=(thread,)) for thread in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    scheduled_at = start
+    for index in itertools.count():
+        scheduled_at += rng.exponential(1 / rate) if poisson else 1 / rate
+        if scheduled_at >= start + duration or (max_requests is not None and index >= max_requests):
+            break
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrivals.put((scheduled_at, entries[index % len(entries)]))
+
+    for _ in threads:
+        arrivals.put(None)
+    for thread in threads:
+        thread.join()
+    return [outcome for thread in outcomes for outcome in thread], time.perf_counter() - start
+
+def summarize_outcomes(outcomes, elapsed):
+    """
+    Summarize the request outcomes per endpoint and overall.
+
+    Errors are failed requests and 5xx responses; 4xx responses, like the
+    invalid diamonds of the log, are counted apart as client errors.
+
+    Parameters:
+    outcomes (list): The outcomes from send_request.
+    elapsed (float): Seconds the load test ran.
+
+    Returns:
+    dict: Requests, throughput, p50/p95/p99 latency, error rates and prediction checks per endpoint, and for 'all'.
+    """
+    by_endpoint = {}
+    for outcome in outcomes:
+        by_endpoint.setdefault(outcome[0], []).append(outcome)
+    by_endpoint['all'] = outcomes
+
+    results = {}
+    for endpoint, endpoint_outcomes in by_endpoint.items():
+        if not endpoint_outcomes:
+            continue
+        latencies = np.array([latency for _, latency, _, _ in endpoint_outcomes]) * 1e3
+        statuses = np.array([status for _, _, status, _ in endpoint_outcomes])
+        checks = [match for _, _, _, match in endpoint_outcomes if match is not None]
+        results[endpoint] = {
+            'requests': len(endpoint_outcomes),
+            'requests_per_s': len(endpoint_outcomes) / elapsed,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'error_rate': float(np.mean((statuses == 0) | (statuses >= 500))),
+            'client_error_rate': float(np.mean((statuses >= 400) & (statuses < 500)))
+        }
+        if checks:
+            results[endpoint]['checked'] = len(checks)
+            results[endpoint]['mismatches'] = checks.count(False)
+    return results
+
+def run_load_test(source='replay', url=None, concurrency=8, duration=10.0, rate=None, max_requests=None,
+                  db_path=None, endpoints=None, poisson=True, seed=42):
+    """
+    Replay the request log, or synthetic traffic shaped like it, against the API.
+
+    Without a rate the test is closed-loop; with a rate it is open-loop
+    (see run_open_loop). Replayed /predict responses are checked against the
+    logged predictions of the same model.
+
+    Parameters:
+    source (str): 'replay' to send the logged requests, 'synthetic' for generated ones.
+    url (str): Base URL of a running server (default: the API in this process, through the Flask test client).
+    concurrency (int): Number of client threads.
+    duration (float): Seconds the test runs.
+    rate (float): Arrivals per second of an open-loop test.
+    max_requests (int): Stop after this many requests (default: no limit).
+    db_path (str): Path to the request log database.
+    endpoints (list): Only use these endpoints (default: every endpoint).
+    poisson (bool): Exponential inter-arrival times in an open-loop test.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    dict: The summary of summarize_outcomes.
+    """
+    db_path = db_path or get_default_db_path()
+    logged = load_logged_requests(db_path, endpoints) if os.path.exists(db_path) else []
+    if source == 'replay':
+        entries = logged
+        if not entries:
+            raise ValueError("The request log has no request to replay; use --source synthetic.")
+    else:
+        shape = describe_traffic(logged)
+        if endpoints and not logged:
+            # Nothing logged for these endpoints: send them in equal shares
+            shape['endpoints'] = {endpoint: 1 / len(endpoints) for endpoint in endpoints}
+        entries = make_synthetic_requests(shape, seed=seed)
+
+    target = HTTPTarget(url) if url else TestClientTarget(import_api().app)
+    if rate:
+        outcomes, elapsed = run_open_loop(target, entries, concurrency, duration, rate, max_requests, poisson, seed)
+        loop = f'open loop at {rate:g} req/s'
+    else:
+        outcomes, elapsed = run_closed_loop(target, entries, concurrency, duration, max_requests)
+        loop = 'closed loop'
+
+    results = summarize_outcomes(outcomes, elapsed)
+    print_results(f"Load test: {source} traffic, {loop}, {concurrency} client threads, {elapsed:.1f}s against {url or 'the test client'}", results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API by replaying the request log or with synthetic traffic shaped like it.")
+    parser.add_argument('--source', choices=['replay', 'synthetic'], default='replay', help="Replay the logged requests or generate synthetic ones")
+    parser.add_argument('--url', default=None, help="Base URL of a running server (default: the API in this process, through the Flask test client)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Client threads")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds the test runs")
+    parser.add_argument('--rate', type=float, default=None, help="Arrivals per second for an open-loop test (default: closed loop)")
+    parser.add_argument('--uniform', action='store_true', help="Evenly spaced arrivals in an open-loop test instead of Poisson arrivals")
+    parser.add_argument('--max-requests', type=int, default=None, help="Stop after this many requests")
+    parser.add_argument('--db-path', default=None, help="Request log database (default: the API's)")
+    parser.add_argument('--endpoints', nargs='+', default=None, help="Only use these endpoints")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the synthetic traffic and of the arrivals")
+    parser.add_argument('--output', default=None, help="Save the results as JSON to this path")
+
+    args = parser.parse_args()
+
+    results = run_load_test(args.source, args.url, args.concurrency, args.duration, args.rate, args.max_requests,
+                            args.db_path, args.endpoints, not args.uniform, args.seed)
+    if args.output:
+        params = {key: value for key, value in vars(args).items() if key != 'output'}
+        save_results(args.output, 'load_test', params, results)
+    if results.get('all', {}).get('mismatches'):
+        sys.exit(1)
@@ -1,47 +1,321 @@
 import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+from threadpoolctl import threadpool_limits
 from data_preprocessing import load_data
+from dataset_cache import source_hash, file_hash
 from evaluate_model import evaluate_model
 from save_model import save_model_and_metrics
+from model_store import ModelStore
 from models_registry import model_registry, dynamic_import
+from tune_model import save_tuned_params, load_tuned_params
+from train_model import SPLIT_SEED
 
 
-def main(model_type, data_url):
+def get_data_hash(data_url):
+    """
+    Get the SHA-256 of the training data file, recorded with the metrics of the models.
+
+    Parameters:
+    data_url (str): Path to the input data file.
+
+    Returns:
+    str: The hex digest, or None if the data is not a local file.
+    """
+    return source_hash(data_url) if os.path.isfile(data_url) else None
+
+def get_data_watermark(data_url, df, segments=None):
+    """
+    Get the size of the training data, recorded with the model to find the rows appended since.
+
+    Parameters:
+    data_url (str): Path to the input data file.
+    df (pd.DataFrame): The loaded data.
+    segments (list): Row positions where the data of each training run of the model ended (default: one run on every row).
+
+    Returns:
+    dict: The number of rows and bytes of the file and the segments, or None if the data is not a local file.
+    """
+    if not os.path.isfile(data_url):
+        return None
+    return {'rows': len(df), 'bytes': os.path.getsize(data_url), 'segments': segments or [len(df)]}
+
+def get_trained_segments(data_url, manifest):
+    """
+    Get the rows a model was trained on, if the data file was only appended to since.
+
+    The file must still start with the exact bytes the model was trained on,
+    checked against the SHA-256 recorded with the model.
+
+    Parameters:
+    data_url (str): Path to the input data file.
+    manifest (dict): The model store manifest of the model.
+
+    Returns:
+    list: Row positions where the data of each training run of the model ended, the last one being
+    the rows it was trained on, or None if they cannot be told apart from the new ones.
+    """
+    watermark = manifest.get('data_watermark')
+    if watermark is None or manifest.get('data_hash') is None or not os.path.isfile(data_url):
+        return None
+    if os.path.getsize(data_url) < watermark['bytes']:
+        return None
+    if file_hash(data_url, size=watermark['bytes']) != manifest['data_hash']:
+        return None
+    return watermark.get('segments', [watermark['rows']])
+
+def resolve_params(model_type, df, tune=False, n_trials=27, workers=None, n_jobs=None, use_tuned_params=True):
+    """
+    Get the hyperparameters to train a model with, searching them if requested.
+
+    Parameters:
+    model_type (str): Type of the model (e.g., 'linear', 'xgboost').
+    df (pd.DataFrame): The raw training data.
+    tune (bool): Run the model's hyperparameter search and record its result.
+    n_trials (int): Number of configurations of the search.
+    workers (int): Number of search processes.
+    n_jobs (int): Threads per search trial.
+    use_tuned_params (bool): Reuse the parameters recorded by a previous search.
+
+    Returns:
+    dict: The hyperparameters, or None for the model defaults.
+    """
+    model_details = model_registry[model_type]
+
+    if tune:
+        if 'tune_function' not in model_details:
+            raise ValueError(f"Model type '{model_type}' does not support tuning.")
+        preprocess_fn = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+        tune_fn = dynamic_import(model_details['tune_module'], model_details['tune_function'])
+
+        tuning_result = tune_fn(preprocess_fn(df), n_trials=n_trials, workers=workers, n_jobs=n_jobs or 1)
+        save_tuned_params(model_type, tuning_result)
+        return tuning_result['params']
+
+    if use_tuned_params:
+        return load_tuned_params(model_type)
+    return None
+
+def train_and_evaluate(model_type, df, n_jobs=None, params=None):
+    """
+    Preprocess the data, train and evaluate one model of the registry.
+
+    Parameters:
+    model_type (str): Type of the model (e.g., 'linear', 'xgboost').
+    df (pd.DataFrame): The raw training data.
+    n_jobs (int): Number of threads the model may use (None for the library default).
+    params (dict): Hyperparameters of the model (None for the model defaults).
+
+    Returns:
+    tuple: The trained model and its metrics.
+    """
+    if model_type not in model_registry:
+        raise ValueError(f"Unsupported model type '{model_type}'. Choose a supported model type.")
+
+    preprocess_fn = dynamic_import(
+        model_registry[model_type]['preprocess_module'],
+        model_registry[model_type]['preprocess_function']
+    )
+    train_fn = dynamic_import(
+        model_registry[model_type]['train_module'],
+        model_registry[model_type]['train_function']
+    )
+    log_transform = model_registry[model_type]['log_transform']
+
+    train_kwargs = {'n_jobs': n_jobs}
+    if params is not None:
+        train_kwargs['params'] = params
+
+    start = time.perf_counter()
+    # Also cap the BLAS/OpenMP pools so parallel workers do not oversubscribe the cores
+    with threadpool_limits(limits=n_jobs):
+        df = preprocess_fn(df)
+        print(df.columns)
+
+        model, X_test, y_test = train_fn(df, **train_kwargs)
+
+        # Evaluate the model
+        mae, r2 = evaluate_model(model, X_test, y_test, log_transform)
+
+    metrics = {'MAE': mae, 'R2': r2, 'training_mode': 'full', 'training_time_s': round(time.perf_counter() - start, 3),
+               'split_seed': SPLIT_SEED}
+    if params is not None:
+        metrics['params'] = params
+    return model, metrics
+
+def update_and_evaluate(model_type, model, df, segments, n_jobs=None, n_rounds=10):
+    """
+    Preprocess the data, update a trained model with the appended rows and evaluate it.
+
+    The model before the update is evaluated on the same test rows, as
+    'base_R2': the R2 recorded when it was trained comes from a test split
+    without the appended rows, so it is not comparable.
+
+    Parameters:
+    model_type (str): Type of the model, with an incremental function in the registry.
+    model (sklearn model): The trained model.
+    df (pd.DataFrame): The raw training data, old and appended rows.
+    segments (list): Row positions where the data of each training run of the model ended.
+    n_jobs (int): Number of threads the model may use (None for the library default).
+    n_rounds (int): Number of boosting rounds added to the model.
+
+    Returns:
+    tuple: The updated model and its metrics.
+    """
+    model_details = model_registry[model_type]
+    preprocess_fn = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+    update_fn = dynamic_import(model_details['incremental_module'], model_details['incremental_function'])
+
+    start = time.perf_counter()
+    with threadpool_limits(limits=n_jobs):
+        updated, X_test, y_test = update_fn(model, preprocess_fn(df), segments, n_jobs=n_jobs, n_rounds=n_rounds)
+        mae, r2 = evaluate_model(updated, X_test, y_test, model_details['log_transform'])
+        training_time = time.perf_counter() - start
+        _, base_r2 = evaluate_model(model, X_test, y_test, model_details['log_transform'])
+
+    metrics = {'MAE': mae, 'R2': r2, 'training_mode': 'incremental', 'training_time_s': round(training_time, 3),
+               'new_rows': len(df) - segments[-1], 'added_rounds': n_rounds, 'base_R2': base_r2, 'split_seed': SPLIT_SEED}
+    return updated, metrics
+
+def main(model_type, data_url, n_jobs=None, tune=False, n_trials=27, use_tuned_params=True, workers=None):
     """
     Main function to run the ML pipeline.
 
     Parameters:
     model_type (str): Type of the model (e.g., 'linear', 'xgboost').
     data_url (str): Path to the input data file.
+    n_jobs (int): Number of threads the model may use (None for the library default).
+    tune (bool): Search the hyperparameters before training.
+    n_trials (int): Number of configurations of the search.
+    use_tuned_params (bool): Reuse the parameters recorded by a previous search.
+    workers (int): Number of hyperparameter search processes (default: the CPU count).
     """
     try:
-        # Load and preprocess data
+        # Load the data
         df = load_data(data_url)
-        
-        if model_type in model_registry:
-            preprocess_fn = dynamic_import(
-                model_registry[model_type]['preprocess_module'],
-                model_registry[model_type]['preprocess_function']
-            )
-            train_fn = dynamic_import(
-                model_registry[model_type]['train_module'],
-                model_registry[model_type]['train_function']
-            )
-            log_transform = model_registry[model_type]['log_transform']
-            
-            df = preprocess_fn(df)
-            print(df.columns)
-            
-            model, X_test, y_test = train_fn(df)
-        else:
+
+        if model_type not in model_registry:
             raise ValueError(f"Unsupported model type '{model_type}'. Choose a supported model type.")
+        params = resolve_params(model_type, df, tune, n_trials, workers, n_jobs, use_tuned_params)
 
-        # Evaluate the model
-        mae, r2 = evaluate_model(model, X_test, y_test, log_transform)
+        model, metrics = train_and_evaluate(model_type, df, n_jobs, params)
 
         # Save the model and metrics
-        metrics = {'MAE': mae, 'R2': r2}
-        save_model_and_metrics(model, metrics, model_type)
-    
+        save_model_and_metrics(model, metrics, model_type, data_hash=get_data_hash(data_url),
+                               data_watermark=get_data_watermark(data_url, df))
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise
+
+def main_all(data_url, workers=None, n_jobs=None, tune=False, n_trials=27, use_tuned_params=True):
+    """
+    Train every model of the registry in parallel and promote the best one.
+
+    The data is loaded once and each model is trained in its own process.
+    The models are saved from this process once all of them are done, and
+    only the best one of the run is considered for promotion.
+
+    Parameters:
+    data_url (str): Path to the input data file.
+    workers (int): Number of training processes (default: one per model, up to the CPU count).
+    n_jobs (int): Threads per model (default: the CPU count divided by the workers).
+    tune (bool): Search the hyperparameters of the models that support it before training.
+    n_trials (int): Number of configurations of each search.
+    use_tuned_params (bool): Reuse the parameters recorded by a previous search.
+    """
+    try:
+        df = load_data(data_url)
+
+        model_types = list(model_registry)
+        cpu_count = os.cpu_count() or 1
+
+        # Searches use the whole machine, one after the other
+        params = {}
+        for model_type in model_types:
+            can_tune = 'tune_function' in model_registry[model_type]
+            params[model_type] = resolve_params(model_type, df, tune and can_tune, n_trials, use_tuned_params=use_tuned_params)
+
+        workers = workers or min(len(model_types), cpu_count)
+        n_jobs = n_jobs or max(1, cpu_count // workers)
+        print(f"Training {len(model_types)} models with {workers} workers and {n_jobs} threads each.")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {model_type: executor.submit(train_and_evaluate, model_type, df, n_jobs, params[model_type]) for model_type in model_types}
+            results = {model_type: future.result() for model_type, future in futures.items()}
+
+        data_hash = get_data_hash(data_url)
+        data_watermark = get_data_watermark(data_url, df)
+        best_model_type = max(results, key=lambda model_type: results[model_type][1]['R2'])
+        for model_type, (model, metrics) in results.items():
+            print(f"{model_type}: MAE={metrics['MAE']:.2f} R2={metrics['R2']:.4f}")
+            save_model_and_metrics(model, metrics, model_type, promote=model_type == best_model_type,
+                                   data_hash=data_hash, data_watermark=data_watermark)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise
+
+def main_incremental(model_type, data_url, n_jobs=None, n_rounds=10, max_r2_drop=0.01, use_tuned_params=True):
+    """
+    Update the best model with the rows appended to the data since it was trained.
+
+    The promoted model keeps boosting on the new rows only. The pipeline falls
+    back to a full retrain when the best model is of another type, when the
+    data file was rewritten rather than appended to, or when the updated
+    model's R2 is more than max_r2_drop below the best model's, both measured
+    on the same test rows; the updated model is then saved without being
+    considered for promotion.
+
+    Parameters:
+    model_type (str): Type of the model, with an incremental function in the registry.
+    data_url (str): Path to the input data file.
+    n_jobs (int): Number of threads the model may use (None for the library default).
+    n_rounds (int): Number of boosting rounds added to the model.
+    max_r2_drop (float): Largest R2 loss against the best model accepted before retraining from scratch.
+    use_tuned_params (bool): Reuse the parameters recorded by a previous search for a full retrain.
+    """
+    try:
+        if 'incremental_function' not in model_registry.get(model_type, {}):
+            raise ValueError(f"Model type '{model_type}' does not support incremental training.")
+
+        store = ModelStore()
+        best = store.best()
+        manifest = store.get_manifest(best['version']) if best is not None and best['version'] else None
+
+        segments = None
+        if manifest is None or manifest['model_type'] != model_type:
+            reason = f"the best model is not a {model_type} model"
+        else:
+            segments = get_trained_segments(data_url, manifest)
+            reason = "the data was not only appended to since the best model was trained"
+
+        if segments is None:
+            print(f"Full retrain: {reason}.")
+            main(model_type, data_url, n_jobs, use_tuned_params=use_tuned_params)
+            return
+
+        df = load_data(data_url)
+        if len(df) == segments[-1]:
+            print(f"No rows were appended since {best['version']} was trained.")
+            return
+
+        model, _ = joblib.load(store.artifact_path(best['version']))
+        model, metrics = update_and_evaluate(model_type, model, df, segments, n_jobs, n_rounds)
+        metrics['base_version'] = best['version']
+        print(f"Updated {best['version']} with {metrics['new_rows']} new rows in {metrics['training_time_s']:.2f}s: "
+              f"MAE={metrics['MAE']:.2f} R2={metrics['R2']:.4f} (best R2={metrics['base_R2']:.4f} on the same test rows)")
+
+        degraded = metrics['R2'] < metrics['base_R2'] - max_r2_drop
+        save_model_and_metrics(model, metrics, model_type, promote=not degraded, data_hash=get_data_hash(data_url),
+                               data_watermark=get_data_watermark(data_url, df, segments + [len(df)]))
+
+        if degraded:
+            print(f"Full retrain: R2 dropped by more than {max_r2_drop}.")
+            main(model_type, data_url, n_jobs, use_tuned_params=use_tuned_params)
+
     except Exception as e:
         print(f"An error occurred: {e}")
         raise
@@ -49,8 +323,21 @@ def main(model_type, data_url):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the ML pipeline.")
     parser.add_argument('data_url', type=str, help="Path to the input data file")
-    parser.add_argument('model_type', choices=model_registry.keys(), help="Type of model to run")
-    
+    parser.add_argument('model_type', choices=list(model_registry.keys()) + ['all'], help="Type of model to run, or 'all' to train every model in parallel")
+    parser.add_argument('--workers', type=int, default=None, help="Training processes in 'all' mode (default: one per model, up to the CPU count) and search processes with --tune (default: the CPU count)")
+    parser.add_argument('--n-jobs', type=int, default=None, help="Threads per model (default: library default, or CPU count / workers in 'all' mode)")
+    parser.add_argument('--tune', action='store_true', help="Search the hyperparameters before training and record them in models/tuned_params.json")
+    parser.add_argument('--trials', type=int, default=27, help="Number of configurations of the hyperparameter search")
+    parser.add_argument('--default-params', action='store_true', help="Ignore the recorded tuned parameters and train with the model defaults")
+    parser.add_argument('--incremental', action='store_true', help="Update the best model with the rows appended to the data since it was trained, instead of retraining from scratch")
+    parser.add_argument('--incremental-rounds', type=int, default=10, help="Boosting rounds added by an incremental update")
+    parser.add_argument('--max-r2-drop', type=float, default=0.01, help="Retrain from scratch when an incremental update loses more R2 than this against the best model")
+
     args = parser.parse_args()
-    
-    main(args.model_type, args.data_url)
+
+    if args.incremental:
+        main_incremental(args.model_type, args.data_url, args.n_jobs, args.incremental_rounds, args.max_r2_drop, not args.default_params)
+    elif args.model_type == 'all':
+        main_all(args.data_url, args.workers, args.n_jobs, args.tune, args.trials, not args.default_params)
+    else:
+        main(args.model_type, args.data_url, args.n_jobs, args.tune, args.trials, not args.default_params, args.workers)
@@ -0,0 +1,279 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+Metrics
+
+This module collects counters and histograms in memory and renders them in
+the Prometheus text exposition format. Recording a value is a dict lookup and
+an increment under a lock, cheap enough to leave on for every request.
+Values owned by other components, like queue depths or cache counters, are
+read through callbacks when the metrics are rendered.
+
+Classes:
+   Counter -- Monotonic counter with optional labels.
+   Histogram -- Bucketed distribution with optional labels.
+   MetricsRegistry -- Holds the metrics and renders them.
+   StageTimer -- Times the stages of one request.
+"""
+
+# Seconds, from 100us to 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Rows per batch request
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+
+
+def _escape_label(value):
+   return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values):
+   if not labelnames:
+      return ''
+   return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, values)) + '}'
+
+def _format_value(value):
+   if value == math.inf:
+      return '+Inf'
+   return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+   """
+   Monotonic counter, one value per combination of label values.
+
+   Parameters:
+   name (str): Metric name, without the _total suffix.
+   description (str): Help text of the metric.
+   labelnames (tuple): Names of the labels.
+   """
+
+   metric_type = 'counter'
+
+   def __init__(self, name, description, labelnames=()):
+      self.name = f'{name}_total'
+      self.description = description
+      self.labelnames = tuple(labelnames)
+      self._values = {}
+      self._lock = threading.Lock()
+
+   def inc(self, *labelvalues, amount=1):
+      """
+      Increase the counter.
+
+      Parameters:
+      labelvalues (str): Values of the labels, in labelnames order.
+      amount (float): Amount to add.
+      """
+      with self._lock:
+         self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+   def samples(self):
+      """
+      Return the samples of the metric.
+
+      Returns:
+      list: (sample name, label names, label values, value) tuples.
+      """
+      with self._lock:
+         return [(self.name, self.labelnames, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+   """
+   Distribution of observed values in cumulative buckets, one per combination of label values.
+
+   Parameters:
+   name (str): Metric name.
+   description (str): Help text of the metric.
+   labelnames (tuple): Names of the labels.
+   buckets (tuple): Upper bounds of the buckets, increasing.
+   """
+
+   metric_type = 'histogram'
+
+   def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+      self.name = name
+      self.description = description
+      self.labelnames = tuple(labelnames)
+      self.buckets = tuple(buckets)
+      # Per label values: [counts per bucket (the last one is +Inf), sum]
+      self._values = {}
+      self._lock = threading.Lock()
+
+   def observe(self, value, *labelvalues):
+      """
+      Record a value.
+
+      Parameters:
+      value (float): The observed value.
+      labelvalues (str): Values of the labels, in labelnames order.
+      """
+      index = bisect.bisect_left(self.buckets, value)
+      with self._lock:
+         entry = self._values.get(labelvalues)
+         if entry is None:
+            entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+         entry[0][index] += 1
+         entry[1] += value
+
+   def samples(self):
+      """
+      Return the samples of the metric.
+
+      Returns:
+      list: (sample name, label names, label values, value) tuples.
+      """
+      samples = []
+      with self._lock:
+         values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+      for key, counts, total in values:
+         cumulative = 0
+         for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            samples.append((f'{self.name}_bucket', self.labelnames + ('le',), key + (_format_value(bound),), cumulative))
+         samples.append((f'{self.name}_sum', self.labelnames, key, total))
+         samples.append((f'{self.name}_count', self.labelnames, key, cumulative))
+      return samples
+
+
+class CallbackMetric:
+   """
+   Metric whose values are read from a function when rendered.
+
+   Parameters:
+   name (str): Metric name, with the _total suffix for counters.
+   description (str): Help text of the metric.
+   function (function): Returns a number, or a dict mapping label value tuples to numbers.
+   metric_type (str): 'gauge' or 'counter'.
+   labelnames (tuple): Names of the labels.
+   """
+
+   def __init__(self, name, description, function, metric_type='gauge', labelnames=()):
+      self.name = name
+      self.description = description
+      self.function = function
+      self.metric_type = metric_type
+      self.labelnames = tuple(labelnames)
+
+   def samples(self):
+      """
+      Return the samples of the metric.
+
+      Returns:
+      list: (sample name, label names, label values, value) tuples.
+      """
+      values = self.function()
+      if values is None:
+         return []
+      if not isinstance(values, dict):
+         values = {(): values}
+      return [(self.name, self.labelnames, key, value) for key, value in values.items()]
+
+
+class MetricsRegistry:
+   """
+   Registry of the metrics of a process, rendered in the Prometheus text format.
+
+   Parameters:
+   prefix (str): Prefix of every metric name.
+   """
+
+   def __init__(self, prefix=''):
+      self.prefix = prefix
+      self._metrics = []
+
+   def _register(self, metric):
+      self._metrics.append(metric)
+      return metric
+
+   def counter(self, name, description, labelnames=()):
+      """
+      Create and register a counter.
+
+      Returns:
+      Counter: The counter.
+      """
+      return self._register(Counter(self.prefix + name, description, labelnames))
+
+   def histogram(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+      """
+      Create and register a histogram.
+
+      Returns:
+      Histogram: The histogram.
+      """
+      return self._register(Histogram(self.prefix + name, description, labelnames, buckets))
+
+   def callback(self, name, description, function, metric_type='gauge', labelnames=()):
+      """
+      Register a metric read from a function when rendered.
+
+      Returns:
+      CallbackMetric: The metric.
+      """
+      return self._register(CallbackMetric(self.prefix + name, description, function, metric_type, labelnames))
+
+   def render(self):
+      """
+      Render every metric in the Prometheus text exposition format.
+
+      Returns:
+      str: The metrics page.
+      """
+      lines = []
+      for metric in self._metrics:
+         try:
+            samples = metric.samples()
+         except Exception:
+            # A failing callback must not take the whole page down
+            continue
+         lines.append(f'# HELP {metric.name} {metric.description}')
+         lines.append(f'# TYPE {metric.name} {metric.metric_type}')
+         for sample_name, labelnames, labelvalues, value in samples:
+            lines.append(f'{sample_name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}')
+      return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+   """
+   Time the stages of a request.
+
+   Stages are timed with `with timer.stage('name'):`; a stage timed several
+   times accumulates its durations.
+   """
+
+   def __init__(self):
+      self.started_at = time.perf_counter()
+      self.stages = {}
+
+   @contextmanager
+   def stage(self, name):
+      """
+      Time a block of code as a stage.
+
+      Parameters:
+      name (str): Name of the stage.
+      """
+      start = time.perf_counter()
+      try:
+         yield
+      finally:
+         self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+   def elapsed(self):
+      """
+      Return the seconds since the timer was created.
+      """
+      return time.perf_counter() - self.started_at
+
+   def breakdown(self):
+      """
+      Describe the duration of every stage.
+
+      Returns:
+      str: The stages and their durations in milliseconds, in the order they ran.
+      """
+      return ' '.join(f'{name}={seconds * 1e3:.2f}ms' for name, seconds in self.stages.items())
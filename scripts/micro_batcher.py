@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+
+"""
+Micro Batcher
+
+This module groups concurrent single-item calls into batches. Callers submit
+one item and block; a background thread collects the items arriving within a
+short window and processes them with one vectorized call, then hands each
+caller its own result.
+
+Classes:
+   MicroBatcher -- Collects concurrent items into batches for a batch function.
+"""
+
+
+class MicroBatcher:
+   """
+   Run a batch function over items submitted concurrently by many callers.
+
+   A batch starts with the first waiting item and is closed when it holds
+   `max_batch_size` items or `max_wait_ms` milliseconds after that first item
+   arrived, whichever comes first. A lone caller therefore waits at most
+   `max_wait_ms` more than without batching.
+
+   Parameters:
+   batch_function (function): Takes a list of items and returns the list of their results, in order.
+   max_wait_ms (float): Maximum milliseconds the first item of a batch waits for more items.
+   max_batch_size (int): Maximum number of items per batch.
+   name (str): Name of the batcher thread.
+   """
+
+   def __init__(self, batch_function, max_wait_ms=2.0, max_batch_size=64, name='micro-batcher'):
+      self.batch_function = batch_function
+      self.max_wait = max_wait_ms / 1000
+      self.max_batch_size = max_batch_size
+      self.name = name
+      self._queue = queue.Queue()
+      self._thread = None
+      self._counter_lock = threading.Lock()
+      self.batches = 0
+      self.items = 0
+      self.largest_batch = 0
+      self.errors = 0
+
+   def start(self):
+      """
+      Start the batcher thread.
+      """
+      if self._thread is not None and self._thread.is_alive():
+         return
+      self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+      self._thread.start()
+
+   def submit(self, item, timeout=None):
+      """
+      Process an item as part of the next batch and wait for its result.
+
+      An item whose caller timed out before its batch started is skipped.
+
+      Parameters:
+      item (object): The item, as expected by the batch function.
+      timeout (float): Maximum seconds to wait for the result.
+
+      Returns:
+      object: The result of the item.
+
+      Raises:
+      TimeoutError: If the result is not ready within `timeout` seconds.
+      Exception: The error raised by the batch function for the item's batch.
+      """
+      future = Future()
+      self._queue.put((item, future))
+      try:
+         return future.result(timeout)
+      except FuturesTimeoutError:
+         future.cancel()
+         raise TimeoutError(f"No result from {self.name} within {timeout}s.")
+
+   def stats(self):
+      """
+      Return the batcher counters.
+
+      Returns:
+      dict: Number of batches and items, mean and largest batch size, and failed batches.
+      """
+      with self._counter_lock:
+         return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+            'errors': self.errors,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_batch_size': self.max_batch_size
+         }
+
+   def _collect(self):
+      batch = [self._queue.get()]
+      deadline = time.monotonic() + self.max_wait
+      while len(batch) < self.max_batch_size:
+         remaining = deadline - time.monotonic()
+         try:
+            batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+         except queue.Empty:
+            break
+      return batch
+
+   def _run(self):
+      while True:
+         # Callers that timed out cancelled their future
+         batch = [(item, future) for item, future in self._collect() if future.set_running_or_notify_cancel()]
+         if not batch:
+            continue
+         items = [item for item, _ in batch]
+         try:
+            results = list(self.batch_function(items))
+            if len(results) != len(batch):
+               raise ValueError(f"{self.name} got {len(results)} results for a batch of {len(batch)} items.")
+            for (_, future), result in zip(batch, results):
+               future.set_result(result)
+         except Exception as e:
+            with self._counter_lock:
+               self.errors += 1
+            # Every caller gets an answer, even if the batch failed after some results were handed out
+            for _, future in batch:
+               if not future.done():
+                  future.set_exception(e)
+            continue
+
+         with self._counter_lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
@@ -0,0 +1,203 @@
+import json
+import os
+import numpy as np
+from dataset_cache import file_hash
+from models_registry import model_registry, dynamic_import
+
+"""
+Model Export
+
+This module saves trained models in formats that load without unpickling.
+Linear models are exported as raw coefficient and intercept arrays that are
+memory-mapped at load time, XGBoost models as the native UBJSON booster. The
+loaded models only implement `predict`, and importing them needs neither
+sklearn nor, for linear models, xgboost.
+
+Classes:
+   ExportedLinearModel -- Linear model backed by coefficient arrays.
+   ExportedXGBoostModel -- XGBoost booster loaded from UBJSON.
+
+Functions:
+   export_linear_model -- Exports a LinearRegression model.
+   load_linear_model -- Loads an exported linear model.
+   export_xgboost_model -- Exports an XGBRegressor model.
+   load_xgboost_model -- Loads an exported XGBoost model.
+   load_artifact -- Loads a model store artifact, from its export when it has one.
+   promoted_artifact_dir -- Finds the artifact of the promoted best model.
+"""
+
+
+class ExportedLinearModel:
+   """
+   Linear model computing `features @ coef + intercept`.
+
+   Parameters:
+   coef (np.ndarray): The coefficients, one per feature.
+   intercept (float): The intercept.
+   feature_names (list): Names of the features, in coefficient order.
+   """
+
+   def __init__(self, coef, intercept, feature_names=None):
+      self.coef_ = coef
+      self.intercept_ = intercept
+      self.feature_names_in_ = feature_names
+
+   def predict(self, features):
+      """
+      Predict the target of each row.
+
+      Parameters:
+      features (np.ndarray or pd.DataFrame): The encoded features, in coefficient order.
+
+      Returns:
+      np.ndarray: The predictions.
+      """
+      return np.asarray(features, dtype=np.float64) @ self.coef_ + self.intercept_
+
+
+class ExportedXGBoostModel:
+   """
+   XGBoost booster loaded from its native format.
+
+   Parameters:
+   booster (xgboost.Booster): The loaded booster.
+   """
+
+   def __init__(self, booster):
+      self.booster = booster
+
+   def predict(self, features):
+      """
+      Predict the target of each row.
+
+      Parameters:
+      features (np.ndarray): The encoded features, categories as their codes.
+
+      Returns:
+      np.ndarray: The predictions.
+      """
+      return self.booster.inplace_predict(features)
+
+
+def export_linear_model(model, artifact_dir):
+   """
+   Export a LinearRegression model as coefficient and intercept arrays.
+
+   Parameters:
+   model (LinearRegression): The trained model.
+   artifact_dir (str): Directory of the artifact.
+
+   Returns:
+   dict: The export entry of the artifact manifest.
+   """
+   np.save(os.path.join(artifact_dir, 'coef.npy'), np.ascontiguousarray(model.coef_, dtype=np.float64))
+   np.save(os.path.join(artifact_dir, 'intercept.npy'), np.asarray(model.intercept_, dtype=np.float64))
+   feature_names = getattr(model, 'feature_names_in_', None)
+   return {
+      'format': 'npy',
+      'files': {'coef': 'coef.npy', 'intercept': 'intercept.npy'},
+      'feature_names': feature_names.tolist() if feature_names is not None else None
+   }
+
+def load_linear_model(artifact_dir, export):
+   """
+   Load an exported linear model, memory-mapping its coefficients.
+
+   Parameters:
+   artifact_dir (str): Directory of the artifact.
+   export (dict): The export entry of the artifact manifest.
+
+   Returns:
+   ExportedLinearModel: The loaded model.
+   """
+   coef = np.load(os.path.join(artifact_dir, export['files']['coef']), mmap_mode='r')
+   intercept = float(np.load(os.path.join(artifact_dir, export['files']['intercept'])))
+   return ExportedLinearModel(coef, intercept, export.get('feature_names'))
+
+def export_xgboost_model(model, artifact_dir):
+   """
+   Export an XGBRegressor model as a UBJSON booster.
+
+   Parameters:
+   model (xgboost.XGBRegressor): The trained model.
+   artifact_dir (str): Directory of the artifact.
+
+   Returns:
+   dict: The export entry of the artifact manifest.
+   """
+   model.get_booster().save_model(os.path.join(artifact_dir, 'model.ubj'))
+   return {'format': 'ubj', 'files': {'booster': 'model.ubj'}}
+
+def load_xgboost_model(artifact_dir, export):
+   """
+   Load an exported XGBoost model.
+
+   Parameters:
+   artifact_dir (str): Directory of the artifact.
+   export (dict): The export entry of the artifact manifest.
+
+   Returns:
+   ExportedXGBoostModel: The loaded model.
+   """
+   import xgboost
+
+   booster = xgboost.Booster(model_file=os.path.join(artifact_dir, export['files']['booster']))
+   return ExportedXGBoostModel(booster)
+
+def load_artifact(artifact_dir):
+   """
+   Load a model store artifact, from its export when it has one.
+
+   The export loader is picked from the model registry entry of the artifact's
+   model type. Artifacts without an export, or whose model type has no export
+   loader, are unpickled.
+
+   Parameters:
+   artifact_dir (str): Directory of the artifact.
+
+   Returns:
+   tuple: The model and its metadata, as saved in the pickled artifact.
+   """
+   with open(os.path.join(artifact_dir, 'manifest.json'), 'r') as f:
+      manifest = json.load(f)
+
+   export = manifest.get('export')
+   model_details = model_registry.get(manifest['model_type'], {})
+   if export is not None and 'export_load_function' in model_details:
+      load_fn = dynamic_import(model_details['export_module'], model_details['export_load_function'])
+      return load_fn(artifact_dir, export), {'model_name': manifest['model_type'], 'version': manifest['version']}
+
+   # Only unpickled artifacts need joblib and the libraries of the pickled model
+   import joblib
+
+   return joblib.load(os.path.join(artifact_dir, manifest['files']['model']))
+
+def promoted_artifact_dir(best_model_dir):
+   """
+   Find the model store artifact of the promoted best model.
+
+   best_model/manifest.json points to the artifact of the last promotion
+   through the store. It only applies while best_model.pkl is still the
+   file that promotion copied: a best_model.pkl replaced by hand must be
+   loaded itself, not the stale artifact. Promotions record the SHA-256 of
+   the copied file in the manifest; for older manifests the artifact's own
+   pickle is hashed instead.
+
+   Parameters:
+   best_model_dir (str): Directory of best_model.pkl.
+
+   Returns:
+   str: The artifact directory, or None if best_model.pkl has to be loaded.
+   """
+   manifest_path = os.path.join(best_model_dir, 'manifest.json')
+   best_model_path = os.path.join(best_model_dir, 'best_model.pkl')
+   if not os.path.exists(manifest_path) or not os.path.exists(best_model_path):
+      return None
+   with open(manifest_path, 'r') as f:
+      manifest = json.load(f)
+
+   artifact_dir = os.path.abspath(os.path.join(best_model_dir, manifest['artifact_dir']))
+   if not os.path.isdir(artifact_dir):
+      return None
+   expected = manifest.get('model_sha256') or file_hash(os.path.join(artifact_dir, manifest['files']['model']))
+   return artifact_dir if file_hash(best_model_path) == expected else None
@@ -0,0 +1,349 @@
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+import joblib
+from dataset_cache import file_hash
+from models_registry import model_registry, dynamic_import
+
+"""
+Model Store
+
+This module keeps every trained model as a versioned artifact and indexes
+their metrics in SQLite. Each artifact lives in its own directory with the
+pickled model and a manifest describing it. The index records the model type,
+artifact path, data hash, metrics and parameters of every run, so leaderboard
+queries read an indexed table instead of a growing JSON file. Promotion of the
+best model happens under an exclusive file lock and publishes the artifact by
+renaming it into place.
+
+Classes:
+   ModelStore -- Versioned artifacts, metrics index and best model promotion.
+"""
+
+SCHEMA = '''
+         CREATE TABLE IF NOT EXISTS runs
+         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         version TEXT UNIQUE NOT NULL,
+         model_type TEXT,
+         artifact_path TEXT,
+         data_hash TEXT,
+         mae REAL,
+         r2 REAL,
+         training_date TEXT,
+         params TEXT,
+         metrics TEXT);
+         CREATE INDEX IF NOT EXISTS runs_r2 ON runs (r2 DESC);
+         CREATE INDEX IF NOT EXISTS runs_model_type_r2 ON runs (model_type, r2 DESC);
+         CREATE TABLE IF NOT EXISTS promotions
+         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         version TEXT NOT NULL,
+         r2 REAL,
+         promoted_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+         '''
+
+
+def get_project_root():
+   """
+   Get the project root directory.
+   """
+   current_dir = os.path.dirname(os.path.abspath(__file__))
+   return os.path.abspath(os.path.join(current_dir, os.pardir))
+
+def _write_json(path, data):
+   # Write to a temporary file and rename it so readers never see a partial file
+   tmp_path = f'{path}.{os.getpid()}.tmp'
+   with open(tmp_path, 'w') as f:
+      json.dump(data, f, indent=4)
+   os.replace(tmp_path, path)
+
+
+class ModelStore:
+   """
+   Versioned store of trained models.
+
+   Layout, relative to `root`:
+      artifacts/<version>/model.pkl -- The (model, metadata) tuple.
+      artifacts/<version>/manifest.json -- Version, model type, data hash, metrics, files and export.
+      artifacts/<version>/... -- Export of the model (see model_export).
+      model_index.db -- SQLite index of the runs and of the promotions.
+      best_model/best_model.pkl -- Copy of the promoted artifact, read by the API.
+      best_model/best_model_metrics.json -- Metrics of the promoted artifact.
+      best_model/manifest.json -- Manifest of the promoted artifact, with its directory.
+
+   Parameters:
+   root (str): Directory of the store, relative to the project root.
+   """
+
+   def __init__(self, root='models'):
+      self.root = os.path.join(get_project_root(), root)
+      self.artifacts_dir = os.path.join(self.root, 'artifacts')
+      self.best_model_dir = os.path.join(self.root, 'best_model')
+      self.index_path = os.path.join(self.root, 'model_index.db')
+      self.lock_path = os.path.join(self.best_model_dir, '.promotion.lock')
+      os.makedirs(self.artifacts_dir, exist_ok=True)
+      os.makedirs(self.best_model_dir, exist_ok=True)
+      self._init_index()
+
+   def _connect(self):
+      conn = sqlite3.connect(self.index_path, timeout=30)
+      conn.execute('PRAGMA journal_mode=WAL')
+      conn.execute('PRAGMA synchronous=NORMAL')
+      return conn
+
+   def _init_index(self):
+      conn = self._connect()
+      try:
+         with conn:
+            is_new = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='runs'").fetchone() is None
+            conn.executescript(SCHEMA)
+            if is_new:
+               self._import_legacy_metrics(conn)
+      finally:
+         conn.close()
+
+   def _import_legacy_metrics(self, conn):
+      # Keep the history of all_metrics.json. Its entries have no model type nor artifact,
+      # but artifacts were saved as '<model type>_<training date>.pkl', so they are matched by date
+      legacy_path = os.path.join(self.root, 'all_metrics.json')
+      if not os.path.exists(legacy_path) or os.path.getsize(legacy_path) == 0:
+         return
+      with open(legacy_path, 'r') as f:
+         entries = json.load(f)
+
+      artifacts = {}
+      for name in os.listdir(self.root):
+         stem, ext = os.path.splitext(name)
+         parts = stem.rsplit('_', 2)
+         if ext == '.pkl' and len(parts) == 3:
+            artifacts[f'{parts[1]}_{parts[2]}'] = (stem, parts[0], name)
+
+      rows = []
+      for i, entry in enumerate(entries):
+         date = (entry.get('training_date') or '').replace(' ', '_').replace(':', '-')
+         version, model_type, artifact_path = artifacts.pop(date, (f'legacy_{i}', None, None))
+         params = json.dumps(entry['params']) if entry.get('params') is not None else None
+         rows.append((version, model_type, artifact_path, entry.get('MAE'), entry.get('R2'), entry.get('training_date'), params, json.dumps(entry)))
+      conn.executemany('INSERT OR IGNORE INTO runs (version, model_type, artifact_path, mae, r2, training_date, params, metrics) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+   def _allocate_version(self, model_type, training_date):
+      # Runs of the same type finishing in the same second get a suffix
+      base = f"{model_type}_{training_date.replace(' ', '_').replace(':', '-')}"
+      version = base
+      suffix = 1
+      while True:
+         try:
+            os.mkdir(os.path.join(self.artifacts_dir, version))
+            return version
+         except FileExistsError:
+            suffix += 1
+            version = f'{base}_{suffix}'
+
+   def save(self, model, metrics, model_type, data_hash=None, data_watermark=None):
+      """
+      Save a trained model as a new artifact and index its metrics.
+
+      Parameters:
+      model (sklearn model): Trained model to be saved.
+      metrics (dict): Performance metrics of the model, with 'MAE', 'R2' and optionally 'params'.
+      model_type (str): Type of the model (e.g., 'linear', 'xgboost').
+      data_hash (str): SHA-256 of the training data, if known.
+      data_watermark (dict): Rows and bytes of the training data file, used to find the rows appended since.
+
+      Returns:
+      dict: The manifest of the artifact.
+      """
+      metrics.setdefault('training_date', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+      version = self._allocate_version(model_type, metrics['training_date'])
+      artifact_dir = os.path.join(self.artifacts_dir, version)
+
+      metadata = {'model_name': model_type, 'version': version}
+      joblib.dump((model, metadata), os.path.join(artifact_dir, 'model.pkl'))
+
+      manifest = {
+         'version': version,
+         'model_type': model_type,
+         'created_at': metrics['training_date'],
+         'data_hash': data_hash,
+         'data_watermark': data_watermark,
+         'metrics': metrics,
+         'files': {'model': 'model.pkl'}
+      }
+
+      # Also export the model to its fast-loading format, the pickle stays the reference
+      model_details = model_registry.get(model_type, {})
+      if 'export_function' in model_details:
+         try:
+            export_fn = dynamic_import(model_details['export_module'], model_details['export_function'])
+            manifest['export'] = export_fn(model, artifact_dir)
+         except Exception as e:
+            logging.warning(f"Could not export model {version}: {e}")
+      _write_json(os.path.join(artifact_dir, 'manifest.json'), manifest)
+
+      conn = self._connect()
+      try:
+         with conn:
+            conn.execute('''
+                         INSERT INTO runs (version, model_type, artifact_path, data_hash, mae, r2, training_date, params, metrics)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                         ''',
+                         (version, model_type, os.path.relpath(artifact_dir, self.root), data_hash, metrics['MAE'], metrics['R2'],
+                          metrics['training_date'], json.dumps(metrics.get('params')) if metrics.get('params') is not None else None,
+                          json.dumps(metrics)))
+      finally:
+         conn.close()
+      return manifest
+
+   def get_manifest(self, version):
+      """
+      Read the manifest of an artifact.
+
+      Parameters:
+      version (str): Version of the artifact.
+
+      Returns:
+      dict: The manifest.
+      """
+      with open(os.path.join(self.artifacts_dir, version, 'manifest.json'), 'r') as f:
+         return json.load(f)
+
+   def artifact_path(self, version, name='model'):
+      """
+      Get the path of a file of an artifact.
+
+      Parameters:
+      version (str): Version of the artifact.
+      name (str): Key of the file in the manifest.
+
+      Returns:
+      str: The absolute path of the file.
+      """
+      return os.path.join(self.artifacts_dir, version, self.get_manifest(version)['files'][name])
+
+   @contextmanager
+   def promotion_lock(self):
+      """
+      Hold the exclusive promotion lock, shared by every process using the store.
+      """
+      with open(self.lock_path, 'a') as lock_file:
+         fcntl.flock(lock_file, fcntl.LOCK_EX)
+         try:
+            yield
+         finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+   def best(self):
+      """
+      Return the currently promoted run.
+
+      Returns:
+      dict: Version and R2 of the promoted model, or None if nothing was promoted.
+      """
+      conn = self._connect()
+      try:
+         row = conn.execute('SELECT version, r2 FROM promotions ORDER BY id DESC LIMIT 1').fetchone()
+      finally:
+         conn.close()
+      if row is not None:
+         return {'version': row[0], 'R2': row[1]}
+
+      # Best model promoted before the store existed
+      best_metrics_path = os.path.join(self.best_model_dir, 'best_model_metrics.json')
+      if os.path.exists(best_metrics_path) and os.path.getsize(best_metrics_path) > 0:
+         with open(best_metrics_path, 'r') as f:
+            best_metrics = json.load(f)
+         return {'version': best_metrics.get('version'), 'R2': best_metrics['R2']}
+      return None
+
+   def promote_if_better(self, version):
+      """
+      Promote an artifact to best model if its R2 beats the promoted one.
+
+      An incremental update of the promoted model is compared with the R2 of
+      that model on the update's test rows ('base_R2' of its metrics).
+
+      The comparison and the promotion happen under the promotion lock, so
+      concurrent training runs cannot both promote, and the artifact is copied
+      to a temporary file and renamed over best_model.pkl so the API never
+      reads a partial model.
+
+      Parameters:
+      version (str): Version of the artifact.
+
+      Returns:
+      bool: True if the artifact was promoted.
+      """
+      manifest = self.get_manifest(version)
+      metrics = manifest['metrics']
+
+      with self.promotion_lock():
+         best = self.best()
+         best_r2 = best['R2'] if best is not None else None
+         # An update of the best model was evaluated with it on the same test rows: its recorded R2 came from another split
+         if best is not None and metrics.get('base_version') == best['version'] and 'base_R2' in metrics:
+            best_r2 = metrics['base_R2']
+         if best is not None and metrics['R2'] <= best_r2:
+            return False
+
+         # The manifest points the API to the artifact's export while best_model.pkl is the copy
+         # of its pickle; the model file is replaced last, since its change is what running APIs watch for
+         _write_json(os.path.join(self.best_model_dir, 'manifest.json'),
+                     dict(manifest, artifact_dir=os.path.relpath(os.path.join(self.artifacts_dir, version), self.best_model_dir),
+                          model_sha256=file_hash(self.artifact_path(version))))
+
+         best_model_path = os.path.join(self.best_model_dir, 'best_model.pkl')
+         tmp_best_model_path = f'{best_model_path}.{os.getpid()}.tmp'
+         shutil.copyfile(self.artifact_path(version), tmp_best_model_path)
+         os.replace(tmp_best_model_path, best_model_path)
+         _write_json(os.path.join(self.best_model_dir, 'best_model_metrics.json'),
+                     dict(metrics, version=version, model_type=manifest['model_type']))
+
+         conn = self._connect()
+         try:
+            with conn:
+               conn.execute('INSERT INTO promotions (version, r2) VALUES (?, ?)', (version, metrics['R2']))
+         finally:
+            conn.close()
+      return True
+
+   def leaderboard(self, limit=10, model_type=None):
+      """
+      Return the best runs by R2.
+
+      Parameters:
+      limit (int): Maximum number of runs.
+      model_type (str): Only return runs of this model type.
+
+      Returns:
+      list: One dict per run with version, model type, artifact path, data hash, MAE, R2 and training date.
+      """
+      query = 'SELECT version, model_type, artifact_path, data_hash, mae, r2, training_date FROM runs'
+      args = []
+      if model_type is not None:
+         query += ' WHERE model_type = ?'
+         args.append(model_type)
+      query += ' ORDER BY r2 DESC, id LIMIT ?'
+      args.append(limit)
+
+      conn = self._connect()
+      try:
+         rows = conn.execute(query, args).fetchall()
+      finally:
+         conn.close()
+      columns = ['version', 'model_type', 'artifact_path', 'data_hash', 'MAE', 'R2', 'training_date']
+      return [dict(zip(columns, row)) for row in rows]
+
+
+if __name__ == "__main__":
+   parser = argparse.ArgumentParser(description="Show the best trained models.")
+   parser.add_argument('--limit', type=int, default=10, help="Number of runs to show")
+   parser.add_argument('--model-type', default=None, help="Only show runs of this model type")
+   args = parser.parse_args()
+
+   for rank, run in enumerate(ModelStore().leaderboard(args.limit, args.model_type), start=1):
+      print(f"{rank:>3}. {run['version']:<36} {run['model_type'] or '-':<10} MAE={run['MAE']:.2f} R2={run['R2']:.4f} data={(run['data_hash'] or '-')[:12]}")
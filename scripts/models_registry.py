@@ -1,3 +1,4 @@
+import functools
 import importlib
 
 """
@@ -12,6 +13,18 @@ Functions:
 
 Registry:
    model_registry -- Dictionary mapping model names to their preprocessing and training functions.
+
+Entry keys:
+   tune_module, tune_function -- Optional hyperparameter search, returning a dict with the best 'params'.
+   incremental_module, incremental_function -- Optional update of a trained model with the rows appended
+                    to the data since it was trained, returning the model and the test split like training.
+   log_transform -- Whether the model predicts the log of the price.
+   predict_input -- Input the model's predict expects at serving time: 'dataframe' for models
+                    that validate feature names, 'array' for models that accept a raw matrix.
+   export_module, export_function, export_load_function -- Optional export of the trained model to a format
+                    that loads without unpickling, and its loader (see model_export).
+   inference_module, inference_function -- Optional fast serving backend built from the loaded model,
+                    used instead of its predict method (see inference).
 """
 
 model_registry = {
@@ -20,22 +33,42 @@ model_registry = {
       'preprocess_function': 'linear_model_preprocess',
       'train_module': 'train_model',
       'train_function': 'train_linear_model',
-      'log_transform': True
+      'log_transform': True,
+      'predict_input': 'dataframe',
+      'export_module': 'model_export',
+      'export_function': 'export_linear_model',
+      'export_load_function': 'load_linear_model',
+      'inference_module': 'inference',
+      'inference_function': 'build_linear_backend'
    },
    'xgboost': {
       'preprocess_module': 'data_preprocessing',
       'preprocess_function': 'xg_boost_preprocess',
       'train_module': 'train_model',
       'train_function': 'train_xgboost_model',
-      'log_transform': False
+      'tune_module': 'tune_model',
+      'tune_function': 'tune_xgboost_model',
+      'incremental_module': 'train_model',
+      'incremental_function': 'update_xgboost_model',
+      'log_transform': False,
+      'predict_input': 'array',
+      'export_module': 'model_export',
+      'export_function': 'export_xgboost_model',
+      'export_load_function': 'load_xgboost_model',
+      'inference_module': 'inference',
+      'inference_function': 'build_xgboost_backend'
    }
    # Add more models here as needed
 }
 
+@functools.lru_cache(maxsize=None)
 def dynamic_import(module_name, function_name):
    """
    Dynamically imports a function from a given module.
 
+   Each function is resolved once; later calls return it from a cache
+   without going through importlib.
+
    Parameters:
    module_name (str): The name of the module from which to import the function.
    function_name (str): The name of the function to import.
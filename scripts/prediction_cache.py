@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+"""
+Prediction Cache
+
+This module caches predictions keyed on the canonicalized features a model
+uses plus the identity of the model that produced them, so repeated diamond
+configurations skip the model call.
+
+Classes:
+   PredictionCache -- Bounded LRU cache of predictions with optional TTL.
+"""
+
+# Decimals kept when canonicalizing numeric features, finer than the float32 the models see
+KEY_DECIMALS = 6
+
+
+class PredictionCache:
+   """
+   Bounded, thread-safe LRU cache of predictions.
+
+   Keys are built by `make_keys` from the model version and the features the
+   model reads, so the same diamond sent with extra fields, numbers as strings
+   or 0.5 vs 0.50 hits the same entry. Requests still running on a replaced
+   model only ever read and write that model's entries. Once the new model is
+   live, `retire_versions` drops the entries of the other versions and later
+   stores of those versions are ignored; lookups and stores never clear the cache.
+
+   Parameters:
+   maxsize (int): Maximum number of cached predictions.
+   ttl (float): Seconds a prediction stays valid, or None to keep it until evicted.
+   """
+
+   def __init__(self, maxsize=10000, ttl=None):
+      self.maxsize = maxsize
+      self.ttl = ttl
+      self._entries = OrderedDict()
+      self._lock = threading.Lock()
+      self._live_version = None
+      self._retired_versions = set()
+      self.hits = 0
+      self.misses = 0
+      self.evictions = 0
+      self.expirations = 0
+      self.invalidations = 0
+
+   @staticmethod
+   def make_keys(model_version, df, numeric_features, categorical_features):
+      """
+      Build the cache keys of the rows of a dataframe.
+
+      Parameters:
+      model_version (str): Version of the model making the predictions.
+      df (pd.DataFrame): The validated feature rows.
+      numeric_features (list): Numeric features read by the model.
+      categorical_features (list): Categorical features read by the model.
+
+      Returns:
+      list: One hashable key per row.
+      """
+      numeric = df[numeric_features].to_numpy(dtype=np.float64).round(KEY_DECIMALS).tolist()
+      categorical = df[categorical_features].to_numpy().tolist()
+      return [(model_version, tuple(values), tuple(categories)) for values, categories in zip(numeric, categorical)]
+
+   def get_many(self, model_version, keys):
+      """
+      Look up the predictions of several keys.
+
+      Parameters:
+      model_version (str): Version of the model the keys were built for.
+      keys (list): Keys built by make_keys.
+
+      Returns:
+      list: The cached prediction of each key, or None for a miss.
+      """
+      now = time.monotonic()
+      values = []
+      with self._lock:
+         for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and entry[1] <= now:
+               del self._entries[key]
+               self.expirations += 1
+               entry = None
+            if entry is None:
+               self.misses += 1
+               values.append(None)
+            else:
+               self.hits += 1
+               self._entries.move_to_end(key)
+               values.append(entry[0])
+      return values
+
+   def put_many(self, model_version, keys, values):
+      """
+      Store the predictions of several keys, evicting the least recently used.
+
+      Parameters:
+      model_version (str): Version of the model that made the predictions.
+      keys (list): Keys built by make_keys.
+      values (list): The predictions.
+      """
+      expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+      with self._lock:
+         # A request finishing on a replaced model would fill the cache with entries nothing reads
+         if model_version in self._retired_versions:
+            return
+         for key, value in zip(keys, values):
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+         while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+   def retire_versions(self, live_version):
+      """
+      Drop the predictions of every model version but the live one.
+
+      Called once a new model is live, outside the request path.
+
+      Parameters:
+      live_version (str): Version of the model now live.
+      """
+      with self._lock:
+         if self._live_version is not None and self._live_version != live_version:
+            self._retired_versions.add(self._live_version)
+         self._live_version = live_version
+         self._retired_versions.discard(live_version)
+         stale = [key for key in self._entries if key[0] != live_version]
+         for key in stale:
+            self._retired_versions.add(key[0])
+            del self._entries[key]
+         if stale:
+            self.invalidations += 1
+
+   def clear(self):
+      """
+      Drop every cached prediction.
+      """
+      with self._lock:
+         self._entries.clear()
+
+   def stats(self):
+      """
+      Return the cache counters.
+
+      Returns:
+      dict: Size and hit, miss, eviction, expiration and invalidation counts.
+      """
+      with self._lock:
+         return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations
+         }
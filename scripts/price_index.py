@@ -0,0 +1,213 @@
+import numpy as np
+from catalog import CompactCatalog
+from data_preprocessing import split_valid_rows, CUT_CATEGORIES, COLOR_CATEGORIES, CLARITY_CATEGORIES
+
+"""
+Price Index
+
+This module answers "which diamonds cost between X and Y" queries without
+calling the model at request time. Every diamond of the catalog is scored once
+by the live model in vectorized chunks, and the predicted prices are kept
+sorted with the row positions and grades of each diamond in parallel columns:
+a query bisects the price range and only filters the grades of the rows
+inside it. The diamonds themselves are read from the compact catalog. When
+rows are appended to the catalog, only those are scored and merged in.
+
+Classes:
+   PriceIndex -- Catalog sorted by predicted price.
+
+Functions:
+   score_catalog -- Predicts the price of every diamond of a catalog.
+"""
+
+# Grades from worst to best: D is the best color
+GRADE_ORDERS = {
+   'cut': CUT_CATEGORIES,
+   'color': COLOR_CATEGORIES[::-1],
+   'clarity': CLARITY_CATEGORIES
+}
+# Maximum diamonds returned per page
+MAX_PAGE_SIZE = 1000
+# Catalog rows encoded and predicted per model call while scoring
+SCORE_CHUNK_SIZE = 100000
+
+
+def score_catalog(catalog, encoder, backend, start=0):
+   """
+   Predict the price of the diamonds of a catalog, one model call per chunk of rows.
+
+   Parameters:
+   catalog (CompactCatalog): The catalog.
+   encoder (FeatureEncoder): The feature encoder of the model.
+   backend (ModelBackend, LinearBackend or XGBoostBackend): The prediction backend of the model.
+   start (int): Position of the first row to score.
+
+   Returns:
+   np.ndarray: The predicted price of each row from start, NaN for the rows the API would reject.
+   """
+   prices = np.full(len(catalog) - start, np.nan)
+   for chunk_start in range(start, len(catalog), SCORE_CHUNK_SIZE):
+      # Indexed by row position, so the valid rows keep their position
+      valid_df, _ = split_valid_rows(catalog.take(slice(chunk_start, chunk_start + SCORE_CHUNK_SIZE)))
+      if not valid_df.empty:
+         prices[valid_df.index - start] = backend.predict(encoder.transform(valid_df, as_frame=backend.as_frame))
+   return prices
+
+def grade_ranks(catalog, attribute):
+   """
+   Rank the grades of a catalog column from worst (0) to best.
+
+   Parameters:
+   catalog (CompactCatalog): The catalog.
+   attribute (str): 'cut', 'color' or 'clarity'.
+
+   Returns:
+   np.ndarray: The int8 rank of each row, -1 for unknown grades.
+   """
+   order = GRADE_ORDERS[attribute]
+   # Rank of each category code; the trailing entry is picked by code -1 (missing)
+   ranks = [order.index(category) if category in order else -1 for category in catalog.categories[attribute]]
+   return np.array(ranks + [-1], dtype=np.int8)[catalog.column(attribute)]
+
+
+class PriceIndex:
+   """
+   Catalog sorted by the price predicted by one model.
+
+   A query costs O(log n) to find the price range and O(k) to filter the k
+   diamonds inside it, instead of predicting the whole catalog.
+
+   Parameters:
+   catalog (CompactCatalog or pd.DataFrame): The catalog, with the features of the model.
+   prices (np.ndarray): Predicted price of each row, NaN for the rows left out of the index.
+   model_version (str): Version of the model that predicted the prices.
+   data_version (str): Version of the catalog.
+   """
+
+   def __init__(self, catalog, prices, model_version=None, data_version=None):
+      self.catalog = catalog if isinstance(catalog, CompactCatalog) else CompactCatalog.from_frame(catalog)
+      self.row_prices = prices
+      self.model_version = model_version
+      self.data_version = data_version
+
+      scored = np.flatnonzero(np.isfinite(prices))
+      self.positions = scored[np.argsort(prices[scored], kind='stable')].astype(np.int32)
+      self.prices = prices[self.positions]
+      self.ranks = {attribute: grade_ranks(self.catalog, attribute)[self.positions] for attribute in GRADE_ORDERS}
+
+   @classmethod
+   def build(cls, catalog, encoder, backend, model_version=None, data_version=None):
+      """
+      Score a catalog and index it.
+
+      Parameters:
+      catalog (CompactCatalog or pd.DataFrame): The catalog.
+      encoder (FeatureEncoder): The feature encoder of the model.
+      backend (ModelBackend, LinearBackend or XGBoostBackend): The prediction backend of the model.
+      model_version (str): Version of the model.
+      data_version (str): Version of the catalog.
+
+      Returns:
+      PriceIndex: The index.
+      """
+      catalog = catalog if isinstance(catalog, CompactCatalog) else CompactCatalog.from_frame(catalog)
+      return cls(catalog, score_catalog(catalog, encoder, backend), model_version, data_version)
+
+   def refresh(self, catalog, encoder, backend, model_version=None, data_version=None):
+      """
+      Get the index of a new model or catalog version, rescoring as little as possible.
+
+      A new model rescores the whole catalog. A catalog that only gained rows
+      at the end keeps the prices of the existing rows and scores the new ones.
+
+      Parameters:
+      catalog (CompactCatalog or pd.DataFrame): The catalog.
+      encoder (FeatureEncoder): The feature encoder of the model.
+      backend (ModelBackend, LinearBackend or XGBoostBackend): The prediction backend of the model.
+      model_version (str): Version of the model.
+      data_version (str): Version of the catalog.
+
+      Returns:
+      PriceIndex: This index if nothing changed, otherwise a new one.
+      """
+      if model_version != self.model_version:
+         return PriceIndex.build(catalog, encoder, backend, model_version, data_version)
+      if data_version == self.data_version:
+         return self
+
+      catalog = catalog if isinstance(catalog, CompactCatalog) else CompactCatalog.from_frame(catalog)
+      if not catalog.extends(self.catalog):
+         return PriceIndex.build(catalog, encoder, backend, model_version, data_version)
+
+      new_prices = score_catalog(catalog, encoder, backend, start=len(self.catalog))
+      return PriceIndex(catalog, np.concatenate([self.row_prices, new_prices]), model_version, data_version)
+
+   def query_positions(self, min_price=None, max_price=None, grades=None, min_grades=None, offset=0, limit=20, descending=False):
+      """
+      Find the diamonds whose predicted price is in a range, with optional grade filters.
+
+      Parameters:
+      min_price (float): Lowest predicted price, inclusive (default: no bound).
+      max_price (float): Highest predicted price, inclusive (default: no bound).
+      grades (dict): Accepted grades per attribute, e.g. {'color': ['D', 'E']}.
+      min_grades (dict): Worst accepted grade per attribute, e.g. {'cut': 'Very Good'}.
+      offset (int): Number of matching diamonds to skip.
+      limit (int): Maximum number of diamonds to return, at most MAX_PAGE_SIZE.
+      descending (bool): Return the most expensive diamonds first.
+
+      Returns:
+      tuple: The number of matching diamonds, and the catalog positions and predicted
+      prices of the requested page, sorted by predicted price.
+
+      Raises:
+      ValueError: If a bound, a grade or the page is invalid.
+      """
+      if min_price is not None and max_price is not None and min_price > max_price:
+         raise ValueError("'min_price' must not be greater than 'max_price'.")
+      if offset < 0 or not 0 <= limit <= MAX_PAGE_SIZE:
+         raise ValueError(f"'offset' must be non-negative and 'limit' between 0 and {MAX_PAGE_SIZE}.")
+
+      lo = 0 if min_price is None else int(np.searchsorted(self.prices, min_price, side='left'))
+      hi = len(self.prices) if max_price is None else int(np.searchsorted(self.prices, max_price, side='right'))
+
+      mask = None
+      for attribute, values in (grades or {}).items():
+         # Lookup table of the accepted ranks; indexed rows never have an unknown (-1) grade
+         accepted = np.zeros(len(GRADE_ORDERS[attribute]), dtype=bool)
+         accepted[[self._rank(attribute, value) for value in values]] = True
+         matches = accepted[self.ranks[attribute][lo:hi]]
+         mask = matches if mask is None else mask & matches
+      for attribute, value in (min_grades or {}).items():
+         matches = self.ranks[attribute][lo:hi] >= self._rank(attribute, value)
+         mask = matches if mask is None else mask & matches
+
+      if mask is None:
+         # Without grade filters the page is a slice of the range
+         total = hi - lo
+         start, stop = (hi - offset - limit, hi - offset) if descending else (lo + offset, lo + offset + limit)
+         page = np.arange(max(start, lo), min(stop, hi))
+         page = page[::-1] if descending else page
+      else:
+         matches = np.flatnonzero(mask) + lo
+         total = len(matches)
+         page = (matches[::-1] if descending else matches)[offset:offset + limit]
+
+      return total, self.positions[page], self.prices[page]
+
+   def query(self, min_price=None, max_price=None, grades=None, min_grades=None, offset=0, limit=20, descending=False):
+      """
+      Return the diamonds whose predicted price is in a range, with the parameters of query_positions.
+
+      Returns:
+      tuple: The number of matching diamonds, and the requested page of them indexed by
+      row position, with a 'predicted_price' column, sorted by predicted price.
+      """
+      total, positions, prices = self.query_positions(min_price, max_price, grades, min_grades, offset, limit, descending)
+      return total, self.catalog.take(positions).assign(predicted_price=prices)
+
+   def _rank(self, attribute, value):
+      if attribute not in GRADE_ORDERS:
+         raise ValueError(f"Grades can only be filtered on {list(GRADE_ORDERS)}.")
+      if value not in GRADE_ORDERS[attribute]:
+         raise ValueError(f"Feature '{attribute}' must be one of {list(GRADE_ORDERS[attribute])}.")
+      return GRADE_ORDERS[attribute].index(value)
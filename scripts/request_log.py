@@ -0,0 +1,223 @@
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+"""
+Request Log
+
+This module writes the API requests and responses to SQLite off the request
+path. Entries are put on a bounded queue and a background thread inserts them
+in batched transactions on one long-lived connection in WAL mode.
+
+Classes:
+   RequestLogWriter -- Background writer of the request log.
+
+Functions:
+   init_db -- Creates the requests table.
+"""
+
+# Marker put on the queue to ask the writer thread for a flush
+_FLUSH = object()
+# Marker put on the queue to stop the writer thread
+_STOP = object()
+
+
+def connect(db_path):
+   """
+   Open a connection to the request log database in WAL mode.
+
+   Parameters:
+   db_path (str): Path to the SQLite database file.
+
+   Returns:
+   sqlite3.Connection: The open connection.
+   """
+   conn = sqlite3.connect(db_path)
+   conn.execute('PRAGMA journal_mode=WAL')
+   conn.execute('PRAGMA synchronous=NORMAL')
+   return conn
+
+def init_db(db_path):
+   """
+   Initialize the database for logging API requests and responses.
+
+   Parameters:
+   db_path (str): Path to the SQLite database file.
+   """
+   conn = connect(db_path)
+   conn.execute('''
+                CREATE TABLE IF NOT EXISTS requests
+                (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                endpoint TEXT,
+                request_data TEXT,
+                response_data TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)
+                ''')
+   conn.commit()
+   conn.close()
+
+
+class RequestLogWriter:
+   """
+   Log API requests and responses to SQLite from a background thread.
+
+   The queue is flushed in one transaction when it holds `batch_size` entries,
+   every `flush_interval` seconds and at shutdown. When the queue is full, the
+   'drop' policy discards the entry and counts it, the 'block' policy waits up
+   to `block_timeout` seconds for room before dropping it.
+
+   Parameters:
+   db_path (str): Path to the SQLite database file.
+   max_queue_size (int): Maximum number of entries waiting to be written.
+   batch_size (int): Number of entries that triggers a flush.
+   flush_interval (float): Maximum seconds an entry waits before being written.
+   full_policy (str): 'drop' or 'block', what to do when the queue is full.
+   block_timeout (float): Seconds the 'block' policy waits for room in the queue.
+   """
+
+   def __init__(self, db_path, max_queue_size=10000, batch_size=100, flush_interval=1.0, full_policy='drop', block_timeout=1.0):
+      if full_policy not in ('drop', 'block'):
+         raise ValueError(f"Unsupported queue full policy '{full_policy}'. Choose 'drop' or 'block'.")
+      self.db_path = db_path
+      self.batch_size = batch_size
+      self.flush_interval = flush_interval
+      self.full_policy = full_policy
+      self.block_timeout = block_timeout
+      self._queue = queue.Queue(maxsize=max_queue_size)
+      self._thread = None
+      self._counter_lock = threading.Lock()
+      self.dropped = 0
+      self.flushed = 0
+      self.batches = 0
+      self.errors = 0
+
+   def start(self):
+      """
+      Start the writer thread and register its shutdown at interpreter exit.
+      """
+      if self._thread is not None and self._thread.is_alive():
+         return
+      self._thread = threading.Thread(target=self._run, name='request-log-writer', daemon=True)
+      self._thread.start()
+      atexit.register(self.stop)
+
+   def log(self, endpoint, request_data, response_data):
+      """
+      Queue an API request and its response to be written.
+
+      The entry is timestamped here, in UTC like the column's CURRENT_TIMESTAMP
+      default, since it is only inserted at the next flush.
+
+      Parameters:
+      endpoint (str): The API endpoint that was called.
+      request_data (dict): The request data sent to the API.
+      response_data (dict): The response data returned by the API.
+
+      Returns:
+      bool: True if the entry was queued, False if it was dropped.
+      """
+      entry = (endpoint, request_data, response_data, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+      try:
+         if self.full_policy == 'block':
+            self._queue.put(entry, timeout=self.block_timeout)
+         else:
+            self._queue.put_nowait(entry)
+         return True
+      except queue.Full:
+         with self._counter_lock:
+            self.dropped += 1
+         return False
+
+   def flush(self, timeout=None):
+      """
+      Write every queued entry and wait until it is committed.
+
+      Parameters:
+      timeout (float): Maximum seconds to wait.
+
+      Returns:
+      bool: True if the flush completed in time.
+      """
+      if self._thread is None or not self._thread.is_alive():
+         return False
+      done = threading.Event()
+      self._queue.put((_FLUSH, done))
+      return done.wait(timeout)
+
+   def stop(self, timeout=10.0):
+      """
+      Flush the queued entries and stop the writer thread.
+
+      Parameters:
+      timeout (float): Maximum seconds to wait for the writer thread.
+      """
+      if self._thread is None:
+         return
+      self._queue.put((_STOP, None))
+      self._thread.join(timeout)
+      self._thread = None
+
+   def stats(self):
+      """
+      Return the writer counters.
+
+      Returns:
+      dict: Queue depth and the number of dropped, flushed and failed entries.
+      """
+      with self._counter_lock:
+         return {
+            'queued': self._queue.qsize(),
+            'dropped': self.dropped,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'errors': self.errors
+         }
+
+   def _write(self, conn, batch):
+      if not batch:
+         return
+      rows = [(endpoint, json.dumps(request_data), json.dumps(response_data), timestamp)
+              for endpoint, request_data, response_data, timestamp in batch]
+      try:
+         with conn:
+            conn.executemany('INSERT INTO requests (endpoint, request_data, response_data, timestamp) VALUES (?, ?, ?, ?)', rows)
+         with self._counter_lock:
+            self.flushed += len(rows)
+            self.batches += 1
+      except (sqlite3.Error, TypeError, ValueError) as e:
+         logging.error(f"Error writing {len(rows)} request log entries: {e}")
+         with self._counter_lock:
+            self.errors += len(rows)
+
+   def _run(self):
+      conn = connect(self.db_path)
+      batch = []
+      deadline = time.monotonic() + self.flush_interval
+      try:
+         while True:
+            try:
+               item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+               item = None
+
+            if item is not None and item[0] is _STOP:
+               self._write(conn, batch)
+               return
+            if item is not None and item[0] is _FLUSH:
+               self._write(conn, batch)
+               batch = []
+               item[1].set()
+               continue
+            if item is not None:
+               batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+               self._write(conn, batch)
+               batch = []
+               deadline = time.monotonic() + self.flush_interval
+      finally:
+         conn.close()
@@ -0,0 +1,332 @@
+import argparse
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+from data_preprocessing import split_valid_rows
+from feature_encoder import build_feature_encoders
+from inference import build_backend
+from model_export import load_artifact, promoted_artifact_dir
+
+Scorer = namedtuple('Scorer', ['model_name', 'version', 'encoder', 'backend'])
+
+# Chunks queued or being scored per worker process; memory is bounded by this many chunks
+CHUNKS_PER_WORKER = 2
+
+# Scorer of the current process, loaded once by init_worker
+_scorer = None
+
+
+def get_project_root():
+    """
+    Get the project root directory.
+
+    Returns:
+    str: The absolute path to the project root directory.
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.abspath(os.path.join(current_dir, os.pardir))
+
+def get_file_format(path):
+    """
+    Get the format of a data file from its extension.
+
+    Parameters:
+    path (str): Path to the file.
+
+    Returns:
+    str: 'parquet' for .parquet and .pq files, 'csv' otherwise.
+    """
+    return 'parquet' if path.lower().endswith(('.parquet', '.pq')) else 'csv'
+
+def import_parquet():
+    """
+    Import pyarrow's Parquet module, needed only for Parquet files.
+
+    Returns:
+    module: pyarrow.parquet.
+    """
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading or writing Parquet files requires pyarrow: pip install pyarrow")
+    return pyarrow.parquet
+
+def read_chunks(path, chunk_size):
+    """
+    Stream a CSV or Parquet file as dataframes of at most chunk_size rows.
+
+    Parameters:
+    path (str): Path to the input file.
+    chunk_size (int): Maximum rows per chunk.
+
+    Returns:
+    generator: The chunks, in file order.
+    """
+    if get_file_format(path) == 'parquet':
+        parquet_file = import_parquet().ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def encode_chunk(chunk, file_format):
+    """
+    Serialize a scored chunk for the output file.
+
+    Chunks are serialized by the scoring processes, so that the process
+    writing the file only appends them.
+
+    Parameters:
+    chunk (pd.DataFrame): The scored rows.
+    file_format (str): 'csv' or 'parquet'.
+
+    Returns:
+    str or pyarrow.Table: The CSV rows without header, or the Arrow table.
+    """
+    if file_format == 'parquet':
+        import pyarrow
+
+        return pyarrow.Table.from_pandas(chunk, preserve_index=False)
+    return chunk.to_csv(index=False, header=False)
+
+
+class ChunkWriter:
+    """
+    Append serialized chunks to a CSV or Parquet file as they arrive.
+
+    Parameters:
+    path (str): Path to the output file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = get_file_format(path)
+        self._file = None
+        self._parquet_writer = None
+
+    def write(self, payload, columns):
+        """
+        Append a chunk to the file.
+
+        Parameters:
+        payload (str or pyarrow.Table): The chunk serialized by encode_chunk.
+        columns (list): The columns of the chunk, written as the CSV header.
+        """
+        if self.format == 'parquet':
+            if self._parquet_writer is None:
+                self._parquet_writer = import_parquet().ParquetWriter(self.path, payload.schema)
+            # Every chunk is cast to the schema of the first one
+            self._parquet_writer.write_table(payload.cast(self._parquet_writer.schema))
+        else:
+            if self._file is None:
+                self._file = open(self.path, 'w', newline='')
+                self._file.write(pd.DataFrame(columns=columns).to_csv(index=False))
+            self._file.write(payload)
+
+    def close(self):
+        """
+        Finish the file.
+        """
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._file is not None:
+            self._file.close()
+
+def resolve_best_model(best_model_dir='models/best_model'):
+    """
+    Get the path of the promoted model, so that every worker loads the same one.
+
+    Parameters:
+    best_model_dir (str): Directory where the best model is stored, relative to the project root.
+
+    Returns:
+    str: The model store artifact directory, or the pickled best model for models promoted before the store existed
+    or replaced outside it.
+    """
+    best_model_dir = os.path.join(get_project_root(), best_model_dir)
+    artifact_dir = promoted_artifact_dir(best_model_dir)
+    if artifact_dir is not None:
+        return artifact_dir
+
+    best_model_path = os.path.join(best_model_dir, 'best_model.pkl')
+    if not os.path.exists(best_model_path):
+        raise FileNotFoundError(f"No best model found in directory: {best_model_dir}")
+    return best_model_path
+
+def load_scorer(model_path):
+    """
+    Load a model with its feature encoder and prediction backend.
+
+    Parameters:
+    model_path (str): A model store artifact directory or a pickled model.
+
+    Returns:
+    Scorer: The model name and version, the encoder and the backend.
+    """
+    if os.path.isdir(model_path):
+        model, metadata = load_artifact(model_path)
+    else:
+        import joblib
+
+        model, metadata = joblib.load(model_path)
+
+    model_name = metadata['model_name']
+    encoder = build_feature_encoders()[model_name]
+    return Scorer(model_name, metadata.get('version', 'unknown'), encoder, build_backend(model, model_name))
+
+def init_worker(model_path, n_jobs=None):
+    """
+    Load the scorer of the current process.
+
+    Parameters:
+    model_path (str): A model store artifact directory or a pickled model.
+    n_jobs (int): Threads of the model and the BLAS/OpenMP pools of the process.
+    """
+    global _scorer
+    if n_jobs:
+        # Cap the pools so parallel workers do not oversubscribe the cores
+        threadpool_limits(limits=n_jobs)
+    _scorer = load_scorer(model_path)
+
+def score_chunk(chunk, skip_invalid=False, file_format=None):
+    """
+    Predict the price of every valid row of a chunk with the scorer of the current process.
+
+    Rows the training preprocessing would drop are not scored: rows with a
+    missing or invalid feature, a zero dimension or, when the input has a
+    price column, a missing, non-numeric or non-positive price.
+
+    Parameters:
+    chunk (pd.DataFrame): The raw rows.
+    skip_invalid (bool): Drop the invalid rows instead of flagging them in an 'error' column.
+    file_format (str): Serialize the scored chunk for a 'csv' or 'parquet' output file (see encode_chunk).
+
+    Returns:
+    tuple: The chunk with a 'predicted_price' column (and an 'error' column
+    unless skip_invalid), serialized if file_format is set, its columns, the
+    number of rows read and the number of invalid rows.
+    """
+    chunk = chunk.reset_index(drop=True)
+    valid_df, errors = split_valid_rows(chunk)
+
+    # Same condition as the price filter applied by the preprocess functions, which keep rows where price > 0:
+    # missing and non-numeric prices are dropped too
+    if 'price' in chunk.columns:
+        price = pd.to_numeric(chunk['price'], errors='coerce').to_numpy(dtype=np.float64)
+        invalid_price = errors.isna().to_numpy() & ~(price > 0)
+        errors[invalid_price] = "Feature 'price' must be a positive number."
+        valid_df = valid_df[~invalid_price[valid_df.index]]
+
+    predicted_price = np.full(len(chunk), np.nan)
+    if not valid_df.empty:
+        features = _scorer.encoder.transform(valid_df, as_frame=_scorer.backend.as_frame)
+        predicted_price[valid_df.index] = _scorer.backend.predict(features)
+
+    n_invalid = len(chunk) - len(valid_df)
+    chunk['predicted_price'] = predicted_price
+    if skip_invalid:
+        chunk = chunk.iloc[valid_df.index]
+    else:
+        chunk['error'] = errors.astype('string')
+    payload = encode_chunk(chunk, file_format) if file_format is not None else chunk
+    return payload, list(chunk.columns), len(errors), n_invalid
+
+def score_chunks(chunks, model_path, workers=1, n_jobs=None, skip_invalid=False, file_format=None):
+    """
+    Score a stream of chunks, in order, across a pool of processes.
+
+    At most CHUNKS_PER_WORKER chunks per worker are in flight, so memory
+    stays bounded by the chunk size whatever the length of the stream.
+
+    Parameters:
+    chunks (iterable): The raw chunks.
+    model_path (str): A model store artifact directory or a pickled model.
+    workers (int): Number of scoring processes (1 scores in the current process).
+    n_jobs (int): Threads per scoring process.
+    skip_invalid (bool): Drop the invalid rows instead of flagging them.
+    file_format (str): Serialize the scored chunks for a 'csv' or 'parquet' output file.
+
+    Returns:
+    generator: The results of score_chunk, in input order.
+    """
+    if workers == 1:
+        init_worker(model_path, n_jobs)
+        for chunk in chunks:
+            yield score_chunk(chunk, skip_invalid, file_format)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(model_path, n_jobs)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(score_chunk, chunk, skip_invalid, file_format))
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def score_file(input_path, output_path, chunk_size=100_000, workers=None, n_jobs=None, skip_invalid=False,
+               best_model_dir='models/best_model'):
+    """
+    Price every row of a CSV or Parquet file with the best model.
+
+    Parameters:
+    input_path (str): Path to the input file.
+    output_path (str): Path to the output file, CSV or Parquet according to its extension.
+    chunk_size (int): Rows per chunk.
+    workers (int): Number of scoring processes (default: the CPU count).
+    n_jobs (int): Threads per scoring process (default: the CPU count divided by the workers).
+    skip_invalid (bool): Leave the invalid rows out of the output instead of flagging them.
+    best_model_dir (str): Directory where the best model is stored, relative to the project root.
+
+    Returns:
+    dict: Rows read and invalid, model version, elapsed seconds and rows per second.
+    """
+    model_path = resolve_best_model(best_model_dir)
+    cpu_count = os.cpu_count() or 1
+    workers = workers or cpu_count
+    n_jobs = n_jobs or max(1, cpu_count // workers)
+
+    start = time.perf_counter()
+    rows, invalid = 0, 0
+    writer = ChunkWriter(output_path)
+    try:
+        scored_chunks = score_chunks(read_chunks(input_path, chunk_size), model_path, workers, n_jobs, skip_invalid, writer.format)
+        for payload, columns, n_rows, n_invalid in scored_chunks:
+            writer.write(payload, columns)
+            rows += n_rows
+            invalid += n_invalid
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'model_path': model_path,
+        'rows': rows,
+        'invalid': invalid,
+        'elapsed_s': elapsed,
+        'rows_per_s': rows / elapsed if elapsed > 0 else 0.0
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Price a CSV or Parquet file of diamonds with the best model.")
+    parser.add_argument('input_path', type=str, help="Path to the input CSV or Parquet file")
+    parser.add_argument('output_path', type=str, help="Path to the output file, CSV or Parquet according to its extension")
+    parser.add_argument('--chunk-size', type=int, default=100_000, help="Rows read, scored and written at a time")
+    parser.add_argument('--workers', type=int, default=None, help="Scoring processes (default: the CPU count)")
+    parser.add_argument('--n-jobs', type=int, default=None, help="Threads per scoring process (default: CPU count / workers)")
+    parser.add_argument('--skip-invalid', action='store_true', help="Leave out the rows that cannot be scored instead of flagging them in an 'error' column")
+    parser.add_argument('--best-model-dir', type=str, default='models/best_model', help="Directory of the best model, relative to the project root")
+
+    args = parser.parse_args()
+
+    summary = score_file(args.input_path, args.output_path, args.chunk_size, args.workers, args.n_jobs,
+                         args.skip_invalid, args.best_model_dir)
+    action = 'skipped' if args.skip_invalid else 'flagged'
+    print(f"Scored {summary['rows']} rows with {summary['model_path']} in {summary['elapsed_s']:.2f}s "
+          f"({summary['rows_per_s']:.0f} rows/s), {summary['invalid']} invalid rows {action}.")
@@ -0,0 +1,112 @@
+import argparse
+import gc
+import logging
+import os
+import signal
+import threading
+import time
+from gunicorn.app.base import BaseApplication
+
+# Seconds between two checks of the model and data files in the master process
+SERVE_POLL_INTERVAL = float(os.environ.get('SERVE_POLL_INTERVAL', 5))
+
+
+def watch_artifacts(server, holders, poll_interval):
+    """
+    Reload the changed artifacts in the master process and restart the workers on them.
+
+    New workers are forked from the master, so once an artifact is reloaded
+    here a SIGHUP makes gunicorn start workers sharing the new state and stop
+    the old ones after their in-flight requests.
+
+    Parameters:
+    server (gunicorn.arbiter.Arbiter): The gunicorn master.
+    holders (list): The ArtifactHolder objects of the API.
+    poll_interval (float): Seconds between two checks of the files.
+    """
+    while True:
+        time.sleep(poll_interval)
+        reloaded = [holder.name for holder in holders if holder.refresh()]
+        if reloaded:
+            server.log.info(f"Reloaded {', '.join(reloaded)}, restarting the workers.")
+            gc.freeze()
+            os.kill(os.getpid(), signal.SIGHUP)
+
+def when_ready(server):
+    """
+    Gunicorn hook run in the master once the state is preloaded: start watching the artifacts.
+    """
+    # The preloaded state is never collected, so the workers do not copy its pages when the GC runs
+    gc.freeze()
+    from api import artifact_holders
+    threading.Thread(target=watch_artifacts, args=(server, artifact_holders, SERVE_POLL_INTERVAL),
+                     name='artifact-watcher', daemon=True).start()
+
+def post_fork(server, worker):
+    """
+    Gunicorn hook run in each new worker: start its request log writer and micro-batcher and warm up the model.
+    """
+    from api import start_background_threads, warm_up
+    start_background_threads(watch_artifacts=False)
+    warm_up()
+
+def worker_exit(server, worker):
+    """
+    Gunicorn hook run when a worker stops: write its queued request log entries.
+    """
+    from api import request_log
+    request_log.stop()
+
+
+class APIServer(BaseApplication):
+    """
+    Gunicorn application serving the API with preloaded, fork-shared state.
+
+    The API module is imported once in the master process, which loads the
+    best model, the feature encoders and the similar diamonds indexes. The
+    workers are forked afterwards and share that memory copy-on-write.
+
+    Parameters:
+    options (dict): Gunicorn settings.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('preload_app', True)
+        self.cfg.set('when_ready', when_ready)
+        self.cfg.set('post_fork', post_fork)
+        self.cfg.set('worker_exit', worker_exit)
+
+    def load(self):
+        os.environ['SERVE_PRELOAD'] = '1'
+        from api import app
+        return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Serve the API with multiple worker processes.")
+    parser.add_argument('--bind', default=os.environ.get('SERVE_BIND', '127.0.0.1:8000'), help="Address to listen on")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVE_WORKERS', (os.cpu_count() or 1) * 2 + 1)),
+                        help="Worker processes (default: 2 x CPU count + 1)")
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SERVE_THREADS', 4)), help="Threads per worker")
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('SERVE_TIMEOUT', 30)), help="Seconds before a silent worker is restarted")
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.environ.get('SERVE_GRACEFUL_TIMEOUT', 30)),
+                        help="Seconds a worker has to finish its requests on reload or shutdown")
+
+    args = parser.parse_args()
+
+    APIServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout
+    }).run()
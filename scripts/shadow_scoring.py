@@ -0,0 +1,420 @@
+import argparse
+import atexit
+import json
+import logging
+import math
+import os
+import queue
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from request_log import connect
+
+"""
+Shadow Scoring
+
+This module scores the live /predict traffic with candidate models off the
+request path, to compare them with the live model on real inputs before one
+is promoted. The API hands each answered request to a ShadowScorer, which
+queues it without waiting. A small pool of worker processes, at the lowest
+scheduling priority, predicts it with every candidate and writes their
+predictions and inference latency, next to the live model's predictions, to
+SQLite. Running in separate processes, the candidates never hold the GIL of
+the API nor take the CPU from its requests. The queue is bounded: when the
+pool falls behind, new requests are shed instead of queued.
+
+Classes:
+   ShadowScorer -- Bounded pool of worker processes scoring requests with candidate models.
+
+Functions:
+   init_shadow_db -- Creates the shadow predictions table.
+   run_worker -- Main loop of a worker process.
+   summarize_shadow_predictions -- Compares each candidate with the live model.
+"""
+
+# Marker put on the queue to stop a feeder thread
+_STOP = object()
+
+
+def init_shadow_db(db_path):
+   """
+   Initialize the table of the shadow predictions.
+
+   Parameters:
+   db_path (str): Path to the SQLite database file.
+   """
+   conn = connect(db_path)
+   conn.execute('''
+                CREATE TABLE IF NOT EXISTS shadow_predictions
+                (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model_version TEXT,
+                live_model_version TEXT,
+                rows INTEGER,
+                predictions TEXT,
+                live_predictions TEXT,
+                latency_ms REAL,
+                mean_abs_diff REAL,
+                error TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)
+                ''')
+   conn.commit()
+   conn.close()
+
+def mean_abs_diff(predictions, live_predictions):
+   """
+   Mean absolute difference between two prediction lists, over the rows both predicted.
+
+   Returns:
+   float: The mean difference, or None if no row was predicted by both.
+   """
+   diffs = [abs(a - b) for a, b in zip(predictions, live_predictions or [])
+            if a is not None and b is not None and math.isfinite(a) and math.isfinite(b)]
+   return sum(diffs) / len(diffs) if diffs else None
+
+
+class ShadowScorer:
+   """
+   Score requests with candidate models on a bounded pool of worker processes.
+
+   Each worker process loads every candidate and is fed by a thread of this
+   process, one request at a time, over its standard input and output.
+   `submit` never blocks: a request is shed when `max_queue_size` requests
+   are already waiting, or left out by sampling.
+
+   Parameters:
+   artifact_dirs (list): Model store artifact directories of the candidates.
+   db_path (str): Path to the SQLite database file.
+   max_workers (int): Number of worker processes.
+   max_queue_size (int): Maximum number of requests waiting to be scored.
+   sample_rate (float): Share of the submitted requests that are scored.
+   latency_histogram (Histogram): If given, observes the inference latency of each candidate, labelled by version.
+   warm_up_records (list): Records predicted by every candidate once loaded, before it scores requests.
+   nice (int): Niceness added to the worker processes.
+   """
+
+   def __init__(self, artifact_dirs, db_path, max_workers=1, max_queue_size=100, sample_rate=1.0, latency_histogram=None,
+                warm_up_records=None, nice=19):
+      self.artifact_dirs = list(artifact_dirs)
+      self.db_path = db_path
+      self.max_workers = max_workers
+      self.sample_rate = sample_rate
+      self.latency_histogram = latency_histogram
+      self.warm_up_records = warm_up_records
+      self.nice = nice
+      self._queue = queue.Queue(maxsize=max_queue_size)
+      self._threads = []
+      self._counter_lock = threading.Lock()
+      self.workers = 0
+      self.submitted = 0
+      self.shed = 0
+      self.scored = 0
+      self.models = {}
+
+   def start(self):
+      """
+      Start the worker processes with their feeder threads, and register their shutdown at interpreter exit.
+      """
+      if any(thread.is_alive() for thread in self._threads):
+         return
+      self._threads = [threading.Thread(target=self._run, name=f'shadow-scorer-{i}', daemon=True) for i in range(self.max_workers)]
+      for thread in self._threads:
+         thread.start()
+      atexit.register(self.stop)
+
+   def submit(self, records, live_predictions, live_model_version):
+      """
+      Queue a request to be scored by the candidates, unless it is shed.
+
+      Parameters:
+      records (list): The raw feature records of the request.
+      live_predictions (list): The predictions of the live model, aligned with records.
+      live_model_version (str): The version of the live model.
+
+      Returns:
+      bool: True if the request was queued.
+      """
+      if self.sample_rate < 1 and random.random() >= self.sample_rate:
+         return False
+      try:
+         self._queue.put_nowait((records, live_predictions, live_model_version))
+         queued = True
+      except queue.Full:
+         queued = False
+      with self._counter_lock:
+         self.submitted += 1
+         self.shed += not queued
+      return queued
+
+   def stop(self, timeout=10.0):
+      """
+      Score the queued requests and stop the worker processes.
+
+      Parameters:
+      timeout (float): Maximum seconds to wait for each feeder thread.
+      """
+      threads, self._threads = self._threads, []
+      for thread in threads:
+         # Threads whose worker exited no longer read the queue
+         if thread.is_alive():
+            try:
+               self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+               pass
+      for thread in threads:
+         thread.join(timeout)
+
+   def stats(self):
+      """
+      Return the scorer counters.
+
+      Returns:
+      dict: Running workers, queue depth, submitted, shed and scored requests, and per candidate
+      its requests, errors, mean latency and mean absolute difference with the live model.
+      """
+      with self._counter_lock:
+         models = {}
+         for version, counts in self.models.items():
+            models[version] = {
+               'requests': counts['requests'],
+               'errors': counts['errors'],
+               'mean_latency_ms': counts['latency_ms'] / counts['requests'] if counts['requests'] else None,
+               'mean_abs_diff': counts['abs_diff'] / counts['compared_requests'] if counts['compared_requests'] else None
+            }
+         return {
+            'workers': self.workers,
+            'queued': self._queue.qsize(),
+            'submitted': self.submitted,
+            'shed': self.shed,
+            'scored': self.scored,
+            'models': models
+         }
+
+   def _call(self, process, job):
+      # One request, one reply line; None if the worker is gone
+      try:
+         process.stdin.write(json.dumps(job, default=str) + '\n')
+         process.stdin.flush()
+         line = process.stdout.readline()
+         return json.loads(line) if line else None
+      except (OSError, ValueError):
+         return None
+
+   def _record(self, reply):
+      with self._counter_lock:
+         self.scored += 1
+         for version, (latency, diff, error) in reply.items():
+            counts = self.models[version]
+            counts['requests'] += 1
+            counts['errors'] += error is not None
+            counts['latency_ms'] += latency * 1000
+            if diff is not None:
+               counts['compared_requests'] += 1
+               counts['abs_diff'] += diff
+      if self.latency_histogram is not None:
+         for version, (latency, _, error) in reply.items():
+            if error is None:
+               self.latency_histogram.observe(latency, version)
+
+   def _run(self):
+      command = [sys.executable, os.path.abspath(__file__), '--worker', *self.artifact_dirs,
+                 '--db-path', self.db_path, '--nice', str(self.nice)]
+      process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+      try:
+         line = process.stdout.readline()
+         if not line:
+            logging.error('Shadow scoring worker exited before loading the candidates.')
+            return
+         loaded = json.loads(line)
+         for artifact_dir, error in loaded['errors'].items():
+            logging.error(f"Error loading shadow candidate {artifact_dir}: {error}")
+         with self._counter_lock:
+            for version in loaded['versions']:
+               self.models.setdefault(version, {'requests': 0, 'errors': 0, 'latency_ms': 0.0, 'compared_requests': 0, 'abs_diff': 0.0})
+         # Without a live model version, the warm-up predictions are not logged
+         if self.warm_up_records and self._call(process, [self.warm_up_records, None, None]) is None:
+            logging.error('Shadow scoring worker exited during its warm-up.')
+            return
+
+         with self._counter_lock:
+            self.workers += 1
+         try:
+            while True:
+               job = self._queue.get()
+               if job is _STOP:
+                  return
+               reply = self._call(process, job)
+               if reply is None:
+                  logging.error(f"Shadow scoring worker exited with code {process.poll()}.")
+                  return
+               self._record(reply)
+         finally:
+            with self._counter_lock:
+               self.workers -= 1
+      finally:
+         # End of input stops the worker
+         try:
+            process.stdin.close()
+         except OSError:
+            pass
+         try:
+            process.wait(timeout=10)
+         except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def predict_records(scorer, records):
+   """
+   Predict the raw records of a request with a candidate model.
+
+   Parameters:
+   scorer (score.Scorer): The candidate model with its encoder and backend.
+   records (list): The raw feature records.
+
+   Returns:
+   list: The prediction of each record, None for the rows rejected by validation.
+   """
+   import pandas as pd
+   from data_preprocessing import split_valid_rows
+
+   df = pd.DataFrame(records, index=range(len(records)))
+   valid_df, _ = split_valid_rows(df)
+   predictions = [None] * len(df)
+   if not valid_df.empty:
+      features = scorer.encoder.transform(valid_df, as_frame=scorer.backend.as_frame)
+      for position, prediction in zip(valid_df.index, scorer.backend.predict(features).tolist()):
+         predictions[position] = prediction
+   return predictions
+
+def run_worker(artifact_dirs, db_path, nice=19):
+   """
+   Score the requests read from standard input with the candidates, until end of input.
+
+   Each input line is a JSON [records, live predictions, live model version]
+   request. Its predictions are written to the shadow predictions table and a
+   JSON line mapping each candidate version to its [latency in seconds, mean
+   absolute difference with the live model, error] is written back. The first
+   output line lists the loaded candidate versions and the load errors.
+
+   Parameters:
+   artifact_dirs (list): Model store artifact directories of the candidates.
+   db_path (str): Path to the SQLite database file.
+   nice (int): Niceness added to this process.
+   """
+   # Keep the standard output for the replies, anything else printed goes to the standard error
+   replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+   os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+   os.nice(nice)
+
+   from threadpoolctl import threadpool_limits
+   from score import load_scorer
+
+   # One thread per worker process, the pool size is set by max_workers
+   threadpool_limits(limits=1)
+   scorers, errors = {}, {}
+   for artifact_dir in artifact_dirs:
+      try:
+         scorer = load_scorer(artifact_dir)
+         scorers[scorer.version] = scorer
+      except Exception as e:
+         errors[artifact_dir] = str(e)
+   replies.write(json.dumps({'versions': list(scorers), 'errors': errors}) + '\n')
+   replies.flush()
+
+   conn = connect(db_path)
+   try:
+      for line in sys.stdin:
+         records, live_predictions, live_model_version = json.loads(line)
+         reply, rows = {}, []
+         for version, scorer in scorers.items():
+            start = time.perf_counter()
+            try:
+               predictions, error = predict_records(scorer, records), None
+            except Exception as e:
+               predictions, error = None, str(e)
+            latency = time.perf_counter() - start
+            diff = mean_abs_diff(predictions, live_predictions) if predictions is not None else None
+            reply[version] = [latency, diff, error]
+            rows.append((version, live_model_version, len(records), json.dumps(predictions), json.dumps(live_predictions),
+                         latency * 1000, diff, error))
+
+         if live_model_version is not None:
+            try:
+               with conn:
+                  conn.executemany('''
+                                   INSERT INTO shadow_predictions
+                                   (model_version, live_model_version, rows, predictions, live_predictions, latency_ms, mean_abs_diff, error)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                   ''', rows)
+            except sqlite3.Error as e:
+               logging.error(f"Error writing {len(rows)} shadow predictions: {e}")
+         replies.write(json.dumps(reply) + '\n')
+         replies.flush()
+   finally:
+      conn.close()
+
+def summarize_shadow_predictions(db_path, since=None):
+   """
+   Compare each candidate with the live model over the logged shadow predictions.
+
+   Parameters:
+   db_path (str): Path to the SQLite database file.
+   since (str): Only use the predictions logged at or after this UTC timestamp ('YYYY-MM-DD HH:MM:SS').
+
+   Returns:
+   list: One dict per candidate and live model version with the number of requests and rows,
+   the errors, the mean and p95 latency and the mean absolute difference with the live predictions.
+   """
+   conn = connect(db_path)
+   try:
+      rows = conn.execute('''
+                          SELECT model_version, live_model_version, rows, latency_ms, mean_abs_diff, error
+                          FROM shadow_predictions WHERE timestamp >= ? ORDER BY id
+                          ''', (since or '',)).fetchall()
+   finally:
+      conn.close()
+
+   groups = {}
+   for model_version, live_model_version, n_rows, latency_ms, diff, error in rows:
+      group = groups.setdefault((model_version, live_model_version), {'rows': 0, 'errors': 0, 'latencies': [], 'diffs': []})
+      group['rows'] += n_rows
+      group['errors'] += error is not None
+      group['latencies'].append(latency_ms)
+      if diff is not None:
+         group['diffs'].append(diff)
+
+   summary = []
+   for (model_version, live_model_version), group in groups.items():
+      latencies = sorted(group['latencies'])
+      summary.append({
+         'model_version': model_version,
+         'live_model_version': live_model_version,
+         'requests': len(latencies),
+         'rows': group['rows'],
+         'errors': group['errors'],
+         'mean_latency_ms': sum(latencies) / len(latencies),
+         'p95_latency_ms': latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)],
+         'mean_abs_diff': sum(group['diffs']) / len(group['diffs']) if group['diffs'] else None
+      })
+   return summary
+
+
+if __name__ == "__main__":
+   parser = argparse.ArgumentParser(description="Compare the shadow-scored candidate models with the live model.")
+   parser.add_argument('--db-path', default=None, help="Request log database (default: the API's)")
+   parser.add_argument('--since', default=None, help="Only use predictions logged since this UTC timestamp ('YYYY-MM-DD HH:MM:SS')")
+   parser.add_argument('--worker', nargs='+', default=None, metavar='ARTIFACT_DIR', help="Run as a worker process of the API's shadow scorer for these candidates")
+   parser.add_argument('--nice', type=int, default=19, help="Niceness added to a worker process")
+   args = parser.parse_args()
+
+   db_path = args.db_path or os.environ.get('REQUEST_LOG_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_requests.db'))
+   if args.worker:
+      run_worker(args.worker, db_path, args.nice)
+      sys.exit(0)
+
+   for entry in summarize_shadow_predictions(db_path, args.since):
+      diff = f"{entry['mean_abs_diff']:.2f}" if entry['mean_abs_diff'] is not None else '-'
+      print(f"{entry['model_version']:<36} vs {entry['live_model_version']:<36} requests={entry['requests']} rows={entry['rows']} "
+            f"errors={entry['errors']} mean_ms={entry['mean_latency_ms']:.3f} p95_ms={entry['p95_latency_ms']:.3f} mean_abs_diff={diff}")
@@ -0,0 +1,128 @@
+import numpy as np
+from catalog import CompactCatalog, load_catalog
+from dataset_cache import to_float64
+
+"""
+Similarity Index
+
+This module answers the "same cut, color and clarity, closest weight" query of
+the API without scanning the whole dataset. The rows are grouped once by
+(cut, color, clarity) and each group keeps its carats sorted, so the n closest
+diamonds are found by bisecting on the given weight and expanding outward.
+The rows themselves stay in the compact catalog; the index only holds the
+sorted carats and the row positions of each group.
+
+Classes:
+   SimilarDiamondsIndex -- Grouped, carat-sorted index over the dataset.
+
+Functions:
+   load_similarity_index -- Builds the index from a dataset file.
+"""
+
+
+class SimilarDiamondsIndex:
+   """
+   Index of the dataset grouped by (cut, color, clarity) and sorted by carat.
+
+   A query costs O(log n + k) for a group of n rows and k results. Results
+   are ordered by weight difference, ties broken by position in the dataset.
+   That is the order of `nsmallest` on the weight difference when fewer rows
+   than the group are asked for; when the whole group is asked for,
+   `nsmallest` falls back to an unstable sort and orders ties arbitrarily,
+   so only the rows and their differences match.
+
+   Parameters:
+   catalog (CompactCatalog or pd.DataFrame): The dataset, with 'cut', 'color', 'clarity' and 'carat' columns.
+   """
+
+   def __init__(self, catalog):
+      self.catalog = catalog if isinstance(catalog, CompactCatalog) else CompactCatalog.from_frame(catalog)
+      carats = self.catalog.column('carat')
+      # Compare weights on the decimal values of the dataset, not on their float32 approximation
+      carats = to_float64(carats) if carats.dtype == np.float32 else carats.astype(np.float64)
+
+      self.groups = {}
+      for key, positions in self.catalog.group_positions(('cut', 'color', 'clarity')).items():
+         order = np.argsort(carats[positions], kind='stable')
+         self.groups[key] = (carats[positions][order], positions[order])
+
+   def query_positions(self, cut, color, clarity, weight, n):
+      """
+      Find the positions of the n diamonds of a group with the closest weight.
+
+      Parameters:
+      cut (str): Cut of the diamond.
+      color (str): Color of the diamond.
+      clarity (str): Clarity of the diamond.
+      weight (float): Weight in carats to compare to.
+      n (int): Number of diamonds to return.
+
+      Returns:
+      np.ndarray: Row positions in the dataset, closest first, or None if the group is empty.
+      """
+      group = self.groups.get((cut, color, clarity))
+      if group is None:
+         return None
+
+      carats, positions = group
+      size = len(carats)
+      n = min(n, size)
+      if n <= 0:
+         return positions[:0]
+
+      # Expand a window [lo + 1, hi) around the insertion point of the weight
+      lo = int(np.searchsorted(carats, weight)) - 1
+      hi = lo + 1
+      for _ in range(n):
+         if lo < 0:
+            hi += 1
+         elif hi >= size or weight - carats[lo] <= carats[hi] - weight:
+            lo -= 1
+         else:
+            hi += 1
+
+      # Include the rows tied with the n-th distance so ties resolve by position
+      kth_diff = max(abs(carats[lo + 1] - weight), abs(carats[hi - 1] - weight))
+      while lo >= 0 and abs(carats[lo] - weight) == kth_diff:
+         lo -= 1
+      while hi < size and abs(carats[hi] - weight) == kth_diff:
+         hi += 1
+
+      window_positions = positions[lo + 1:hi]
+      window_diffs = np.abs(carats[lo + 1:hi] - weight)
+      order = np.lexsort((window_positions, window_diffs))[:n]
+
+      return window_positions[order]
+
+   def query(self, cut, color, clarity, weight, n=5):
+      """
+      Return the n diamonds of the same cut, color and clarity with the closest weight.
+
+      Parameters:
+      cut (str): Cut of the diamond.
+      color (str): Color of the diamond.
+      clarity (str): Clarity of the diamond.
+      weight (float): Weight in carats to compare to.
+      n (int): Number of diamonds to return.
+
+      Returns:
+      pd.DataFrame: The similar diamonds indexed by row position, closest first,
+      or None if no diamond has the same cut, color and clarity.
+      """
+      positions = self.query_positions(cut, color, clarity, weight, n)
+      if positions is None:
+         return None
+      return self.catalog.take(positions)
+
+
+def load_similarity_index(data_path):
+   """
+   Build the similarity index from a dataset file.
+
+   Parameters:
+   data_path (str): Path to the dataset CSV file.
+
+   Returns:
+   SimilarDiamondsIndex: The index over the compact catalog of the dataset.
+   """
+   return SimilarDiamondsIndex(load_catalog(data_path))
@@ -0,0 +1,203 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import cKDTree
+from catalog import CompactCatalog, load_catalog
+from data_preprocessing import NUMERIC_FEATURES
+
+"""
+Similarity Search
+
+This module finds the nearest diamonds of the catalog across several numeric
+attributes (carat, depth, table, x, y, z). The numeric features are
+standardized with the catalog mean and standard deviation, multiplied by the
+square root of their weight, and indexed with one KD-tree per partition of the
+categorical attributes that must match, so a query only visits its partition.
+Rows with a missing numeric feature are left out of the trees.
+
+Classes:
+   NeighbourIndex -- KD-trees over the scaled features for one match/weights setting.
+   DiamondNeighbourSearch -- Builds and caches NeighbourIndex instances per query setting.
+
+Functions:
+   load_neighbour_search -- Builds the search engine from a dataset file.
+"""
+
+CATEGORICAL_ATTRIBUTES = ('cut', 'color', 'clarity')
+
+
+class NeighbourIndex:
+   """
+   KD-trees over weighted, standardized numeric features, one per categorical partition.
+
+   The distance between two diamonds is sqrt(sum(w_f * ((a_f - b_f) / std_f) ** 2))
+   over the weighted features f.
+
+   Parameters:
+   catalog (CompactCatalog): The catalog.
+   match (tuple): Categorical attributes a neighbour must share with the query.
+   weights (dict): Weight of each numeric feature used in the distance.
+   mean (np.ndarray): Catalog mean of each numeric feature, in NUMERIC_FEATURES order.
+   std (np.ndarray): Catalog standard deviation of each numeric feature.
+   """
+
+   def __init__(self, catalog, match, weights, mean, std):
+      self.match = tuple(match)
+      self.features = [feature for feature in NUMERIC_FEATURES if weights.get(feature, 0) > 0]
+      if not self.features:
+         raise ValueError('At least one numeric feature needs a positive weight.')
+
+      columns = [NUMERIC_FEATURES.index(feature) for feature in self.features]
+      self.mean = mean[columns]
+      self.scale = np.sqrt([weights[feature] for feature in self.features]) / std[columns]
+
+      points = np.column_stack([catalog.column(feature) for feature in self.features]).astype(np.float64)
+      points = (points - self.mean) * self.scale
+      finite = np.isfinite(points).all(axis=1)
+
+      self.partitions = {}
+      for key, positions in catalog.group_positions(self.match).items():
+         positions = positions[finite[positions]]
+         if len(positions):
+            self.partitions[key] = (cKDTree(points[positions]), positions)
+
+   def query(self, query, n=5, radius=None):
+      """
+      Find the nearest diamonds of the query's partition.
+
+      Parameters:
+      query (dict): Values of the weighted features and of the matched attributes.
+      n (int): Maximum number of diamonds to return; None returns every diamond within radius.
+      radius (float): If given, only return diamonds within this distance.
+
+      Returns:
+      tuple: Row positions in the catalog and their distances, closest first,
+      or None if no diamond shares the matched attributes.
+      """
+      missing = [key for key in self.features + list(self.match) if key not in query]
+      if missing:
+         raise ValueError(f"Missing query attributes: {missing}")
+
+      partition = self.partitions.get(tuple(query[attribute] for attribute in self.match))
+      if partition is None:
+         return None
+      tree, positions = partition
+
+      point = (np.array([query[feature] for feature in self.features], dtype=np.float64) - self.mean) * self.scale
+
+      if n is None:
+         if radius is None:
+            raise ValueError('Either n or radius is required.')
+         hits = np.array(tree.query_ball_point(point, radius), dtype=np.intp)
+         distances = np.sqrt(((tree.data[hits] - point) ** 2).sum(axis=1))
+         order = np.lexsort((hits, distances))
+         return positions[hits[order]], distances[order]
+
+      n = min(n, tree.n)
+      if n <= 0:
+         return positions[:0], np.empty(0)
+
+      if radius is None:
+         distances, hits = tree.query(point, k=n)
+      else:
+         # distance_upper_bound is exclusive, query_ball_point is inclusive: align on inclusive
+         distances, hits = tree.query(point, k=n, distance_upper_bound=np.nextafter(radius, np.inf))
+         distances, hits = np.atleast_1d(distances), np.atleast_1d(hits)
+         found = np.isfinite(distances)
+         distances, hits = distances[found], hits[found]
+
+      return positions[np.atleast_1d(hits)], np.atleast_1d(distances)
+
+
+class DiamondNeighbourSearch:
+   """
+   Nearest-neighbour search over the catalog with configurable weights and relaxation.
+
+   A NeighbourIndex is built lazily for each (match, weights) setting and the
+   most recently used ones are kept, so repeated settings reuse their trees.
+
+   Parameters:
+   catalog (CompactCatalog or pd.DataFrame): The catalog.
+   max_indexes (int): Number of NeighbourIndex instances kept in memory.
+   """
+
+   def __init__(self, catalog, max_indexes=8):
+      self.catalog = catalog if isinstance(catalog, CompactCatalog) else CompactCatalog.from_frame(catalog)
+      values = np.column_stack([self.catalog.column(feature) for feature in NUMERIC_FEATURES]).astype(np.float64)
+      self.mean = np.nanmean(values, axis=0)
+      self.std = np.nanstd(values, axis=0)
+      self.std[self.std == 0] = 1.0
+
+      self.max_indexes = max_indexes
+      self._indexes = OrderedDict()
+      self._lock = threading.Lock()
+
+   def get_index(self, match=CATEGORICAL_ATTRIBUTES, weights=None):
+      """
+      Return the index for a match/weights setting, building it if needed.
+
+      Parameters:
+      match (tuple): Categorical attributes a neighbour must share with the query.
+      weights (dict): Weight of each numeric feature; defaults to 1 for every feature.
+
+      Returns:
+      NeighbourIndex: The index for this setting.
+      """
+      unknown = set(match) - set(CATEGORICAL_ATTRIBUTES)
+      if unknown:
+         raise ValueError(f"Unknown match attributes: {sorted(unknown)}")
+      weights = weights if weights is not None else dict.fromkeys(NUMERIC_FEATURES, 1.0)
+      unknown = set(weights) - set(NUMERIC_FEATURES)
+      if unknown:
+         raise ValueError(f"Unknown weighted features: {sorted(unknown)}")
+
+      key = (tuple(attribute for attribute in CATEGORICAL_ATTRIBUTES if attribute in match),
+             tuple((feature, float(weights[feature])) for feature in NUMERIC_FEATURES if weights.get(feature, 0) > 0))
+
+      with self._lock:
+         index = self._indexes.get(key)
+         if index is not None:
+            self._indexes.move_to_end(key)
+            return index
+
+      index = NeighbourIndex(self.catalog, key[0], dict(key[1]), self.mean, self.std)
+
+      with self._lock:
+         self._indexes[key] = index
+         while len(self._indexes) > self.max_indexes:
+            self._indexes.popitem(last=False)
+      return index
+
+   def query(self, query, n=5, radius=None, match=CATEGORICAL_ATTRIBUTES, weights=None):
+      """
+      Return the nearest diamonds with their distance to the query.
+
+      Parameters:
+      query (dict): Values of the weighted features and of the matched attributes.
+      n (int): Maximum number of diamonds to return; None returns every diamond within radius.
+      radius (float): If given, only return diamonds within this distance.
+      match (tuple): Categorical attributes a neighbour must share with the query.
+      weights (dict): Weight of each numeric feature; defaults to 1 for every feature.
+
+      Returns:
+      pd.DataFrame: The nearest diamonds indexed by row position, with a 'distance' column,
+      closest first, or None if no diamond shares the matched attributes.
+      """
+      result = self.get_index(match, weights).query(query, n, radius)
+      if result is None:
+         return None
+      positions, distances = result
+      return self.catalog.take(positions).assign(distance=distances)
+
+
+def load_neighbour_search(data_path):
+   """
+   Build the nearest-neighbour search engine from a dataset file.
+
+   Parameters:
+   data_path (str): Path to the dataset CSV file.
+
+   Returns:
+   DiamondNeighbourSearch: The search engine over the compact catalog of the dataset.
+   """
+   return DiamondNeighbourSearch(load_catalog(data_path))
@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from data_preprocessing import load_data, split_valid_rows
+from evaluate_model import evaluate_model
+from models_registry import model_registry, dynamic_import
+
+"""
+Data Preprocessing Tests
+
+Checks which API rows split_valid_rows accepts and the error reported for the
+others, and that loading the dataset through its cache trains the same models.
+"""
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data', 'diamonds.csv')
+
+ROW = {'carat': 0.7, 'cut': 'Ideal', 'color': 'G', 'clarity': 'VS2', 'depth': 61.8, 'table': 57.0, 'x': 5.7, 'y': 5.72, 'z': 3.53}
+
+
+def test_valid_rows_are_cast_to_float():
+   valid_df, errors = split_valid_rows(pd.DataFrame([ROW, dict(ROW, carat='1.5')]))
+   assert errors.isna().all()
+   assert valid_df['carat'].tolist() == [0.7, 1.5]
+
+
+@pytest.mark.parametrize('value', [None, 'a', float('nan'), float('inf'), '-inf', 'Infinity', '1e400', True, False])
+def test_invalid_numbers_are_rejected(value):
+   valid_df, errors = split_valid_rows(pd.DataFrame([dict(ROW, carat=value)]))
+   assert valid_df.empty
+   assert errors.iloc[0] == "Feature 'carat' must be a number."
+
+
+def test_booleans_are_rejected_among_numbers():
+   valid_df, errors = split_valid_rows(pd.DataFrame([dict(ROW, depth=True), ROW, dict(ROW, depth=np.inf)]))
+   assert valid_df.index.tolist() == [1]
+   assert errors.notna().tolist() == [True, False, True]
+
+
+def test_unknown_category_and_zero_dimension_are_rejected():
+   valid_df, errors = split_valid_rows(pd.DataFrame([dict(ROW, cut='Excellent'), dict(ROW, z=0), dict(ROW, x=None)]))
+   assert valid_df.empty
+   assert errors.iloc[0].startswith("Feature 'cut' must be one of")
+   assert errors.iloc[1] == "Features 'x', 'y' and 'z' must be non-zero."
+   assert errors.iloc[2] == "Feature 'x' must be a number."
+
+
+def test_missing_feature_is_reported():
+   row = dict(ROW)
+   del row['table']
+   valid_df, errors = split_valid_rows(pd.DataFrame([row]))
+   assert valid_df.empty
+   assert errors.iloc[0] == "Missing feature 'table'."
+
+
+@pytest.mark.parametrize('model_name', list(model_registry))
+def test_cached_load_trains_like_the_csv(model_name, tmp_path, monkeypatch):
+   monkeypatch.setenv('DATASET_CACHE_DIR', str(tmp_path))
+   model_details = model_registry[model_name]
+   preprocess_fn = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+   train_fn = dynamic_import(model_details['train_module'], model_details['train_function'])
+
+   r2 = {}
+   for use_cache in (False, True):
+      model, x_test, y_test = train_fn(preprocess_fn(load_data(DATA_PATH, use_cache=use_cache)), n_jobs=1)
+      r2[use_cache] = evaluate_model(model, x_test, y_test, model_details['log_transform'])[1]
+   assert os.listdir(tmp_path)
+   assert r2[True] == r2[False]
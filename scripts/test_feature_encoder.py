@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+from data_preprocessing import linear_model_preprocess, xg_boost_preprocess, CUT_CATEGORIES, COLOR_CATEGORIES, CLARITY_CATEGORIES
+from feature_encoder import FeatureEncoder, build_feature_encoders
+
+"""
+Feature Encoder Tests
+
+Checks that FeatureEncoder.transform produces the same feature matrix, with
+the same columns in the same order, as the preprocess functions the models
+are trained with.
+"""
+
+PREPROCESS_FUNCTIONS = {'linear': linear_model_preprocess, 'xgboost': xg_boost_preprocess}
+
+ROWS = [
+   {'carat': 0.23, 'cut': 'Ideal', 'color': 'E', 'clarity': 'SI2', 'depth': 61.5, 'table': 55.0, 'x': 3.95, 'y': 3.98, 'z': 2.43},
+   {'carat': 1.01, 'cut': 'Fair', 'color': 'J', 'clarity': 'I1', 'depth': 64.9, 'table': 58.0, 'x': 6.29, 'y': 6.21, 'z': 4.06},
+   {'carat': 0.7, 'cut': 'Very Good', 'color': 'D', 'clarity': 'IF', 'depth': 62.1, 'table': 57.0, 'x': 5.68, 'y': 5.72, 'z': 3.54},
+   {'carat': 2.5, 'cut': 'Premium', 'color': 'G', 'clarity': 'VVS1', 'depth': 60.3, 'table': 59.0, 'x': 8.71, 'y': 8.66, 'z': 5.24}
+]
+
+# Categories the preprocess functions do not know: every one-hot column of the feature stays 0
+UNKNOWN_ROW = {'carat': 0.5, 'cut': 'Excellent', 'color': 'K', 'clarity': 'SI3', 'depth': 61.0, 'table': 56.0, 'x': 5.1, 'y': 5.1, 'z': 3.1}
+
+
+def expected_features(model_name, rows):
+   """
+   Encode rows with the training preprocessing of a model.
+
+   Parameters:
+   model_name (str): The registry name of the model.
+   rows (list): The raw records.
+
+   Returns:
+   pd.DataFrame: The preprocessed features, without 'price'.
+   """
+   df = pd.DataFrame([dict(row, price=1) for row in rows])
+   return PREPROCESS_FUNCTIONS[model_name](df).drop(columns='price')
+
+
+def assert_same_features(model_name, rows):
+   expected = expected_features(model_name, rows)
+   encoder = build_feature_encoders()[model_name]
+
+   assert encoder.columns == list(expected.columns)
+   for records in (rows, pd.DataFrame(rows)):
+      np.testing.assert_array_equal(encoder.transform(records), expected.to_numpy(dtype=np.float32))
+      frame = encoder.transform(records, as_frame=True)
+      assert list(frame.columns) == list(expected.columns)
+
+
+@pytest.mark.parametrize('model_name', PREPROCESS_FUNCTIONS)
+def test_single_row(model_name):
+   assert_same_features(model_name, ROWS[:1])
+
+
+@pytest.mark.parametrize('model_name', PREPROCESS_FUNCTIONS)
+def test_batch(model_name):
+   assert_same_features(model_name, ROWS)
+
+
+@pytest.mark.parametrize('model_name', PREPROCESS_FUNCTIONS)
+def test_unknown_categories_single_row(model_name):
+   assert_same_features(model_name, [UNKNOWN_ROW])
+
+
+@pytest.mark.parametrize('model_name', PREPROCESS_FUNCTIONS)
+def test_unknown_categories_in_batch(model_name):
+   assert_same_features(model_name, ROWS + [UNKNOWN_ROW])
+
+
+@pytest.mark.parametrize('model_name', PREPROCESS_FUNCTIONS)
+def test_batch_with_rare_categories(model_name):
+   # A single grade per feature: the batch preprocessing still emits every one-hot column
+   rows = [dict(ROWS[0], cut='Good', color='I', clarity='VS1') for _ in range(3)]
+   assert_same_features(model_name, rows)
+
+
+@pytest.mark.parametrize('model_name', PREPROCESS_FUNCTIONS)
+def test_every_category(model_name):
+   rows = [dict(ROWS[0], cut=cut, color=color, clarity=clarity)
+           for cut, color, clarity in zip(CUT_CATEGORIES * 2, COLOR_CATEGORIES + COLOR_CATEGORIES[:3], CLARITY_CATEGORIES + CLARITY_CATEGORIES[:2])]
+   assert_same_features(model_name, rows)
+
+
+@pytest.mark.parametrize('model_name', PREPROCESS_FUNCTIONS)
+def test_column_order_of_the_input_does_not_matter(model_name):
+   rows = [dict(reversed(list(row.items()))) for row in ROWS]
+   assert_same_features(model_name, rows)
+
+
+def test_column_order_follows_the_encoder_columns():
+   columns = ['clarity_IF', 'carat', 'cut_Ideal', 'z']
+   features = FeatureEncoder(columns).transform(ROWS[:2])
+   np.testing.assert_array_equal(features, np.array([[0, 0.23, 1, 2.43], [0, 1.01, 0, 4.06]], dtype=np.float32))
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pytest
+from data_preprocessing import load_data
+from feature_encoder import build_feature_encoders
+from inference import build_backend, ModelBackend
+from models_registry import model_registry, dynamic_import
+
+"""
+Inference Tests
+
+Checks that the feature encoder with the fast inference backends, on the
+trained models and on their exports, predicts the same prices as the path the
+models are trained and evaluated with: the preprocess function of the registry
+entry, then model.predict with the log transform reversed.
+"""
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data', 'diamonds.csv')
+# The linear backend computes in float64 where sklearn computes on the float32 input: about 2e-6 apart
+RTOL = 1e-5
+
+
+@pytest.fixture(scope='module')
+def dataset():
+   return load_data(DATA_PATH)
+
+
+@pytest.fixture(scope='module')
+def trained_models(dataset):
+   models = {}
+   for model_name, model_details in model_registry.items():
+      preprocess_fn = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+      train_fn = dynamic_import(model_details['train_module'], model_details['train_function'])
+      models[model_name], _, _ = train_fn(preprocess_fn(dataset), n_jobs=1)
+   return models
+
+
+@pytest.fixture(scope='module')
+def records(dataset):
+   # Every row the preprocess functions keep, with the grades as plain strings like in API requests
+   return dataset[(dataset.x * dataset.y * dataset.z != 0) & (dataset.price > 0)].astype({'cut': object, 'color': object, 'clarity': object})
+
+
+@pytest.fixture(scope='module')
+def rows(records):
+   return records.drop(columns='price')
+
+
+def reference_predictions(model, model_name, records):
+   """
+   Predict with the training path: the preprocess function of the model, then model.predict.
+
+   Parameters:
+   model (sklearn model): The trained model.
+   model_name (str): The registry name of the model.
+   records (pd.DataFrame): The raw rows, with their price.
+
+   Returns:
+   np.ndarray: The predicted prices.
+   """
+   model_details = model_registry[model_name]
+   preprocess_fn = dynamic_import(model_details['preprocess_module'], model_details['preprocess_function'])
+   features = preprocess_fn(records)
+   assert len(features) == len(records)
+   predictions = model.predict(features.drop(columns='price'))
+   return np.exp(predictions) if model_details['log_transform'] else predictions
+
+
+def backend_predictions(backend, model_name, rows):
+   encoder = build_feature_encoders()[model_name]
+   return backend.predict(encoder.transform(rows, as_frame=backend.as_frame))
+
+
+@pytest.mark.parametrize('model_name', list(model_registry))
+def test_fast_backend_matches_predict(model_name, trained_models, records, rows):
+   model = trained_models[model_name]
+   backend = build_backend(model, model_name)
+   assert not isinstance(backend, ModelBackend)
+
+   expected = reference_predictions(model, model_name, records)
+   np.testing.assert_allclose(backend_predictions(backend, model_name, rows), expected, rtol=RTOL)
+   # A single row goes through the single-row branch of the preprocess functions
+   np.testing.assert_allclose(backend_predictions(backend, model_name, rows.iloc[:1]),
+                              reference_predictions(model, model_name, records.iloc[:1]), rtol=RTOL)
+
+
+@pytest.mark.parametrize('model_name', list(model_registry))
+def test_model_backend_matches_predict(model_name, trained_models, records, rows):
+   model = trained_models[model_name]
+   backend = build_backend(model, model_name, fast=False)
+   assert isinstance(backend, ModelBackend)
+   np.testing.assert_allclose(backend_predictions(backend, model_name, rows), reference_predictions(model, model_name, records), rtol=RTOL)
+
+
+@pytest.mark.parametrize('model_name', [name for name, details in model_registry.items() if 'export_function' in details])
+def test_exported_model_matches_predict(model_name, trained_models, records, rows, tmp_path):
+   model = trained_models[model_name]
+   model_details = model_registry[model_name]
+   export_fn = dynamic_import(model_details['export_module'], model_details['export_function'])
+   load_fn = dynamic_import(model_details['export_module'], model_details['export_load_function'])
+   exported = load_fn(str(tmp_path), export_fn(model, str(tmp_path)))
+
+   expected = reference_predictions(model, model_name, records)
+   np.testing.assert_allclose(backend_predictions(build_backend(exported, model_name), model_name, rows), expected, rtol=RTOL)
+   np.testing.assert_allclose(backend_predictions(build_backend(exported, model_name, fast=False), model_name, rows), expected, rtol=RTOL)
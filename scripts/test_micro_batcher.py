@@ -0,0 +1,51 @@
+import threading
+import pytest
+from micro_batcher import MicroBatcher
+
+"""
+Micro Batcher Tests
+
+Checks that every caller gets a result or an error, whatever the batch
+function returns, and that a caller can stop waiting.
+"""
+
+
+def start_batcher(batch_function):
+   batcher = MicroBatcher(batch_function, max_wait_ms=1, max_batch_size=8)
+   batcher.start()
+   return batcher
+
+
+def test_results_go_to_their_caller():
+   batcher = start_batcher(lambda items: [item * 2 for item in items])
+   assert [batcher.submit(item, timeout=5) for item in range(3)] == [0, 2, 4]
+
+
+def test_missing_results_fail_the_batch():
+   batcher = start_batcher(lambda items: [item * 2 for item in items][:-1])
+   with pytest.raises(ValueError, match='results for a batch'):
+      batcher.submit(1, timeout=5)
+   assert batcher.stats()['errors'] == 1
+
+
+def test_batch_function_error_reaches_every_caller():
+   def failing(items):
+      raise RuntimeError('model failed')
+
+   batcher = start_batcher(failing)
+   with pytest.raises(RuntimeError, match='model failed'):
+      batcher.submit(1, timeout=5)
+
+
+def test_caller_times_out_and_batcher_keeps_going():
+   release = threading.Event()
+
+   def blocking(items):
+      release.wait()
+      return items
+
+   batcher = start_batcher(blocking)
+   with pytest.raises(TimeoutError):
+      batcher.submit(1, timeout=0.05)
+   release.set()
+   assert batcher.submit(2, timeout=5) == 2
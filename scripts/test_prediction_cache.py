@@ -0,0 +1,41 @@
+import pandas as pd
+from prediction_cache import PredictionCache
+
+"""
+Prediction Cache Tests
+
+Checks that requests still running on a replaced model cannot evict the
+entries of the new one.
+"""
+
+NUMERIC = ['carat']
+CATEGORICAL = ['cut']
+ROWS = pd.DataFrame({'carat': [0.5, 1.0], 'cut': ['Ideal', 'Good']})
+
+
+def test_versions_do_not_evict_each_other():
+   cache = PredictionCache()
+   old_keys = cache.make_keys('v1', ROWS, NUMERIC, CATEGORICAL)
+   new_keys = cache.make_keys('v2', ROWS, NUMERIC, CATEGORICAL)
+   cache.put_many('v1', old_keys, [1.0, 2.0])
+   cache.put_many('v2', new_keys, [3.0, 4.0])
+
+   assert cache.get_many('v1', old_keys) == [1.0, 2.0]
+   assert cache.get_many('v2', new_keys) == [3.0, 4.0]
+   assert cache.stats()['invalidations'] == 0
+
+
+def test_retired_version_is_dropped_and_not_stored_again():
+   cache = PredictionCache()
+   old_keys = cache.make_keys('v1', ROWS, NUMERIC, CATEGORICAL)
+   new_keys = cache.make_keys('v2', ROWS, NUMERIC, CATEGORICAL)
+   cache.put_many('v1', old_keys, [1.0, 2.0])
+   cache.put_many('v2', new_keys, [3.0, 4.0])
+
+   cache.retire_versions('v2')
+   # A request that started on v1 finishes after the swap
+   cache.put_many('v1', old_keys, [1.0, 2.0])
+
+   assert cache.get_many('v1', old_keys) == [None, None]
+   assert cache.get_many('v2', new_keys) == [3.0, 4.0]
+   assert cache.stats()['size'] == 2
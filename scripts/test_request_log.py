@@ -0,0 +1,31 @@
+import os
+import sqlite3
+import time
+from request_log import RequestLogWriter, init_db
+
+"""
+Request Log Tests
+
+Checks that the batched writer records when each request was logged, not
+when its batch was flushed.
+"""
+
+
+def test_entries_keep_their_request_time(tmp_path):
+   db_path = os.path.join(tmp_path, 'requests.db')
+   init_db(db_path)
+   writer = RequestLogWriter(db_path, batch_size=100, flush_interval=60)
+   writer.start()
+   writer.log('/predict', {'carat': 0.5}, {'predictions': [1000.0]})
+   time.sleep(1.1)
+   writer.log('/predict', {'carat': 0.6}, {'predictions': [1100.0]})
+   assert writer.flush(timeout=5)
+   writer.stop()
+
+   conn = sqlite3.connect(db_path)
+   timestamps = [row[0] for row in conn.execute('SELECT timestamp FROM requests ORDER BY id')]
+   flushed_at = conn.execute('SELECT CURRENT_TIMESTAMP').fetchone()[0]
+   conn.close()
+   assert len(timestamps) == 2
+   # Written in one batch, logged a second apart
+   assert timestamps[0] < timestamps[1] <= flushed_at
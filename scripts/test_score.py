@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import score
+from data_preprocessing import load_data, linear_model_preprocess
+from feature_encoder import build_feature_encoders
+from inference import build_backend
+from train_model import train_linear_model
+
+"""
+Batch Scoring Tests
+
+Checks that score_chunk flags the rows the training preprocessing drops,
+including the rows whose price is missing or not a number.
+"""
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data', 'diamonds.csv')
+
+ROW = {'carat': 0.7, 'cut': 'Ideal', 'color': 'G', 'clarity': 'VS2', 'depth': 61.8, 'table': 57.0, 'x': 5.7, 'y': 5.72, 'z': 3.53}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def scorer():
+   model, _, _ = train_linear_model(linear_model_preprocess(load_data(DATA_PATH)), n_jobs=1)
+   score._scorer = score.Scorer('linear', 'test', build_feature_encoders()['linear'], build_backend(model, 'linear'))
+   yield
+   score._scorer = None
+
+
+def test_rows_without_a_positive_price_are_flagged():
+   prices = [1000, None, 'n/a', 0, -5]
+   chunk = pd.DataFrame([dict(ROW, price=price) for price in prices])
+   scored, _, n_rows, n_invalid = score.score_chunk(chunk)
+
+   assert n_rows == 5 and n_invalid == 4
+   assert np.isfinite(scored['predicted_price'][0]) and pd.isna(scored['error'][0])
+   assert scored['predicted_price'][1:].isna().all()
+   assert (scored['error'][1:] == "Feature 'price' must be a positive number.").all()
+
+
+def test_invalid_price_rows_are_skipped():
+   chunk = pd.DataFrame([dict(ROW, price=price) for price in [None, 1000, 'n/a']])
+   scored, columns, _, n_invalid = score.score_chunk(chunk, skip_invalid=True)
+   assert n_invalid == 2
+   assert len(scored) == 1 and 'error' not in columns
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from similarity_index import SimilarDiamondsIndex
+
+"""
+Similarity Index Tests
+
+Checks that SimilarDiamondsIndex returns the diamonds the original pandas
+implementation of /get_similar_diamonds returned: the group filtered by cut,
+color and clarity, then `nsmallest` on the weight difference.
+"""
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'data', 'diamonds.csv')
+
+
+def baseline_positions(df, cut, color, clarity, weight, n):
+   """
+   Find the similar diamonds like the API did before the index.
+
+   Parameters:
+   df (pd.DataFrame): The dataset.
+   cut (str): Cut of the diamond.
+   color (str): Color of the diamond.
+   clarity (str): Clarity of the diamond.
+   weight (float): Weight in carats to compare to.
+   n (int): Number of diamonds to return.
+
+   Returns:
+   tuple: Row positions, closest first, and the size of the group.
+   """
+   filtered_data = df[(df['cut'] == cut) & (df['color'] == color) & (df['clarity'] == clarity)].copy()
+   filtered_data['weight_diff'] = (filtered_data['carat'] - weight).abs()
+   return filtered_data.nsmallest(n, 'weight_diff').index.to_numpy(), len(filtered_data)
+
+
+def assert_same_diamonds(df, index, cut, color, clarity, weight, n):
+   expected, group_size = baseline_positions(df, cut, color, clarity, weight, n)
+   positions = index.query_positions(cut, color, clarity, weight, n)
+   if n < group_size:
+      np.testing.assert_array_equal(positions, expected)
+   else:
+      # nsmallest sorts the whole group with an unstable sort: ties come in any order
+      assert sorted(positions) == sorted(expected)
+      diffs = (df['carat'] - weight).abs()
+      np.testing.assert_array_equal(diffs[positions].to_numpy(), diffs[expected].to_numpy())
+
+
+@pytest.fixture(scope='module')
+def dataset():
+   return pd.read_csv(DATA_PATH)
+
+
+def test_matches_nsmallest_on_the_dataset(dataset):
+   index = SimilarDiamondsIndex(dataset)
+   rng = np.random.default_rng(0)
+   for position in rng.integers(0, len(dataset), 500):
+      row = dataset.iloc[position]
+      # The weight of an existing diamond is tied with its duplicates, a rounded one with its neighbours
+      weight = float(row['carat']) if rng.random() < 0.5 else round(rng.uniform(0.2, 3), 2)
+      assert_same_diamonds(dataset, index, row['cut'], row['color'], row['clarity'], weight, int(rng.integers(1, 30)))
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4, 5, 7, 8])
+def test_tied_carats_resolve_by_position(n):
+   # 0.25 and 0.75 are exactly 0.25 away from 0.5, and 0.75 and 0.5 appear several times
+   carats = [0.75, 0.25, 0.5, 0.75, 1.0, 0.25, 0.5, 0.75]
+   df = pd.DataFrame({'carat': carats, 'cut': 'Ideal', 'color': 'G', 'clarity': 'VS2',
+                      'depth': 61.5, 'table': 57.0, 'price': 1000, 'x': 5.0, 'y': 5.0, 'z': 3.0})
+   assert_same_diamonds(df, SimilarDiamondsIndex(df), 'Ideal', 'G', 'VS2', 0.5, n)
+   if n < len(df):
+      assert list(SimilarDiamondsIndex(df).query_positions('Ideal', 'G', 'VS2', 0.5, n)) == [2, 6, 0, 1, 3, 5, 7][:n]
+
+
+def test_unknown_group():
+   df = pd.DataFrame({'carat': [0.5], 'cut': 'Ideal', 'color': 'G', 'clarity': 'VS2',
+                      'depth': 61.5, 'table': 57.0, 'price': 1000, 'x': 5.0, 'y': 5.0, 'z': 3.0})
+   assert SimilarDiamondsIndex(df).query_positions('Fair', 'G', 'VS2', 0.5, 5) is None
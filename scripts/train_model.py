@@ -2,13 +2,18 @@ from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LinearRegression
 import xgboost
 import numpy as np
+import pandas as pd
 
-def train_linear_model(df):
+# Seed of the train/test split: runs on the same data are evaluated on the same test rows
+SPLIT_SEED = 42
+
+def train_linear_model(df, n_jobs=None):
    """
    Train a linear regression model.
 
    Parameters:
    df (pd.DataFrame): The dataframe containing features and target variable.
+   n_jobs (int): Number of threads used for fitting (None for the library default).
 
    Returns:
    tuple: A tuple containing the trained model, test features, and test target variable.
@@ -19,22 +24,24 @@ def train_linear_model(df):
    y = df.price
 
    # Split the data into training and testing sets
-   x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=0.2, random_state=42)
+   x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=0.2, random_state=SPLIT_SEED)
    
    y_train = np.log(y_train)
 
    # Define and train the model
-   model = LinearRegression()
+   model = LinearRegression(n_jobs=n_jobs)
    model.fit(x_train, y_train)
     
    return model, x_test, y_test
 
-def train_xgboost_model(df):
+def train_xgboost_model(df, n_jobs=None, params=None):
    """
    Train an XGBoost regression model.
 
    Parameters:
    df (pd.DataFrame): The dataframe containing features and target variable.
+   n_jobs (int): Number of threads used for fitting (None for all cores).
+   params (dict): Hyperparameters of the model (None for the library defaults).
 
    Returns:
    tuple: A tuple containing the trained model, test features, and test target variable.
@@ -45,10 +52,55 @@ def train_xgboost_model(df):
    y = df.price
 
    # Split the data into training and testing sets
-   x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=0.2, random_state=42)
+   x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=0.2, random_state=SPLIT_SEED)
    
-   model = xgboost.XGBRegressor(enable_categorical=True, random_state=42)
+   model = xgboost.XGBRegressor(enable_categorical=True, random_state=42, n_jobs=n_jobs, **(params or {}))
    model.fit(x_train, y_train)
     
    return model, x_test, y_test
 
+
+def update_xgboost_model(model, df, segments, n_jobs=None, n_rounds=10):
+   """
+   Continue boosting a trained XGBoost model on the rows appended to the data since it was trained.
+
+   The rows of each training run are split like in train_xgboost_model,
+   which reproduces the test rows of the earlier runs: the new trees are
+   fitted on the training split of the appended rows, and the model is
+   evaluated on the test splits of every run, none of which it was fitted on.
+
+   Parameters:
+   model (xgboost.XGBRegressor): The trained model.
+   df (pd.DataFrame): The whole preprocessed dataframe, indexed by row position in the data file.
+   segments (list): Row positions where the data of each earlier training run ended, the last one
+   being the rows the model was trained on.
+   n_jobs (int): Number of threads used for fitting (None for all cores).
+   n_rounds (int): Number of boosting rounds added to the model.
+
+   Returns:
+   tuple: A tuple containing the updated model, test features, and test target variable.
+   """
+
+   x = df.drop(columns='price')
+   y = df.price
+
+   x_tests, y_tests = [], []
+   bounds = [0] + list(segments) + [np.inf]
+   for start, end in zip(bounds[:-1], bounds[1:]):
+      rows = (df.index >= start) & (df.index < end)
+      if rows.sum() < 2:
+         # Too few rows to split, they are only trained on
+         x_train, y_train = x[rows], y[rows]
+         continue
+      x_train, x_test, y_train, y_test = train_test_split(x[rows], y[rows], test_size=0.2, random_state=SPLIT_SEED)
+      x_tests.append(x_test)
+      y_tests.append(y_test)
+
+   # The training split of the last segment holds the appended rows
+   if len(x_train):
+      # Same hyperparameters as the model, with only the added rounds to fit
+      booster = model.get_booster()
+      model = xgboost.XGBRegressor(**dict(model.get_params(), n_estimators=n_rounds, n_jobs=n_jobs))
+      model.fit(x_train, y_train, xgb_model=booster)
+
+   return model, pd.concat(x_tests), pd.concat(y_tests)
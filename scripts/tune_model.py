@@ -0,0 +1,182 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from sklearn.model_selection import train_test_split
+import xgboost
+
+"""
+Model Tuning
+
+This module searches the XGBoost hyperparameters with successive halving.
+Random configurations are trained on a small budget of boosting rounds, only
+the best third moves on to a budget three times larger, and so on until one
+configuration is left. Every trial uses early stopping on a validation split
+and trials run in parallel in a process pool.
+
+Functions:
+   tune_xgboost_model -- Runs the search and returns the best parameters.
+   save_tuned_params -- Records the tuned parameters of a model type.
+   load_tuned_params -- Reads the tuned parameters of a model type.
+"""
+
+# Data of the running search, set once per worker process
+_trial_data = None
+
+
+def get_project_root():
+   """
+   Get the project root directory.
+   """
+   current_dir = os.path.dirname(os.path.abspath(__file__))
+   return os.path.abspath(os.path.join(current_dir, os.pardir))
+
+def sample_xgboost_params(rng):
+   """
+   Sample a random XGBoost configuration.
+
+   Parameters:
+   rng (np.random.Generator): The random generator.
+
+   Returns:
+   dict: The sampled parameters.
+   """
+   return {
+      'max_depth': int(rng.integers(3, 11)),
+      'learning_rate': float(10 ** rng.uniform(-2, math.log10(0.3))),
+      'subsample': float(rng.uniform(0.5, 1.0)),
+      'colsample_bytree': float(rng.uniform(0.5, 1.0)),
+      'min_child_weight': float(10 ** rng.uniform(0, 1)),
+      'reg_lambda': float(10 ** rng.uniform(-3, 1)),
+      'reg_alpha': float(10 ** rng.uniform(-3, 1))
+   }
+
+def _init_trial_worker(data):
+   global _trial_data
+   _trial_data = data
+
+def _run_trial(params, n_rounds, early_stopping_rounds, n_jobs):
+   x_train, y_train, x_valid, y_valid = _trial_data
+   model = xgboost.XGBRegressor(enable_categorical=True, random_state=42, n_jobs=n_jobs,
+                                n_estimators=n_rounds, early_stopping_rounds=early_stopping_rounds,
+                                eval_metric='mae', **params)
+   model.fit(x_train, y_train, eval_set=[(x_valid, y_valid)], verbose=False)
+   return float(model.best_score), int(model.best_iteration) + 1
+
+def tune_xgboost_model(df, n_trials=27, min_rounds=50, max_rounds=1350, reduction_factor=3,
+                       early_stopping_rounds=20, workers=None, n_jobs=1, seed=42):
+   """
+   Search the XGBoost hyperparameters with successive halving.
+
+   The test split of train_xgboost_model is left out, and the remaining rows
+   are split again into a training and a validation set used for early
+   stopping and for ranking the configurations.
+
+   Parameters:
+   df (pd.DataFrame): The preprocessed dataframe containing features and target variable.
+   n_trials (int): Number of random configurations of the first rung.
+   min_rounds (int): Boosting rounds budget of the first rung.
+   max_rounds (int): Maximum boosting rounds budget of a rung.
+   reduction_factor (int): Fraction of configurations kept per rung, and budget growth.
+   early_stopping_rounds (int): Rounds without validation improvement that stop a trial.
+   workers (int): Number of trial processes (default: the CPU count).
+   n_jobs (int): Threads per trial.
+   seed (int): Seed of the configuration sampler.
+
+   Returns:
+   dict: The best parameters, their validation MAE and the search statistics.
+   """
+   x = df.drop(columns='price')
+   y = df.price
+   # Same split as train_xgboost_model, so the test set never drives the search
+   x_train, _, y_train, _ = train_test_split(x, y, test_size=0.2, random_state=42)
+   x_train, x_valid, y_train, y_valid = train_test_split(x_train, y_train, test_size=0.2, random_state=seed)
+
+   rng = np.random.default_rng(seed)
+   candidates = [sample_xgboost_params(rng) for _ in range(n_trials)]
+   workers = workers or os.cpu_count() or 1
+
+   start = time.perf_counter()
+   evaluations = 0
+   rungs = []
+   n_rounds = min_rounds
+
+   with ProcessPoolExecutor(max_workers=workers, initializer=_init_trial_worker,
+                            initargs=((x_train, y_train, x_valid, y_valid),)) as executor:
+      while True:
+         futures = [executor.submit(_run_trial, params, n_rounds, early_stopping_rounds, n_jobs) for params in candidates]
+         scores = [future.result() for future in futures]
+         evaluations += len(candidates)
+
+         ranking = sorted(range(len(candidates)), key=lambda i: scores[i][0])
+         rungs.append({'n_rounds': n_rounds, 'trials': len(candidates), 'best_mae': scores[ranking[0]][0]})
+         print(f"Rung {len(rungs)}: {len(candidates)} trials of up to {n_rounds} rounds, best validation MAE {scores[ranking[0]][0]:.2f}")
+
+         keep = max(1, len(candidates) // reduction_factor)
+         if len(candidates) == 1 or n_rounds >= max_rounds:
+            best_score, best_rounds = scores[ranking[0]]
+            best_params = dict(candidates[ranking[0]], n_estimators=best_rounds)
+            break
+         candidates = [candidates[i] for i in ranking[:keep]]
+         n_rounds = min(n_rounds * reduction_factor, max_rounds)
+
+   wall_time = time.perf_counter() - start
+   print(f"Tuning done: {evaluations} trials in {wall_time:.1f}s ({evaluations / wall_time:.2f} trials/s)")
+
+   return {
+      'params': best_params,
+      'validation_MAE': best_score,
+      'trials': evaluations,
+      'rungs': rungs,
+      'wall_time_s': wall_time,
+      'trials_per_s': evaluations / wall_time,
+      'workers': workers,
+      'n_jobs': n_jobs
+   }
+
+def save_tuned_params(model_type, tuning_result, tuned_params_path='models/tuned_params.json'):
+   """
+   Record the tuned parameters of a model type next to the metrics.
+
+   Parameters:
+   model_type (str): Type of the model (e.g., 'xgboost').
+   tuning_result (dict): The result returned by the tuning function.
+   tuned_params_path (str): Path of the tuned parameters file, relative to the project root.
+   """
+   tuned_params_path = os.path.join(get_project_root(), tuned_params_path)
+
+   if os.path.exists(tuned_params_path) and os.path.getsize(tuned_params_path) > 0:
+      with open(tuned_params_path, 'r') as f:
+         tuned_params = json.load(f)
+   else:
+      tuned_params = {}
+
+   tuned_params[model_type] = dict(tuning_result, tuning_date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+   tmp_path = f'{tuned_params_path}.tmp'
+   with open(tmp_path, 'w') as f:
+      json.dump(tuned_params, f, indent=4)
+   os.replace(tmp_path, tuned_params_path)
+
+def load_tuned_params(model_type, tuned_params_path='models/tuned_params.json'):
+   """
+   Read the tuned parameters of a model type.
+
+   Parameters:
+   model_type (str): Type of the model (e.g., 'xgboost').
+   tuned_params_path (str): Path of the tuned parameters file, relative to the project root.
+
+   Returns:
+   dict: The tuned parameters, or None if the model type was never tuned.
+   """
+   tuned_params_path = os.path.join(get_project_root(), tuned_params_path)
+
+   if not os.path.exists(tuned_params_path) or os.path.getsize(tuned_params_path) == 0:
+      return None
+   with open(tuned_params_path, 'r') as f:
+      tuned_params = json.load(f)
+   entry = tuned_params.get(model_type)
+   return entry['params'] if entry is not None else None